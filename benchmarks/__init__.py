@@ -0,0 +1 @@
+""" Benchmarks for the m5 package: run them with python -m benchmarks.<name>. """
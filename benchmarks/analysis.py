@@ -0,0 +1,66 @@
+""" Compare the usual statistics computed over ORM objects and over cached data frames, on 100k orders. """
+
+
+from collections import Counter, defaultdict
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Order, Checkin
+from m5.storage import connect, upgrade
+from m5.analysis import Frames, earnings, jobs_per_weekday, jobs_per_hour, clients
+from benchmarks.queries import ORDERS, populate
+
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return perf_counter() - start, result
+
+
+def with_orm(db):
+    monthly, per_client = defaultdict(float), defaultdict(float)
+    weekdays, hours = Counter(), Counter()
+
+    for order in db.query(Order):
+        monthly[order.date.strftime('%Y-%m')] += order.earnings
+        per_client[order.client_id] += order.earnings
+        weekdays[order.date.weekday()] += 1
+
+    first = dict()
+    for checkin in db.query(Checkin).filter(Checkin.purpose == 'pickup'):
+        if checkin.order_id not in first or checkin.timestamp < first[checkin.order_id]:
+            first[checkin.order_id] = checkin.timestamp
+    hours.update(timestamp.hour for timestamp in first.values())
+
+    db.expunge_all()
+    return monthly, per_client, weekdays, hours
+
+
+def with_frames(frames):
+    orders, checkins = frames.orders, frames.checkins
+    return earnings(orders), clients(orders), jobs_per_weekday(orders), jobs_per_hour(orders, checkins)
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        engine = connect('sqlite:///' + join(folder, 'bench.sqlite'))
+        upgrade(engine)
+        populate(engine)
+        db = sessionmaker(bind=engine)()
+
+        orm, (monthly, *_) = timed(with_orm, db)
+        cold, _ = timed(lambda: Frames(engine).orders)
+        warm, _ = timed(lambda: Frames(engine).orders)
+        frames = Frames(engine)
+        frames.orders
+        stats, (series, *_) = timed(with_frames, frames)
+
+        assert [round(v, 6) for v in series.tolist()] == [round(monthly[k], 6) for k in sorted(monthly)]
+
+        print('%s orders, %s checkins' % (ORDERS, 2 * ORDERS))
+        print('{:>36} {:8.3f} s'.format('statistics over ORM objects', orm))
+        print('{:>36} {:8.3f} s'.format('frames read from the database', cold))
+        print('{:>36} {:8.3f} s'.format('frames loaded from the cache', warm))
+        print('{:>36} {:8.3f} s'.format('statistics over the frames', stats))
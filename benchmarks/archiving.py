@@ -0,0 +1,83 @@
+""" Compare row-by-row and bulk archiving of synthetic jobs, on a first run and on a rerun. """
+
+
+from datetime import date, datetime, timedelta
+from functools import partial
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Client, Order, Checkpoint, Checkin
+from m5.pipeline import archive, bulk_archive, ArchivedKeys
+from m5.storage import upgrade
+
+
+JOBS = 2000
+BATCH = 64
+CLIENTS = 200
+CHECKPOINTS = 1500
+PRICES = ('city_tour', 'overnight', 'loading_service', 'fax_confirm',
+          'extra_stops', 'cancelled_stop', 'client_support', 'waiting_time')
+
+
+def job_rows(n):
+    day = date(2014, 1, 1) + timedelta(days=n // 10)
+    client_id = n % CLIENTS
+    rows = [Client(client_id=client_id, name='Client %s' % client_id),
+            Order(order_id=n, client_id=client_id, type='city_tour', date=day, uuid=n, user='bench',
+                  distance=1.5, cash=False, **dict.fromkeys(PRICES, 1.0))]
+
+    for stop, purpose in enumerate(('pickup', 'dropoff')):
+        address = 'Street %s, 10115 Berlin' % ((n * 7 + stop) % CHECKPOINTS)
+        rows.append(Checkpoint(checkpoint_id=address, as_scraped=address, lat=52.5, lon=13.4))
+        rows.append(Checkin(address=address, order_id=n, purpose=purpose,
+                            timestamp=datetime(day.year, day.month, day.day, 9 + stop),
+                            after_=None, until=None))
+
+    return rows
+
+
+def run(archiver, jobs, batched, keyed=False):
+    with TemporaryDirectory() as folder:
+        engine = create_engine('sqlite:///' + join(folder, 'bench.sqlite'))
+        upgrade(engine)
+        db = sessionmaker(autoflush=False, bind=engine)()
+
+        if keyed:
+            archiver = partial(archiver, keys=ArchivedKeys(db))
+
+        timings = []
+        for _ in range(2):
+            start = perf_counter()
+            if batched:
+                for i in range(0, len(jobs), BATCH):
+                    archiver(db, [row for rows in jobs[i:i + BATCH] for row in rows])
+            else:
+                for rows in jobs:
+                    archiver(db, rows)
+            timings.append(perf_counter() - start)
+
+        counts = [db.query(model).count() for model in (Client, Order, Checkpoint, Checkin)]
+        db.close()
+        engine.dispose()
+
+    return timings, counts
+
+
+if __name__ == '__main__':
+    jobs = [job_rows(n) for n in range(JOBS)]
+    print('%s jobs, %s rows, bulk batches of %s jobs' % (JOBS, sum(map(len, jobs)), BATCH))
+
+    (first, rerun), expected = run(archive, jobs, False)
+    print('{:>12} {:8.2f} s first run {:8.2f} s rerun'.format('row by row', first, rerun))
+
+    (bulk_first, bulk_rerun), counts = run(bulk_archive, jobs, True)
+    print('{:>12} {:8.2f} s first run {:8.2f} s rerun'.format('bulk', bulk_first, bulk_rerun))
+
+    (keyed_first, keyed_rerun), keyed_counts = run(bulk_archive, jobs, True, keyed=True)
+    print('{:>12} {:8.2f} s first run {:8.2f} s rerun'.format('bulk + keys', keyed_first, keyed_rerun))
+
+    assert counts == expected, (counts, expected)
+    assert keyed_counts == expected, (keyed_counts, expected)
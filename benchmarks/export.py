@@ -0,0 +1,58 @@
+""" Time exporting 100k orders and 200k checkins, appending to the export, and loading it against the ORM. """
+
+
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy.orm import sessionmaker
+import pandas  # imported up front, so that loading the export is timed alone
+
+from m5.model import Order, Checkin, Checkpoint
+from m5.storage import connect, upgrade
+from m5.export import export, frame
+from benchmarks.queries import ORDERS, populate
+
+
+NEW = 1000
+
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return perf_counter() - start, result
+
+
+def orm(db):
+    rows = {model: db.query(model).all() for model in (Order, Checkin, Checkpoint)}
+    db.expunge_all()
+    return rows
+
+
+def frames(folder):
+    return {name: frame(join(folder, name)) for name in ('orders', 'checkins', 'checkpoints')}
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        engine = connect('sqlite:///' + join(folder, 'bench.sqlite'))
+        upgrade(engine)
+        populate(engine)
+        db = sessionmaker(bind=engine)()
+        exports = join(folder, 'export')
+
+        full, counts = timed(export, db, exports)
+
+        with engine.begin() as connection:
+            connection.execute(Order.__table__.insert(), [
+                {'order_id': ORDERS + n, 'client_id': 0, 'type': 'city_tour', 'city_tour': 5.0}
+                for n in range(NEW)])
+        appended, new = timed(export, db, exports)
+        nothing, _ = timed(export, db, exports)
+
+        loaded, _ = timed(orm, db)
+        mapped, tables = timed(frames, exports)
+        assert len(tables['orders']) == ORDERS + NEW
+
+        print('%s rows exported in %.2f s' % (sum(counts.values()), full))
+        print('%s new rows appended in %.2f s, nothing new in %.2f s' % (sum(new.values()), appended, nothing))
+        print('load with the ORM %.2f s, memory map the export %.3f s' % (loaded, mapped))
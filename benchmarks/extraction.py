@@ -0,0 +1,158 @@
+""" Compare the compiled extraction plan with the former interpreter-style blueprint loop. """
+
+
+from re import search
+from glob import glob
+from os.path import join
+from timeit import repeat
+from datetime import date
+from warnings import simplefilter
+from logging import disable, warning, WARNING
+
+from m5.scraper import BLUEPRINTS, HTML, PRICE_CATEGORIES, PLAN, fix_unicode
+from m5.scraper import _select_fragments, _scrape_fragment, _scrape_prices, _report_failure
+from m5.settings import ASSETS_DIR, MOCK_DIRNAME
+from m5.spider import Stamp, Webpage
+
+
+FIXTURES = sorted(glob(join(ASSETS_DIR, '*-uuid-???????.html')) +
+                  glob(join(ASSETS_DIR, MOCK_DIRNAME, 'archive', '*.html')))
+
+REPEAT = 5
+NUMBER = 200
+STAMP = Stamp('bench', date.today(), '0000000')
+
+
+# The extraction loop as it was before the plan was compiled.
+
+def legacy_fix_unicode(original_text):
+    # This function is deprecated because web-pages are now correctly decoded into unicode.
+    # But there could still be a few in the cache that haven't. This is a really DIRTY FIX.
+    substitutions = [
+        ('Ã¼', 'ü'),
+        ('Ã¤', 'ä'),
+        ('Ã¶', 'ö'),
+        ('Ã©', 'é'),
+        ('â¬', '€'),
+        ('Ã', 'ß'),
+        ('Ã', 'Ö'),
+    ]
+
+    corrected_text = original_text
+    for bad, good in substitutions:
+        corrected_text = corrected_text.replace(bad, good)
+
+    return corrected_text
+
+
+def legacy_scrape_fragment(blueprints, fragment, stamp):
+    # Fields are ambiguously inserted in the markup.
+    # Fields may or may not be there.
+    # Fields may be bundled together inside a single tag.
+    # The number of fields inside a tag may vary.
+    # The number of lines for a single field may vary.
+    # The number of fields inside a single line may vary.
+
+    contents = list(fragment.stripped_strings)
+    collected = {}
+
+    # Sometimes addresses are formatted differently
+    case = 'variant' if 'Zusatz' in fragment.text else 'default'
+
+    for field, bp in blueprints.items():
+        try:
+            for line in bp['lines'][case]:
+                matched = bp['pattern'].match(contents[line])
+                if matched:
+                    raw_value = matched.group(1)
+                    collected[field] = legacy_fix_unicode(raw_value)
+                    break
+            else:
+                raise ValueError
+
+        except (IndexError, ValueError):
+            collected[field] = None
+            if not bp['optional']:
+                _report_failure(stamp, field, contents)
+
+    return collected
+
+
+def legacy_scrape_prices(fragment, stamp):
+    # This fragment is treated separately because it's a
+    # table with a whole bunch of possible price labels.
+    pattern = r'(\d+,\d{2})$'
+
+    cells = list(fragment.stripped_strings)
+    raw_price_table = list(zip(cells[::2], cells[1::2]))
+    price_table = {k: [] for k in PRICE_CATEGORIES.keys()}
+
+    for raw_label, raw_price in sorted(raw_price_table):
+        for category, category_synonyms in PRICE_CATEGORIES.items():
+            if raw_label in category_synonyms:
+                matched = search(pattern, raw_price)
+
+                if matched:
+                    price = matched.group(0)
+                else:
+                    price = None
+                    warning('Could not convert "%s" into a price', raw_price)
+
+                price_table[category].append(price)
+
+    if not any(price_table.values()):
+        _report_failure(stamp, 'prices', cells)
+
+    return price_table
+
+
+def legacy_extract(order):
+    info = dict()
+    for tag in ['header', 'client', 'itinerary']:
+        fragment = order.find_next(name=HTML[tag]['tag'])
+        info.update(legacy_scrape_fragment(BLUEPRINTS[tag], fragment, STAMP))
+    info.update(legacy_scrape_prices(order.find(HTML['prices']['tag']), STAMP))
+    fragments = order.find_all(name=HTML['address']['tag'], attrs=HTML['address']['attrs'])
+    return info, [legacy_scrape_fragment(BLUEPRINTS['address'], fragment, STAMP) for fragment in fragments]
+
+
+def compiled_extract(order):
+    info = dict()
+    firsts, fragments = _select_fragments(order)
+    for tag in ['header', 'client', 'itinerary']:
+        info.update(_scrape_fragment(PLAN.fragments[tag].fields, firsts[tag], STAMP))
+    info.update(_scrape_prices(firsts['prices'], STAMP))
+    return info, [_scrape_fragment(PLAN.fragments['address'].fields, fragment, STAMP) for fragment in fragments]
+
+
+def _time(func, *args):
+    timings = repeat(lambda: func(*args), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER * 1e6
+
+
+def benchmark():
+    orders = []
+    for filepath in FIXTURES:
+        with open(filepath, 'rb') as f:
+            orders.append(Webpage(f.read()).find(id='order_detail'))
+
+    for order in orders:
+        assert legacy_extract(order) == compiled_extract(order)
+
+    legacy = sum(_time(legacy_extract, order) for order in orders) / len(orders)
+    compiled = sum(_time(compiled_extract, order) for order in orders) / len(orders)
+    print('Extraction per page: {:8.1f} us legacy {:8.1f} us compiled {:5.2f}x'.format(legacy, compiled, legacy / compiled))
+
+    texts = [string for order in orders for string in order.stripped_strings]
+    assert [legacy_fix_unicode(t) for t in texts] == [fix_unicode(t) for t in texts]
+
+    legacy = _time(lambda: [legacy_fix_unicode(t) for t in texts])
+    compiled = _time(lambda: [fix_unicode(t) for t in texts])
+    print('Unicode repair for {} strings: {:8.1f} us legacy {:8.1f} us compiled {:5.2f}x'.format(
+        len(texts), legacy, compiled, legacy / compiled))
+
+
+if __name__ == '__main__':
+    simplefilter('ignore')
+    disable(WARNING)
+    benchmark()
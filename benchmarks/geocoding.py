@@ -0,0 +1,69 @@
+""" Measure batch geocoding throughput and quota behavior against a local stub geocoder. """
+
+
+from random import Random
+from time import sleep, monotonic
+from geopy.exc import GeocoderTimedOut
+
+from m5.geocoder import BatchGeocoder, TokenBucket, Quota
+
+
+QUERIES = 400
+DISTINCT = 200
+LATENCY = 0.02
+TIMEOUTS = 0.05
+RATE = 200
+
+
+class StubGeocoder(object):
+    """ Answer after a fixed latency and time out now and then, like Google on a bad day. """
+
+    def __init__(self, latency=LATENCY, timeouts=TIMEOUTS, seed=0):
+        self.latency = latency
+        self.timeouts = timeouts
+        self.requests = 0
+        self._random = Random(seed)
+
+    def geocode(self, query):
+        self.requests += 1
+        sleep(self.latency)
+
+        if self._random.random() < self.timeouts:
+            raise GeocoderTimedOut('Stub timed out')
+
+        return None
+
+
+def _queries():
+    return ['Street %s, 10115 Berlin' % (n % DISTINCT) for n in range(QUERIES)]
+
+
+def throughput(workers):
+    service = StubGeocoder()
+    geocoder = BatchGeocoder(service=service, workers=workers, bucket=TokenBucket(rate=RATE), backoff=0.01)
+
+    start = monotonic()
+    geocoder.geocode(_queries())
+    elapsed = monotonic() - start
+
+    print('{workers:>3} threads {requests:>5} requests {elapsed:6.2f} s {rate:7.1f} queries/s'.format(
+        workers=workers, requests=service.requests, elapsed=elapsed, rate=QUERIES / elapsed))
+
+
+def exhaustion(limit):
+    service = StubGeocoder(timeouts=0)
+    geocoder = BatchGeocoder(service=service, workers=8, bucket=TokenBucket(rate=RATE), quota=Quota(limit))
+    points = geocoder.geocode(_queries())
+
+    print('Quota of {limit}: {requests} requests sent for {distinct} distinct queries'.format(
+        limit=limit, requests=service.requests, distinct=len(points)))
+
+
+if __name__ == '__main__':
+    print('%s queries (%s distinct), %.0f ms latency, %.0f%% timeouts, %s requests/s at most' % (
+        QUERIES, DISTINCT, LATENCY * 1000, TIMEOUTS * 100, RATE))
+
+    for workers in (1, 4, 8, 16):
+        throughput(workers)
+
+    exhaustion(50)
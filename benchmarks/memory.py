@@ -0,0 +1,53 @@
+""" Show the peak RSS of archiving more and more jobs, in one long session and in a session per batch. """
+
+
+from resource import getrusage, RUSAGE_SELF
+from subprocess import run
+from sys import executable, argv
+from os.path import join
+from tempfile import TemporaryDirectory
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Model
+from m5.pipeline import archive
+from m5.settings import ARCHIVE_BATCH
+from benchmarks.archiving import job_rows
+
+
+SIZES = (1000, 2000, 4000, 8000)
+
+
+def migrate(jobs, scoped):
+    with TemporaryDirectory() as folder:
+        engine = create_engine('sqlite:///' + join(folder, 'bench.sqlite'))
+        Model.metadata.create_all(engine)
+        sessions = sessionmaker(autoflush=False, bind=engine)
+        db = sessions()
+
+        if scoped:
+            for i in range(0, jobs, ARCHIVE_BATCH):
+                with sessions() as batch:
+                    for n in range(i, min(i + ARCHIVE_BATCH, jobs)):
+                        archive(batch, job_rows(n))
+        else:
+            for n in range(jobs):
+                archive(db, job_rows(n))
+
+        print(getrusage(RUSAGE_SELF).ru_maxrss // 1024)
+
+
+def peak(jobs, scoped):
+    command = [executable, '-m', 'benchmarks.memory', str(jobs), 'scoped' if scoped else 'long']
+    return int(run(command, capture_output=True, text=True, check=True).stdout.split()[-1])
+
+
+if __name__ == '__main__':
+    if len(argv) == 3:
+        migrate(int(argv[1]), argv[2] == 'scoped')
+
+    else:
+        print('Peak RSS in MB, sessions scoped to batches of %s jobs' % ARCHIVE_BATCH)
+        print('{:>8} {:>14} {:>14}'.format('jobs', 'one session', 'per batch'))
+        for size in SIZES:
+            print('{:>8} {:>14} {:>14}'.format(size, peak(size, False), peak(size, True)))
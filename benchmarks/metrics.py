@@ -0,0 +1,55 @@
+""" Compare ranking and grouping orders by derived metrics in Python and inside SQLite, on 100k orders. """
+
+
+from collections import defaultdict
+from os.path import join
+from tempfile import TemporaryDirectory
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Order, aggregate
+from m5.storage import connect, upgrade
+from benchmarks.summaries import ORDERS, populate, best
+
+
+TOP = 20
+
+
+def top_in_python(db):
+    orders = sorted(db.query(Order), key=lambda order: order.price, reverse=True)[:TOP]
+    db.expunge_all()
+    return [order.price for order in orders]
+
+
+def top_in_sql(db):
+    return [price for price, in db.query(Order.price).order_by(Order.price.desc()).limit(TOP)]
+
+
+def rates_in_python(db):
+    earnings, distance = defaultdict(float), defaultdict(float)
+    for order in db.query(Order):
+        earnings[order.client_id] += order.earnings
+        distance[order.client_id] += order.distance
+    db.expunge_all()
+    return {client: earnings[client] / distance[client] for client in earnings}
+
+
+def rates_in_sql(db):
+    return dict(aggregate(db, 'client', ('per_km',)))
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        engine = connect('sqlite:///' + join(folder, 'bench.sqlite'))
+        upgrade(engine)
+        populate(engine)
+        db = sessionmaker(bind=engine)()
+
+        print('%s orders' % ORDERS)
+        for name, python, sql in (('top %s orders by price' % TOP, top_in_python, top_in_sql),
+                                  ('earnings per km of each client', rates_in_python, rates_in_sql)):
+            slow, expected = best(python, db)
+            fast, result = best(sql, db)
+            assert expected == result if isinstance(result, list) else \
+                all(abs(expected[k] - result[k]) < 1e-9 for k in expected)
+            print('{:>30} {:9.1f} ms python {:7.1f} ms sql {:6.0f}x'.format(name, slow * 1000, fast * 1000,
+                                                                          slow / fast))
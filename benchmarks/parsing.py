@@ -0,0 +1,52 @@
+""" Compare the full and the fast scraper paths on the test fixtures. """
+
+
+from glob import glob
+from os.path import join, basename
+from timeit import repeat
+from datetime import date
+from warnings import simplefilter
+
+import m5.spider
+from m5.scraper import scrape
+from m5.settings import ASSETS_DIR, MOCK_DIRNAME
+from m5.spider import Stamp, Stamped, Webpage
+
+
+FIXTURES = sorted(glob(join(ASSETS_DIR, '*-uuid-???????.html')) +
+                  glob(join(ASSETS_DIR, MOCK_DIRNAME, 'archive', '*.html')))
+
+REPEAT = 5
+NUMBER = 20
+
+
+def _scrape(content, fast):
+    return scrape(Stamped(Stamp('bench', date.today(), '0000000'), Webpage(content)), fast=fast)
+
+
+def _per_page(content, fast):
+    timings = repeat(lambda: _scrape(content, fast), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER * 1000
+
+
+def benchmark(parser):
+    m5.spider.FAST_PARSER = parser
+    print('Fast parser: %s' % parser)
+
+    for filepath in FIXTURES:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+
+        assert _scrape(content, True).data == _scrape(content, False).data, filepath
+
+        full = _per_page(content, False)
+        fast = _per_page(content, True)
+
+        print('{page:>32} {full:7.2f} ms {fast:7.2f} ms {speedup:5.2f}x'.format(
+            page=basename(filepath), full=full, fast=fast, speedup=full / fast))
+
+
+if __name__ == '__main__':
+    simplefilter('ignore')
+    for parser in sorted({m5.spider.FAST_PARSER, 'html.parser'}):
+        benchmark(parser)
@@ -0,0 +1,57 @@
+""" Compare processing scraped jobs into model instances and into lightweight records. """
+
+
+from glob import glob
+from os.path import join
+from timeit import repeat
+from datetime import date
+from tracemalloc import start, stop, get_traced_memory
+from warnings import simplefilter
+
+from m5.pipeline import process
+from m5.scraper import scrape
+from m5.settings import ASSETS_DIR, MOCK_DIRNAME
+from m5.spider import Stamp, Stamped, Webpage
+
+
+FIXTURES = sorted(glob(join(ASSETS_DIR, MOCK_DIRNAME, 'archive', '*.html')))
+
+REPEAT = 5
+NUMBER = 200
+
+
+def _jobs():
+    jobs = []
+    for filepath in FIXTURES:
+        with open(filepath, 'rb') as f:
+            jobs.append(scrape(Stamped(Stamp('bench', date.today(), '0000000'), Webpage(f.read()))))
+    return jobs
+
+
+def _process(jobs, records):
+    return [process(job, is_offline=True, records=records) for job in jobs]
+
+
+def _per_job(jobs, records):
+    timings = repeat(lambda: _process(jobs, records), repeat=REPEAT, number=NUMBER)
+    return min(timings) / NUMBER / len(jobs) * 1e6
+
+
+def _memory(jobs, records):
+    start()
+    kept = [_process(jobs, records) for _ in range(NUMBER)]
+    size = get_traced_memory()[0]
+    stop()
+
+    rows = sum(len(rows) for batch in kept for rows in batch)
+    return size / rows
+
+
+if __name__ == '__main__':
+    simplefilter('ignore')
+    jobs = _jobs()
+    print('%s jobs, %s rows per pass' % (len(jobs), sum(len(rows) for rows in _process(jobs, False))))
+
+    for name, records in (('models', False), ('records', True)):
+        print('{name:>8} {time:7.1f} us per job {memory:7.0f} bytes per row'.format(
+            name=name, time=_per_job(jobs, records), memory=_memory(jobs, records)))
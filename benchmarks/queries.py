@@ -0,0 +1,107 @@
+""" Time typical queries on a synthetic database of 100k orders, before and after the storage profile. """
+
+
+from datetime import datetime, timedelta
+from os.path import join
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy import create_engine, text
+
+from m5.model import Model, Client, Order, Checkpoint, Checkin
+from m5.storage import connect, upgrade
+
+
+ORDERS = 100000
+CLIENTS = 1000
+CHECKPOINTS = 20000
+USERS = ('alice', 'bob', 'carol', 'dave', 'erin')
+START = datetime(2012, 1, 1)
+LOOKUPS = 200
+
+QUERIES = {
+    'checkins of an order': 'SELECT * FROM checkins WHERE order_id = :order',
+    'orders of a client': 'SELECT * FROM orders WHERE client_id = :client',
+    'orders of a week': 'SELECT * FROM orders WHERE date BETWEEN :start AND :stop',
+    'orders of a user and day': 'SELECT * FROM orders WHERE user = :user AND date BETWEEN :start AND :stop',
+    'orders at a checkpoint': 'SELECT orders.* FROM checkpoints '
+                              'JOIN checkins ON checkins.checkpoint_id = checkpoints.id '
+                              'JOIN orders ON orders.order_id = checkins.order_id '
+                              'WHERE checkpoints.checkpoint_id = :checkpoint',
+}
+
+
+def populate(engine):
+    random = Random(0)
+    clients = [{'client_id': n, 'name': 'Client %s' % n} for n in range(CLIENTS)]
+    checkpoints = [{'id': n + 1, 'checkpoint_id': 'Street %s, 10115 Berlin, Germany' % n, 'lat': 52.5, 'lon': 13.4}
+                   for n in range(CHECKPOINTS)]
+    orders, checkins = [], []
+
+    for n in range(ORDERS):
+        day = START + timedelta(minutes=15 * n)
+        orders.append({'order_id': n, 'client_id': random.randrange(CLIENTS), 'date': day, 'uuid': n,
+                       'user': random.choice(USERS), 'type': 'city_tour', 'city_tour': 5.0})
+        for stop, purpose in enumerate(('pickup', 'dropoff')):
+            checkpoint = checkpoints[random.randrange(CHECKPOINTS)]['id']
+            checkins.append({'checkin_id': '%032x' % (2 * n + stop), 'checkpoint_id': checkpoint,
+                             'order_id': n, 'purpose': purpose, 'timestamp': day})
+
+    start = perf_counter()
+    with engine.begin() as connection:
+        for model, rows in ((Client, clients), (Checkpoint, checkpoints), (Order, orders), (Checkin, checkins)):
+            connection.execute(model.__table__.insert(), rows)
+
+    return perf_counter() - start
+
+
+def lookups():
+    random = Random(1)
+    for _ in range(LOOKUPS):
+        start = START + timedelta(days=random.randrange(1000))
+        yield {'order': random.randrange(ORDERS),
+               'client': random.randrange(CLIENTS),
+               'checkpoint': 'Street %s, 10115 Berlin, Germany' % random.randrange(CHECKPOINTS),
+               'user': random.choice(USERS),
+               'start': start, 'stop': start + timedelta(days=7)}
+
+
+def measure(engine):
+    timings = dict()
+    parameters = list(lookups())
+
+    with engine.connect() as connection:
+        for name, query in QUERIES.items():
+            statement = text(query)
+            start = perf_counter()
+            for values in parameters:
+                if name == 'orders of a user and day':
+                    values = dict(values, stop=values['start'] + timedelta(days=1))
+                connection.execute(statement, values).fetchall()
+            timings[name] = (perf_counter() - start) / LOOKUPS * 1000
+
+    return timings
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        before = create_engine('sqlite:///' + join(folder, 'before.sqlite'))
+        Model.metadata.create_all(before)
+        with before.begin() as connection:
+            for table in Model.metadata.sorted_tables:
+                for index in table.indexes:
+                    connection.exec_driver_sql('DROP INDEX %s' % index.name)
+
+        after = connect('sqlite:///' + join(folder, 'after.sqlite'))
+        upgrade(after)
+
+        print('%s orders, %s checkins, %s lookups per query' % (ORDERS, 2 * ORDERS, LOOKUPS))
+        print('{:>28} {:>10} {:>10}'.format('insert', '%.2f s' % populate(before), '%.2f s' % populate(after)))
+
+        with after.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+
+        slow, fast = measure(before), measure(after)
+        for name in QUERIES:
+            print('{:>28} {:>7.2f} ms {:>7.3f} ms {:>8.0f}x'.format(name, slow[name], fast[name],
+                                                                   slow[name] / fast[name]))
@@ -0,0 +1,136 @@
+""" Compare the size and the join latency of a synthetic database before and after the surrogate keys migration. """
+
+
+from datetime import datetime, timedelta
+from os.path import getsize, join
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy import text
+
+from m5.storage import connect, upgrade
+
+
+ORDERS = 100000
+CLIENTS = 1000
+CHECKPOINTS = 20000
+START = datetime(2012, 1, 1)
+LOOKUPS = 200
+REPEAT = 5
+
+V1 = [
+    'CREATE TABLE clients (client_id INTEGER PRIMARY KEY, name TEXT)',
+    'CREATE TABLE checkpoints (checkpoint_id TEXT PRIMARY KEY, lat FLOAT, lon FLOAT, city TEXT, '
+    'postal_code TEXT, street_name TEXT, street_number TEXT, country_code TEXT, country TEXT, '
+    'company TEXT, as_scraped TEXT, place_id TEXT)',
+    'CREATE TABLE orders (order_id INTEGER PRIMARY KEY, client_id INTEGER, type TEXT, city_tour FLOAT, '
+    'overnight FLOAT, waiting_time FLOAT, extra_stops FLOAT, fax_confirm FLOAT, cancelled_stop FLOAT, '
+    'loading_service FLOAT, client_support FLOAT, distance FLOAT, cash BOOLEAN, date DATETIME, uuid INTEGER, '
+    'user TEXT)',
+    'CREATE TABLE checkins (checkin_id VARCHAR PRIMARY KEY, '
+    'checkpoint_id INTEGER NOT NULL REFERENCES checkpoints (checkpoint_id), '
+    'order_id INTEGER NOT NULL REFERENCES orders (order_id), purpose TEXT, timestamp DATETIME, '
+    'after_ DATETIME, until DATETIME)',
+    'CREATE INDEX ix_checkins_checkpoint_id ON checkins (checkpoint_id)',
+    'CREATE INDEX ix_checkins_order_id ON checkins (order_id)',
+]
+
+QUERIES = {
+    'orders at a checkpoint': ('SELECT orders.* FROM checkpoints '
+                               'JOIN checkins ON checkins.checkpoint_id = checkpoints.{key} '
+                               'JOIN orders ON orders.order_id = checkins.order_id '
+                               'WHERE checkpoints.checkpoint_id = :checkpoint', LOOKUPS),
+    'checkpoints of an order': ('SELECT checkpoints.* FROM checkins '
+                                'JOIN checkpoints ON checkpoints.{key} = checkins.checkpoint_id '
+                                'WHERE checkins.order_id = :order', LOOKUPS),
+    'checkins per postcode': ('SELECT postal_code, COUNT(*) FROM checkins '
+                              'JOIN checkpoints ON checkpoints.{key} = checkins.checkpoint_id '
+                              'GROUP BY postal_code', 1),
+}
+
+
+def populate(engine):
+    random = Random(0)
+    postcodes = ['10%03d' % (n % 1000) for n in range(CHECKPOINTS)]
+    addresses = ['Street %s, %s Berlin, Germany' % (n, postcode) for n, postcode in enumerate(postcodes)]
+
+    with engine.begin() as connection:
+        for statement in V1:
+            connection.exec_driver_sql(statement)
+
+        connection.exec_driver_sql('INSERT INTO clients VALUES (?, ?)',
+                                   [(n, 'Client %s' % n) for n in range(CLIENTS)])
+        connection.exec_driver_sql('INSERT INTO checkpoints (checkpoint_id, lat, lon, city, postal_code, '
+                                   'country_code, country, as_scraped) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                   [(address, 52.5, 13.4, 'Berlin', postcode, 'DE', 'Germany', address[:-9])
+                                    for address, postcode in zip(addresses, postcodes)])
+
+        orders, checkins = [], []
+        for n in range(ORDERS):
+            day = START + timedelta(minutes=15 * n)
+            orders.append((n, random.randrange(CLIENTS), 'city_tour', 5.0, day, n, 'bench'))
+            for stop, purpose in enumerate(('pickup', 'dropoff')):
+                checkins.append(('%032x' % (2 * n + stop), random.choice(addresses), n, purpose, day))
+
+        connection.exec_driver_sql('INSERT INTO orders (order_id, client_id, type, city_tour, date, uuid, user) '
+                                   'VALUES (?, ?, ?, ?, ?, ?, ?)', orders)
+        connection.exec_driver_sql('INSERT INTO checkins (checkin_id, checkpoint_id, order_id, purpose, '
+                                   'timestamp) VALUES (?, ?, ?, ?, ?)', checkins)
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('VACUUM')
+        connection.exec_driver_sql('ANALYZE')
+
+
+def lookups():
+    random = Random(1)
+    return [{'order': random.randrange(ORDERS),
+             'checkpoint': 'Street %s, 10%03d Berlin, Germany' % (n, n % 1000)}
+            for n in (random.randrange(CHECKPOINTS) for _ in range(LOOKUPS))]
+
+
+def measure(engine, key):
+    timings = dict()
+    parameters = lookups()
+
+    with engine.connect() as connection:
+        for name, (query, number) in QUERIES.items():
+            statement = text(query.format(key=key))
+            best = float('inf')
+            for _ in range(REPEAT):
+                start = perf_counter()
+                for values in parameters[:number]:
+                    connection.execute(statement, values).fetchall()
+                best = min(best, perf_counter() - start)
+            timings[name] = best / number * 1000
+
+    return timings
+
+
+def size(engine, filepath):
+    with engine.connect() as connection:
+        connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    return getsize(filepath) / 2 ** 20
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        filepath = join(folder, 'bench.sqlite')
+        engine = connect('sqlite:///' + filepath)
+
+        populate(engine)
+        before, before_size = measure(engine, 'checkpoint_id'), size(engine, filepath)
+
+        start = perf_counter()
+        upgrade(engine)
+        migration = perf_counter() - start
+
+        after, after_size = measure(engine, 'id'), size(engine, filepath)
+
+        print('%s orders, %s checkins, %s checkpoints, migrated in %.2f s'
+              % (ORDERS, 2 * ORDERS, CHECKPOINTS, migration))
+        print('{:>26} {:>10} {:>10}'.format('', 'text keys', 'int keys'))
+        print('{:>26} {:>7.1f} MB {:>7.1f} MB'.format('file size', before_size, after_size))
+        for name in QUERIES:
+            print('{:>26} {:>7.3f} ms {:>7.3f} ms {:>8.1f}x'.format(name, before[name], after[name],
+                                                                    before[name] / after[name]))
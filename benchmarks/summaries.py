@@ -0,0 +1,80 @@
+""" Compare monthly earnings from a scan of the orders and from the summary tables, on 100k orders. """
+
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from os.path import join
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Client, Order
+from m5.storage import connect, upgrade
+from m5.summary import rebuild, summary, update
+
+
+ORDERS = 100000
+CLIENTS = 1000
+BATCH = 64
+START = datetime(2012, 1, 1)
+REPEAT = 5
+
+
+def populate(engine):
+    random = Random(0)
+    clients = [{'client_id': n, 'name': 'Client %s' % n} for n in range(CLIENTS)]
+    orders = [{'order_id': n, 'client_id': random.randrange(CLIENTS), 'date': START + timedelta(minutes=15 * n),
+               'uuid': n, 'user': 'bench', 'type': 'city_tour', 'city_tour': 5.0, 'overnight': 0.0,
+               'loading_service': 0.0, 'fax_confirm': 0.0, 'extra_stops': random.choice((0.0, 1.5)),
+               'cancelled_stop': 0.0, 'client_support': 0.0, 'distance': 3.0, 'cash': random.random() < 0.1}
+              for n in range(ORDERS)]
+
+    with engine.begin() as connection:
+        connection.execute(Client.__table__.insert(), clients)
+        connection.execute(Order.__table__.insert(), orders)
+
+    return orders
+
+
+def scan(db):
+    earnings = defaultdict(float)
+    for order in db.query(Order):
+        earnings[order.date.strftime('%Y-%m')] += order.price
+    db.expunge_all()
+    return earnings
+
+
+def read(db):
+    return {row.month.strftime('%Y-%m'): row.price for row in summary(db, 'month')}
+
+
+def best(function, *args):
+    timings = []
+    for _ in range(REPEAT):
+        start = perf_counter()
+        result = function(*args)
+        timings.append(perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as folder:
+        engine = connect('sqlite:///' + join(folder, 'bench.sqlite'))
+        upgrade(engine)
+        orders = populate(engine)
+        db = sessionmaker(bind=engine)()
+
+        rebuilt, _ = best(lambda: (rebuild(db), db.commit()))
+        scanned, slow = best(scan, db)
+        summarized, fast = best(read, db)
+        assert slow.keys() == fast.keys() and all(abs(slow[k] - fast[k]) < 1e-6 for k in slow)
+
+        batch = [dict(order, order_id=ORDERS + n) for n, order in enumerate(orders[:BATCH])]
+        updated, _ = best(lambda: (update(db, batch), db.rollback()))
+
+        print('%s orders, %s months' % (ORDERS, len(fast)))
+        print('{:>34} {:9.2f} ms'.format('monthly earnings, scan', scanned * 1000))
+        print('{:>34} {:9.2f} ms'.format('monthly earnings, summary', summarized * 1000))
+        print('{:>34} {:9.2f} ms'.format('update for %s orders' % BATCH, updated * 1000))
+        print('{:>34} {:9.2f} ms'.format('rebuild', rebuilt * 1000))
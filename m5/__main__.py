@@ -8,41 +8,135 @@ from datetime import date
 from textwrap import dedent
 from time import strptime
 from datetime import timedelta
-
-from m5.scraper import scrape
-from m5.pipeline import process, archive
-from m5.spider import download
-from m5.settings import LOGGING_FORMAT
+from itertools import chain
+from collections import Counter
+from time import time
+
+from m5.spider import download, download_range, load
+from m5.scraper import failures
+from m5.stream import stream, two_pass
+from m5.settings import LOGGING_FORMAT, DOWNLOAD_WORKERS, RECHECK_DAYS, SCRAPE_PROCESSES, GEOCODE_THREADS
 from m5.user import User
+from m5.pack import pack_archive
+from m5.summary import rebuild
+from m5.export import export
 
 
 def setup_logger(verbose):
     basicConfig(level=DEBUG if verbose else INFO, format=LOGGING_FORMAT)
 
 
+def login(**options):
+    keys = ('username', 'password', 'offline', 'verbose', 'packed', 'recheck')
+    return User(**{k: options[k] for k in keys}).init()
+
+
 def migrate(**options):
     """ Migrate user data from the company website to the local database. """
 
-    start_date = options.pop('begin')
-    stop_date = options.pop('end')
+    start_date = options['begin']
+    stop_date = options['end']
+    workers = options['workers']
     period = stop_date - start_date
 
-    user = User(**options).init()
+    user = login(**options)
 
     info('User %s is %s', options['username'], 'offline' if options['offline'] else 'online')
     info('Migrating data from %s to %s', start_date, stop_date)
 
-    for day in range(period.days):
-        date_ = start_date + timedelta(days=day)
-        webpages = download(date_, user)
+    if workers > 1:
+        webpages = download_range(start_date, stop_date, user, workers=workers)
+    else:
+        days = (start_date + timedelta(days=day) for day in range(period.days))
+        webpages = chain.from_iterable(download(date_, user) for date_ in days)
 
-        for webpage in webpages:
-            job = scrape(webpage)
-            tables = process(job, is_offline=user.offline)
-            archive(user.db, tables)
+    migration = two_pass if options['two_pass'] else stream
+    jobs = migration(webpages, user, scrapers=options['scrapers'], geocoders=options['geocoders'])
+    migrated = sum(1 for _ in jobs)
 
+    info('Geocoding cache: %s hits, %s misses', user.geocodes.hits, user.geocodes.misses)
+    info('Geocoding quota: %s of %s requests spent today', user.quota.spent, user.quota.limit)
+    info('Reused %s existing checkpoints', user.checkpoints.hits)
     user.logout()
-    info('Finished the migration process')
+    info('Finished the migration process (%s jobs)', migrated)
+
+
+def rescrape(**options):
+    """ Scrape the whole archive again and merge the results into the local database. """
+
+    user = login(**options)
+    pages = [(day, uuid) for day, uuid, *_ in user.index.pages()]
+
+    info('Rescraping %s webpages with %s processes', len(pages), options['scrapers'])
+
+    failed = Counter()
+    start = time()
+
+    jobs = stream(load(pages, user), user, scrapers=options['scrapers'], geocoders=options['geocoders'], refresh=True)
+
+    for job in jobs:
+        failed.update(failures(job.data))
+
+    elapsed = time() - start
+
+    info('Rescraped %s webpages in %.1fs (%.1f per second)', len(pages), elapsed, len(pages) / max(elapsed, 1e-6))
+    for field, count in failed.most_common():
+        info('Failed to scrape %s %s times', field, count)
+
+    info('Geocoding cache: %s hits, %s misses', user.geocodes.hits, user.geocodes.misses)
+    info('Geocoding quota: %s of %s requests spent today', user.quota.spent, user.quota.limit)
+    info('Reused %s existing checkpoints', user.checkpoints.hits)
+
+    user.logout()
+
+
+def reindex(**options):
+    """ Rebuild the archive index from the webpages in the archive folder. """
+
+    user = login(**dict(options, offline=True))
+    pages = user.index.rebuild()
+
+    info('Indexed %s webpages in %s', pages, user.archive)
+
+
+def pack(**options):
+    """ Move the webpages of a file-per-job archive into monthly packs. """
+
+    user = login(**dict(options, offline=True))
+    webpages = pack_archive(user.archive, packs=user.packs)
+
+    info('Packed %s webpages in %s', webpages, user.archive)
+
+
+def summarize(**options):
+    """ Recompute the daily, weekly, monthly, client and type summaries from the orders. """
+
+    user = login(**dict(options, offline=True))
+
+    with user.sessions() as db:
+        orders = rebuild(db)
+        db.commit()
+
+    info('Summarized %s orders', orders)
+
+
+def export_tables(**options):
+    """ Append the rows archived since the last export to the columnar export of the user. """
+
+    user = login(**dict(options, offline=True))
+    exported = export(user.db, user.exports)
+
+    info('Exported %s new rows to %s', sum(exported.values()), user.exports)
+
+
+COMMANDS = {
+    'migrate': migrate,
+    'rescrape': rescrape,
+    'reindex': reindex,
+    'pack': pack,
+    'summarize': summarize,
+    'export': export_tables,
+}
 
 
 def build_parser():
@@ -52,6 +146,12 @@ def build_parser():
                        fromfile_prefix_chars='@',
                        epilog='To read arguments from file pass @/absolute/path/to/file.ini')
 
+    p.add_argument('command',
+                   help='what to do (default to migrate)',
+                   nargs='?',
+                   choices=sorted(COMMANDS),
+                   default='migrate')
+
     p.add_argument('-u',
                    help='username for the bammboo-mec.de website',
                    type=str,
@@ -76,6 +176,42 @@ def build_parser():
                    action='store_true',
                    dest='offline')
 
+    p.add_argument('-z',
+                   help='packed archive mode on',
+                   default=False,
+                   action='store_true',
+                   dest='packed')
+
+    p.add_argument('-w',
+                   help='download with that many threads (default to %s)' % DOWNLOAD_WORKERS,
+                   type=int,
+                   default=DOWNLOAD_WORKERS,
+                   dest='workers')
+
+    p.add_argument('-s',
+                   help='scrape with that many processes (default to %s)' % SCRAPE_PROCESSES,
+                   type=int,
+                   default=SCRAPE_PROCESSES,
+                   dest='scrapers')
+
+    p.add_argument('-g',
+                   help='geocode with that many threads (default to %s)' % GEOCODE_THREADS,
+                   type=int,
+                   default=GEOCODE_THREADS,
+                   dest='geocoders')
+
+    p.add_argument('-t',
+                   help='two-pass migration: geocode each address once for the whole range',
+                   default=False,
+                   action='store_true',
+                   dest='two_pass')
+
+    p.add_argument('-r',
+                   help='always recheck the last so many days online (default to %s)' % RECHECK_DAYS,
+                   type=int,
+                   default=RECHECK_DAYS,
+                   dest='recheck')
+
     def calendar_day(date_string):
         t = strptime(date_string, '%d-%m-%Y')
         day = date(t.tm_year, month=t.tm_mon, day=t.tm_mday)
@@ -102,4 +238,4 @@ if __name__ == '__main__':
     parser = build_parser()
     args = parser.parse_args()
     setup_logger(args.verbose)
-    migrate(**vars(args))
+    COMMANDS[args.command](**vars(args))
@@ -0,0 +1,160 @@
+""" The analysis module loads the database of a user into data frames and computes the usual statistics. """
+
+
+from logging import debug, warning
+from os import replace, stat
+from os.path import dirname, exists, join
+from pickle import dump, load, HIGHEST_PROTOCOL, UnpicklingError
+from pandas import read_sql_query
+from sqlalchemy import select
+
+from m5.model import Order, Client, Checkin, Checkpoint, PRICES
+from m5.settings import FRAMES_FILENAME
+
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+# Weeks are labelled by their monday, like the summaries.
+PERIODS = {
+    'day': {'rule': 'D'},
+    'week': {'rule': 'W-MON', 'closed': 'left', 'label': 'left'},
+    'month': {'rule': 'MS'},
+    'year': {'rule': 'YS'},
+}
+
+
+def stamp(filepath):
+    """ Return what changes when the database does: the size and modification time of the file and its journal. """
+
+    return tuple((stat(path).st_size, stat(path).st_mtime_ns) if exists(path) else None
+                 for path in (filepath, filepath + '-wal'))
+
+
+class Frames(object):
+    """
+    The tables of a user database as data frames, read once and pickled
+    next to the database. The pickle is used for as long as the database
+    file (and its write-ahead log) keeps the same size and modification
+    time, and is read again from the database otherwise, or when the
+    pickle cannot be loaded.
+    """
+
+    def __init__(self, engine, filepath=None):
+        self.engine = engine
+        self.database = engine.url.database
+        self.filepath = filepath or join(dirname(self.database), FRAMES_FILENAME)
+        self.is_cached = False
+        self._frames = None
+
+    @classmethod
+    def of(cls, user):
+        return cls(user.engine, join(user.userdir, FRAMES_FILENAME))
+
+    def __repr__(self):
+        return '<Frames: %s>' % self.filepath
+
+    def __getitem__(self, name):
+        if self._frames is None:
+            self._frames = self._load()
+        return self._frames[name]
+
+    @property
+    def orders(self):
+        return self['orders']
+
+    @property
+    def checkins(self):
+        return self['checkins']
+
+    def _load(self):
+        current = stamp(self.database)
+
+        if exists(self.filepath):
+            try:
+                with open(self.filepath, 'rb') as f:
+                    cached, frames = load(f)
+            except (EOFError, UnpicklingError, AttributeError, ImportError) as e:
+                warning('Ignored the data frames in %s (%s)', self.filepath, e)
+                cached = None
+
+            if cached == current:
+                self.is_cached = True
+                debug('Loaded data frames from %s', self.filepath)
+                return frames
+
+        frames = self._read()
+
+        # A cache that is written halfway never replaces a good one.
+        with open(self.filepath + '.tmp', 'wb') as f:
+            dump((current, frames), f, HIGHEST_PROTOCOL)
+        replace(self.filepath + '.tmp', self.filepath)
+
+        debug('Cached data frames in %s', self.filepath)
+        return frames
+
+    def _read(self):
+        orders = select(Order.__table__, Client.name.label('client')).outerjoin(Client)
+        checkins = select(Checkin.__table__, Checkpoint.checkpoint_id.label('address'),
+                          Checkpoint.lat, Checkpoint.lon, Checkpoint.postal_code, Checkpoint.city,
+                          Checkpoint.company).join(Checkpoint, Checkin.checkpoint_id == Checkpoint.id)
+
+        with self.engine.connect() as connection:
+            frames = {
+                'orders': read_sql_query(orders, connection, index_col='order_id', parse_dates=['date']),
+                'checkins': read_sql_query(checkins, connection, index_col='id',
+                                           parse_dates=['timestamp', 'after_', 'until']),
+            }
+
+        orders = frames['orders']
+        orders[list(PRICES)] = orders[list(PRICES)].fillna(0.0)
+        orders['waiting_time'] = orders['waiting_time'].fillna(0.0)
+        orders['price'] = orders[list(PRICES)].sum(axis=1)
+        orders['earnings'] = orders['price'] + orders['waiting_time']
+
+        debug('Read %s orders and %s checkins', len(orders), len(frames['checkins']))
+        return frames
+
+
+def earnings(orders, period='month'):
+    """ Return the earnings (prices and pay for waiting) per day, week, month or year. """
+
+    return orders.set_index('date')['earnings'].resample(**PERIODS[period]).sum()
+
+
+def distance(orders, period='month'):
+    """ Return the distance covered, and the earnings per km, per day, week, month or year. """
+
+    totals = orders.set_index('date')[['distance', 'earnings']].resample(**PERIODS[period]).sum()
+    totals['per_km'] = totals['earnings'] / totals['distance'].where(totals['distance'] > 0)
+    return totals
+
+
+def jobs_per_weekday(orders):
+    """ Return the number of jobs on each day of the week, mondays first. """
+
+    counts = orders['date'].dt.dayofweek.value_counts().reindex(range(7), fill_value=0)
+    counts.index = WEEKDAYS
+    return counts
+
+
+def jobs_per_hour(orders, checkins):
+    """ Return the number of jobs by the hour of their first pickup. """
+
+    pickups = checkins[checkins['purpose'] == 'pickup']
+    first = pickups.groupby('order_id')['timestamp'].min().reindex(orders.index)
+    return first.dt.hour.value_counts().reindex(range(24), fill_value=0).sort_index()
+
+
+def clients(orders, top=None):
+    """
+    Return jobs, earnings and distance per client id, best paying first, with
+    the name of the client and their share of the earnings. Clients are told
+    apart by id, so two clients with the same name are not lumped together.
+    """
+
+    totals = orders.groupby('client_id', dropna=False).agg(client=('client', 'first'),
+                                                           jobs=('earnings', 'size'),
+                                                           earnings=('earnings', 'sum'),
+                                                           distance=('distance', 'sum'))
+    totals['share'] = totals['earnings'] / totals['earnings'].sum()
+    totals = totals.sort_values('earnings', ascending=False)
+    return totals if top is None else totals.head(top)
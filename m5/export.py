@@ -0,0 +1,302 @@
+""" The export module writes tables to raw binary columns that can be memory mapped for analysis. """
+
+
+from array import array
+from datetime import datetime, timedelta
+from json import dump, load
+from logging import debug, info
+from mmap import mmap, ACCESS_READ
+from os import makedirs, replace
+from os.path import exists, getsize, join
+from sys import byteorder
+from sqlalchemy import select
+from sqlalchemy.types import Boolean, Date, DateTime, Float, Integer, String
+
+from m5.model import Model
+from m5.settings import EXPORT_TABLES, EXPORT_DICTIONARY
+
+
+MANIFEST = 'manifest.json'
+ENDIAN = '<' if byteorder == 'little' else '>'
+EPOCH = datetime(1970, 1, 1)
+
+# Nulls are stored as sentinels: NaN for floats,
+# the smallest int64 for integers and datetimes
+# (NaT in NumPy), -1 for booleans and codes and
+# an empty string for plain strings.
+NULL_INT = -2 ** 63
+
+KINDS = {
+    'integer': ('q', 'i', NULL_INT),
+    'float': ('d', 'f', float('nan')),
+    'boolean': ('b', 'i', -1),
+    'datetime': ('q', 'M', NULL_INT),
+    'date': ('q', 'M', NULL_INT),
+    'category': ('i', 'i', -1),
+    'string': ('q', 'i', None),
+}
+
+UNITS = {'datetime': 's', 'date': 'D'}
+
+
+def kind(column):
+    """ Return how a column is exported. """
+
+    if column.name in EXPORT_DICTIONARY:
+        return 'category'
+
+    for type_, name in ((Boolean, 'boolean'), (DateTime, 'datetime'), (Date, 'date'),
+                        (Integer, 'integer'), (Float, 'float'), (String, 'string')):
+        if isinstance(column.type, type_):
+            return name
+
+    raise TypeError('Cannot export %s of type %s' % (column, column.type))
+
+
+def dtype(kind_):
+    """ Return the NumPy dtype of the values (or the offsets, or the codes) of a kind of column. """
+
+    typecode, letter, _ = KINDS[kind_]
+    if kind_ in UNITS:
+        return '%sM8[%s]' % (ENDIAN, UNITS[kind_])
+    return '%s%s%s' % (ENDIAN, letter, array(typecode).itemsize)
+
+
+def encode(kind_, value):
+    if value is None:
+        return KINDS[kind_][2]
+    if kind_ == 'datetime':
+        return (value - EPOCH) // timedelta(seconds=1)
+    if kind_ == 'date':
+        return value.toordinal() - EPOCH.toordinal()
+    if kind_ == 'boolean':
+        return 1 if value else 0
+    return value
+
+
+class ColumnWriter(object):
+    """
+    One column of an exported table. Fixed width values go to a single file.
+    Strings go to a file of utf-8 bytes and a file of offsets into it, one
+    more than there are rows. Categories are codes into a dictionary that
+    only ever grows, so codes written before stay valid.
+    """
+
+    def __init__(self, folder, column, manifest=None):
+        self.name = column.name
+        self.kind = manifest['kind'] if manifest else kind(column)
+        self.filepath = join(folder, self.name + '.bin')
+        self.dictionary = list(manifest.get('dictionary', ())) if manifest else []
+        self._codes = {value: code for code, value in enumerate(self.dictionary)}
+        self._values = array(KINDS[self.kind][0])
+        self._data = bytearray()
+        self._offset = manifest.get('bytes', 0) if manifest else 0
+
+    def append(self, value):
+        if self.kind == 'category':
+            if value is None:
+                self._values.append(-1)
+            else:
+                if value not in self._codes:
+                    self._codes[value] = len(self.dictionary)
+                    self.dictionary.append(value)
+                self._values.append(self._codes[value])
+
+        elif self.kind == 'string':
+            self._data += (value or '').encode('utf-8')
+            self._values.append(self._offset + len(self._data))
+
+        else:
+            self._values.append(encode(self.kind, value))
+
+    def flush(self, rows):
+        """ Append the buffered values after the first rows of the files and return the manifest entry. """
+
+        if self.kind == 'string':
+            _truncate(self.filepath, self._offset)
+            with open(self.filepath, 'ab') as f:
+                f.write(self._data)
+            offsets = self.filepath[:-4] + '.offsets'
+            if not rows:
+                _truncate(offsets, 0)
+                self._values.insert(0, 0)
+            _append(offsets, self._values, rows + 1 if rows else 0)
+            self._offset += len(self._data)
+        else:
+            _append(self.filepath, self._values, rows)
+
+        self._values = array(KINDS[self.kind][0])
+        self._data = bytearray()
+
+        entry = {'kind': self.kind, 'dtype': dtype(self.kind)}
+        if self.kind == 'category':
+            entry['dictionary'] = self.dictionary
+        if self.kind == 'string':
+            entry['bytes'] = self._offset
+        return entry
+
+
+def _truncate(filepath, size):
+    if exists(filepath) and getsize(filepath) != size:
+        with open(filepath, 'r+b') as f:
+            f.truncate(size)
+
+
+def _append(filepath, values, items):
+    # Leftovers of an export that died before its manifest are cut off.
+    _truncate(filepath, items * values.itemsize)
+    with open(filepath, 'ab') as f:
+        values.tofile(f)
+
+
+def read_manifest(folder):
+    filepath = join(folder, MANIFEST)
+    if not exists(filepath):
+        return {'rows': 0, 'columns': {}}
+    with open(filepath) as f:
+        return load(f)
+
+
+def _write_manifest(folder, manifest):
+    filepath = join(folder, MANIFEST)
+    with open(filepath + '.tmp', 'w') as f:
+        dump(manifest, f, indent=2)
+    replace(filepath + '.tmp', filepath)
+
+
+def exported_keys(folder, table):
+    """ Return the primary keys already exported from a table. """
+
+    manifest = read_manifest(folder)
+    key = table.primary_key.columns[0].name
+
+    if not manifest['rows']:
+        return set()
+
+    with open(join(folder, key + '.bin'), 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as content:
+        with memoryview(content) as view:
+            return set(view.cast('q')[:manifest['rows']])
+
+
+def export_table(db, table, folder, chunksize=10000):
+    """
+    Append the rows of a table that are not exported yet, in primary key
+    order. Rows are told apart by their primary key, so rows updated since
+    they were exported keep their old values: remove the folder to export
+    everything again. The manifest is written last, so an export that dies
+    halfway is ignored and overwritten next time. Return the number of new rows.
+    """
+
+    makedirs(folder, exist_ok=True)
+    manifest = read_manifest(folder)
+    rows = manifest['rows']
+    key = table.primary_key.columns[0]
+
+    known = exported_keys(folder, table)
+    keys = sorted(set(db.execute(select(key)).scalars()) - known)
+
+    writers = [ColumnWriter(folder, column, manifest['columns'].get(column.name)) for column in table.columns]
+    position = list(table.columns).index(key)
+
+    # A first export of an empty table still writes the (empty) columns.
+    chunks = [keys[i:i + chunksize] for i in range(0, len(keys), chunksize)] or ([] if rows else [[]])
+
+    for chunk in chunks:
+        new = 0
+
+        if chunk:
+            statement = select(table).where(key.between(chunk[0], chunk[-1])).order_by(key)
+            for row in db.execute(statement):
+                if row[position] in known:
+                    continue
+                for writer, value in zip(writers, row):
+                    writer.append(value)
+                new += 1
+
+        columns = {writer.name: writer.flush(rows) for writer in writers}
+        rows += new
+        manifest = {'table': table.name, 'rows': rows, 'key': key.name, 'columns': columns,
+                    'exported': datetime.now().isoformat()}
+        _write_manifest(folder, manifest)
+
+    debug('Exported %s new rows of %s', len(keys), table.name)
+    return len(keys)
+
+
+def export(db, folder, tables=EXPORT_TABLES):
+    """ Export each table to a subfolder and return the number of new rows per table. """
+
+    exported = dict()
+    for name in tables:
+        exported[name] = export_table(db, Model.metadata.tables[name], join(folder, name))
+        info('Exported %s new rows of %s', exported[name], name)
+
+    return exported
+
+
+def columns(folder):
+    """
+    Return the columns of an exported table as read-only memory views over
+    the files, without copying them. Strings come as (offsets, bytes) and
+    categories as codes, to be looked up in the dictionary of the manifest.
+    """
+
+    manifest = read_manifest(folder)
+    views = dict()
+
+    for name, entry in manifest['columns'].items():
+        typecode = KINDS[entry['kind']][0]
+        if entry['kind'] == 'string':
+            views[name] = (_view(join(folder, name + '.offsets'), typecode, manifest['rows'] + 1),
+                           _view(join(folder, name + '.bin'), 'B', entry['bytes']))
+        else:
+            views[name] = _view(join(folder, name + '.bin'), typecode, manifest['rows'])
+
+    return views
+
+
+def _view(filepath, typecode, items):
+    if not items or not getsize(filepath):
+        return memoryview(array(typecode))
+    with open(filepath, 'rb') as f:
+        content = mmap(f.fileno(), 0, access=ACCESS_READ)
+    return memoryview(content).cast(typecode)[:items]
+
+
+def frame(folder):
+    """
+    Load an exported table into a pandas data frame. Numbers, booleans and
+    datetimes are NumPy memory maps of the files and categories keep their
+    codes, so only plain strings are copied.
+    """
+
+    import numpy
+    import pandas
+
+    manifest = read_manifest(folder)
+    rows = manifest['rows']
+    data = dict()
+
+    for name, entry in manifest['columns'].items():
+        filepath = join(folder, name + '.bin')
+
+        if entry['kind'] == 'string':
+            offsets = _memmap(numpy, join(folder, name + '.offsets'), entry['dtype'], rows + 1)
+            content = _memmap(numpy, filepath, 'u1', entry['bytes']).tobytes()
+            data[name] = numpy.array([content[start:stop].decode('utf-8')
+                                      for start, stop in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+        elif entry['kind'] == 'category':
+            codes = _memmap(numpy, filepath, entry['dtype'], rows)
+            data[name] = pandas.Categorical.from_codes(codes, entry['dictionary'])
+
+        else:
+            data[name] = _memmap(numpy, filepath, entry['dtype'], rows)
+
+    return pandas.DataFrame(data, copy=False)
+
+
+def _memmap(numpy, filepath, dtype_, items):
+    if not items:
+        return numpy.empty(0, dtype=dtype_)
+    return numpy.memmap(filepath, dtype=dtype_, mode='r', shape=(items,))
@@ -0,0 +1,408 @@
+""" The geocoder module keeps geocoding cheap: it remembers what Google already answered. """
+
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import lru_cache
+from json import dumps, loads
+from sqlite3 import connect
+from threading import Lock
+from time import time, sleep, monotonic
+from logging import debug, warning
+from re import compile
+from geopy import GoogleV3, Location
+from geopy.exc import GeopyError, GeocoderQuotaExceeded, GeocoderTimedOut, GeocoderUnavailable
+
+from m5.settings import GEOCODE_TTL, GEOCODE_CACHE_SIZE, GEOCODE_LRU_SIZE, GEOCODE_RETRIES, GEOCODE_BACKOFF
+from m5.settings import GEOCODE_RATE, GEOCODE_QUOTA, GEOCODE_THREADS, GOOGLE_API_KEY
+
+
+NOT_FOUND = 'null'
+
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+STREET = compile(r'str(?:asse|\.)?(?=\W|$)')
+PUNCTUATION = compile(r'[^\w\s]')
+
+
+@lru_cache(maxsize=1)
+def google():
+    # Google is free up to 2500 requests per day, then 0.50€ per 1000. We don't use
+    # Nominatim because it doesn't like bulk requests. Other services cost money.
+    return GoogleV3(api_key=GOOGLE_API_KEY)
+
+
+def query(address):
+    return '{address}, {locality}'.format(**address)
+
+
+def normalize(query):
+    return ' '.join(query.casefold().split())
+
+
+def canonical(query):
+    """ Spell an address the same way however it was typed: 'Lützowstraße 107' is 'luetzowstr 107'. """
+
+    query = query.casefold().translate(UMLAUTS)
+    query = STREET.sub('str', query)
+    return ' '.join(PUNCTUATION.sub(' ', query).split())
+
+
+def location(raw):
+    """ Rebuild a geopy location from a raw Google response. """
+
+    coordinates = raw['geometry']['location']
+    return Location(raw.get('formatted_address'), (coordinates['lat'], coordinates['lng']), raw)
+
+
+class CheckpointIndex(object):
+    """
+    The checkpoints already geocoded by Google in the database, keyed by the
+    canonical form of the address they were scraped as. Addresses found in
+    the index need not be geocoded again: the index gives back a location
+    that rebuilds the very same checkpoint. Checkpoints placed offline at a
+    postcode centroid have no place id and are left out.
+    """
+
+    def __init__(self, checkpoints=()):
+        self.hits = 0
+        self._points = dict()
+
+        for checkpoint in checkpoints:
+            self.add(checkpoint)
+
+    def __repr__(self):
+        return '<CheckpointIndex: %s checkpoints (%s hits)>' % (len(self), self.hits)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, query):
+        return canonical(query) in self._points
+
+    def get(self, query):
+        point = self._points.get(canonical(query))
+        if point is not None:
+            self.hits += 1
+        return point
+
+    def add(self, checkpoint):
+        if checkpoint.as_scraped and checkpoint.place_id and checkpoint.lat is not None and checkpoint.lon is not None:
+            self._points[canonical(checkpoint.as_scraped)] = self._location(checkpoint)
+
+    @staticmethod
+    def _location(checkpoint):
+        fields = (('street_number', checkpoint.street_number, checkpoint.street_number),
+                  ('route', checkpoint.street_name, checkpoint.street_name),
+                  ('locality', checkpoint.city, checkpoint.city),
+                  ('postal_code', checkpoint.postal_code, checkpoint.postal_code),
+                  ('country', checkpoint.country, checkpoint.country_code))
+
+        raw = {
+            'formatted_address': checkpoint.checkpoint_id,
+            'place_id': checkpoint.place_id,
+            'geometry': {'location': {'lat': checkpoint.lat, 'lng': checkpoint.lon}},
+            'address_components': [{'long_name': long_name, 'short_name': short_name, 'types': [type_]}
+                                   for type_, long_name, short_name in fields if long_name is not None],
+        }
+
+        return location(raw)
+
+
+class GeoCache(object):
+    """
+    Raw Google responses stored on disk and keyed by normalized query, with
+    an in-process LRU in front. Entries expire after ttl seconds and the
+    least recently used ones are evicted beyond size entries. Addresses that
+    Google could not find are remembered too, so that they are not asked
+    about again and again.
+    """
+
+    def __init__(self, filepath, ttl=GEOCODE_TTL, size=GEOCODE_CACHE_SIZE, lru=GEOCODE_LRU_SIZE):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.size = size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lru = OrderedDict()
+        self._lru_size = lru
+        self._lock = Lock()
+
+        self._db = connect(filepath, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                         'query TEXT PRIMARY KEY, raw TEXT NOT NULL, stored REAL NOT NULL, used REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS geocodes_used ON geocodes (used)')
+        self._db.execute('DELETE FROM geocodes WHERE stored < ?', (time() - ttl,))
+        self._db.commit()
+
+        self._count = self._db.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0]
+
+    def __repr__(self):
+        return '<GeoCache: %s (%s hits, %s misses)>' % (self.filepath, self.hits, self.misses)
+
+    def __contains__(self, query):
+        return self._lookup(normalize(query)) is not None
+
+    def get(self, query):
+        """ Return (True, location or None) when the query is known and (False, None) otherwise. """
+
+        raw = self._lookup(normalize(query))
+
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+
+        return True, None if raw == NOT_FOUND else location(loads(raw))
+
+    def put(self, query, point):
+        key = normalize(query)
+        raw = dumps(point.raw) if point else NOT_FOUND
+        now = time()
+
+        with self._lock, self._db:
+            is_new = self._db.execute('SELECT 1 FROM geocodes WHERE query = ?', (key,)).fetchone() is None
+            self._db.execute('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)', (key, raw, now, now))
+            self._count += is_new
+            self._remember(key, raw, now)
+
+            if self._count > self.size:
+                evicted = [row[0] for row in self._db.execute('SELECT query FROM geocodes ORDER BY used LIMIT ?',
+                                                              (self._count - self.size,))]
+                self._db.executemany('DELETE FROM geocodes WHERE query = ?', [(k,) for k in evicted])
+                self._count -= len(evicted)
+
+                for evicted_key in evicted:
+                    self._lru.pop(evicted_key, None)
+
+                debug('Evicted %s geocodes from %s', len(evicted), self.filepath)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _lookup(self, key):
+        now = time()
+
+        with self._lock:
+            if key in self._lru:
+                raw, stored = self._lru[key]
+                if stored >= now - self.ttl:
+                    self._lru.move_to_end(key)
+                    return raw
+                del self._lru[key]
+
+            row = self._db.execute('SELECT raw, stored FROM geocodes WHERE query = ? AND stored >= ?',
+                                   (key, now - self.ttl)).fetchone()
+            if row is None:
+                return None
+
+            with self._db:
+                self._db.execute('UPDATE geocodes SET used = ? WHERE query = ?', (now, key))
+
+            self._remember(key, *row)
+            return row[0]
+
+    def _remember(self, key, raw, stored):
+        self._lru[key] = raw, stored
+        self._lru.move_to_end(key)
+
+        while len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+
+def lookup(service, query, retries=GEOCODE_RETRIES, backoff=GEOCODE_BACKOFF, bucket=None, quota=None):
+    """
+    Ask the geocoding service about a query. Timeouts are retried with an
+    exponential backoff. Every request waits for a token from the bucket and
+    is charged to the quota, if any. Return (is_answered, point): is_answered
+    is False when the service gave no answer at all, so that the point is not
+    worth caching.
+    """
+
+    for attempt in range(retries):
+        if quota is not None and not quota.spend():
+            raise GeocoderQuotaExceeded('Spent the daily budget of %s requests' % quota.limit)
+        if bucket is not None:
+            bucket.acquire()
+
+        try:
+            point = service.geocode(query)
+
+        except GeocoderQuotaExceeded:
+            raise
+
+        except (GeocoderTimedOut, GeocoderUnavailable) as e:
+            debug('Google failed on %s (%s), attempt %s', query, e, attempt + 1)
+            sleep(backoff * 2 ** attempt)
+            continue
+
+        except GeopyError as e:
+            warning('Error geocoding %s (%s)', query, e)
+            return False, None
+
+        if not point:
+            warning('Error geocoding %s (Google returned empty object)', query)
+        elif 'partial_match' in point.raw.keys():
+            warning('Google partly matched %s', query)
+        else:
+            debug('Google matched %s', query)
+
+        return True, point
+
+    warning('Google timed out %s times. Giving up on %s', retries, query)
+    return False, None
+
+
+class TokenBucket(object):
+    """ Let no more than rate requests per second through, in bursts of burst at most. """
+
+    def __init__(self, rate=GEOCODE_RATE, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._last = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            sleep(wait)
+
+
+class Quota(object):
+    """ A daily budget of requests, shared by all runs of the day when it is kept on disk. """
+
+    def __init__(self, limit=GEOCODE_QUOTA, filepath=None):
+        self.limit = limit
+        self._lock = Lock()
+        self._spent = dict()
+        self._db = None
+
+        if filepath:
+            self._db = connect(filepath, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS quota (day TEXT PRIMARY KEY, requests INTEGER NOT NULL)')
+            self._db.commit()
+
+    def __repr__(self):
+        return '<Quota: %s/%s requests today>' % (self.spent, self.limit)
+
+    @property
+    def spent(self):
+        with self._lock:
+            return self._today()
+
+    @property
+    def remaining(self):
+        return max(0, self.limit - self.spent)
+
+    def spend(self):
+        with self._lock:
+            today = date.today().isoformat()
+            spent = self._today()
+
+            if spent >= self.limit:
+                return False
+
+            self._spent = {today: spent + 1}
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO quota VALUES (?, ?)', (today, spent + 1))
+
+            return True
+
+    def _today(self):
+        today = date.today().isoformat()
+
+        if today not in self._spent:
+            row = None
+            if self._db is not None:
+                row = self._db.execute('SELECT requests FROM quota WHERE day = ?', (today,)).fetchone()
+            self._spent = {today: row[0] if row else 0}
+
+        return self._spent[today]
+
+
+class BatchGeocoder(object):
+    """
+    Resolve many queries at once: each distinct query is looked up in the
+    cache first and the rest are sent to the service by a pool of threads,
+    within the rate limit and the daily quota. Once the quota is spent, the
+    remaining queries are left unresolved.
+    """
+
+    def __init__(self, service=None, cache=None, workers=GEOCODE_THREADS, bucket=None, quota=None,
+                 retries=GEOCODE_RETRIES, backoff=GEOCODE_BACKOFF):
+        self.service = service
+        self.cache = cache
+        self.workers = workers
+        self.bucket = bucket or TokenBucket()
+        self.quota = quota
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.is_exhausted = False
+        self._lock = Lock()
+
+    def __repr__(self):
+        return '<BatchGeocoder: %s requests%s>' % (self.requests, ', exhausted' if self.is_exhausted else '')
+
+    def geocode(self, queries):
+        """ Return a dictionary of points (or None) for every distinct query. """
+
+        points = dict()
+        missing = list()
+
+        for query_ in sorted(set(queries)):
+            is_known, point = self.cache.get(query_) if self.cache is not None else (False, None)
+            if is_known:
+                points[query_] = point
+            else:
+                missing.append(query_)
+
+        if self.workers > 1 and len(missing) > 1:
+            with ThreadPoolExecutor(min(self.workers, len(missing))) as pool:
+                points.update(zip(missing, pool.map(self._resolve, missing)))
+        else:
+            points.update(zip(missing, map(self._resolve, missing)))
+
+        debug('Geocoded %s queries (%s from cache)', len(points), len(points) - len(missing))
+
+        return points
+
+    def _resolve(self, query_):
+        if self.is_exhausted:
+            return None
+
+        service = self.service or google()
+
+        try:
+            with self._lock:
+                self.requests += 1
+            is_answered, point = lookup(service, query_, retries=self.retries, backoff=self.backoff,
+                                        bucket=self.bucket, quota=self.quota)
+
+        except GeocoderQuotaExceeded as e:
+            if not self.is_exhausted:
+                warning('Stopped geocoding: %s', e)
+            self.is_exhausted = True
+            return None
+
+        if is_answered and self.cache is not None:
+            self.cache.put(query_, point)
+
+        return point
@@ -0,0 +1,161 @@
+""" The index module keeps track of the webpages stored in the user archive. """
+
+
+from os import listdir
+from os.path import join, isfile, getsize
+from sqlite3 import connect
+from threading import Lock
+from hashlib import sha1
+from datetime import datetime
+from logging import debug
+
+from m5.settings import INDEX_FILENAME
+from m5.pack import Packs, JOB_FILE, DATE_FORMAT
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    date TEXT NOT NULL,
+    uuid TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    scraped INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, uuid)
+);
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    jobs INTEGER NOT NULL,
+    checked TEXT NOT NULL
+);
+"""
+
+# A day is empty when the company website listed no
+# jobs and complete once all its jobs are archived.
+EMPTY = 'empty'
+COMPLETE = 'complete'
+
+
+def _day(text):
+    return datetime.strptime(text, DATE_FORMAT).date()
+
+
+def digest(content):
+    return sha1(content).hexdigest()
+
+
+class ArchiveIndex(object):
+    """
+    An on-disk index of the archive: which uuids are cached for each
+    date, along with their size, content hash and scrape status, and
+    which days are known to be empty or completely downloaded. The
+    index is kept up to date by the spider, page by page, and it can
+    be rebuilt from the archive folder at any time.
+    """
+
+    def __init__(self, archive, packs=None):
+        self._archive = archive
+        self._packs = packs or Packs(archive)
+        self._filepath = join(archive, INDEX_FILENAME)
+        self._lock = Lock()
+
+        is_new = not isfile(self._filepath)
+        self._db = connect(self._filepath, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+        if is_new:
+            self.rebuild()
+
+    def __repr__(self):
+        return '<ArchiveIndex: %s>' % self._filepath
+
+    def add(self, day, uuid, content):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, 0)',
+                             (day.strftime(DATE_FORMAT), uuid, len(content), digest(content)))
+
+    def mark_scraped(self, day, uuid):
+        with self._lock, self._db:
+            self._db.execute('UPDATE pages SET scraped = 1 WHERE date = ? AND uuid = ?',
+                             (day.strftime(DATE_FORMAT), uuid))
+
+    def mark_day(self, day, status, jobs=0):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)',
+                             (day.strftime(DATE_FORMAT), status, jobs, datetime.now().isoformat()))
+
+    def status(self, day):
+        return self.days(day, day).get(day)
+
+    def days(self, start, stop):
+        """ Return the status of each known day from start to stop (included). """
+
+        with self._lock:
+            rows = self._db.execute('SELECT date, status FROM days WHERE date BETWEEN ? AND ?',
+                                    (start.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT))).fetchall()
+
+        return {_day(day): status for day, status in rows}
+
+    def uuids(self, day):
+        return self.lookup(day, day).get(day, [])
+
+    def lookup(self, start, stop):
+        """ Return the cached uuids of each day from start to stop (included). """
+
+        with self._lock:
+            rows = self._db.execute('SELECT date, uuid FROM pages WHERE date BETWEEN ? AND ? ORDER BY date, uuid',
+                                    (start.strftime(DATE_FORMAT), stop.strftime(DATE_FORMAT))).fetchall()
+
+        cached = dict()
+        for day, uuid in rows:
+            cached.setdefault(_day(day), []).append(uuid)
+
+        return cached
+
+    def pages(self):
+        """ Return (date, uuid, size, hash, scraped) for every page in the index. """
+
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM pages ORDER BY date, uuid').fetchall()
+
+        return [(_day(day), uuid, size, hash_, bool(scraped)) for day, uuid, size, hash_, scraped in rows]
+
+    def rebuild(self):
+        """
+        Repair the index from the job files and packs in the archive folder.
+        Unchanged pages keep their scrape status. Complete days that lost
+        webpages in the meantime are forgotten.
+        """
+
+        with self._lock:
+            scraped = set(self._db.execute('SELECT date, uuid, hash FROM pages WHERE scraped = 1'))
+            pages = dict()
+
+            for day, uuid, content in self._packs.items():
+                pages[(day.strftime(DATE_FORMAT), uuid)] = len(content), digest(content)
+
+            # Job files take precedence over packs,
+            # just like they do for the spider.
+            for filename in sorted(listdir(self._archive)):
+                matched = JOB_FILE.match(filename)
+                if matched:
+                    filepath = join(self._archive, filename)
+                    with open(filepath, 'rb') as f:
+                        pages[matched.groups()] = getsize(filepath), digest(f.read())
+
+            rows = [(day, uuid, size, hash_, (day, uuid, hash_) in scraped)
+                    for (day, uuid), (size, hash_) in sorted(pages.items())]
+
+            with self._db:
+                self._db.execute('DELETE FROM pages')
+                self._db.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?)', rows)
+                self._db.execute('DELETE FROM days WHERE status = ? AND jobs != '
+                                 '(SELECT COUNT(*) FROM pages WHERE pages.date = days.date)', (COMPLETE,))
+
+        debug('Rebuilt %s with %s pages', self._filepath, len(rows))
+
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -8,13 +8,19 @@
                  ^^       ^^
                    Checkins
 
+Checkpoints and checkins have compact integer surrogate keys. Their natural
+keys (the address and the checkin digest) are unique. Rows are written with
+natural keys only: a new checkin knows its checkpoint by address (or by the
+checkpoint relationship) and the archiver looks up the id.
 """
 
 
-from sqlalchemy import Column, ForeignKey, DateTime, String
+from collections import namedtuple
+from sqlalchemy import Column, ForeignKey, DateTime, String, inspect, func, case, cast, select
 from sqlalchemy.types import Integer, Float, Boolean, Enum, UnicodeText
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base, synonym_for
+from sqlalchemy.ext.hybrid import hybrid_property
 from hashlib import md5
 
 from m5.settings import JOB_URL_FORMAT, JOB_FILE_FORMAT, FILE_DATE_FORMAT, URL_DATE_FORMAT
@@ -22,6 +28,23 @@ from m5.settings import JOB_URL_FORMAT, JOB_FILE_FORMAT, FILE_DATE_FORMAT, URL_D
 
 Model = declarative_base()
 
+PRICES = ('city_tour', 'overnight', 'loading_service', 'fax_confirm',
+          'extra_stops', 'cancelled_stop', 'client_support')
+
+SCHEMA_VERSION = 2
+
+
+def natural_key(table):
+    """ Return the columns that identify a row: the unique ones, if any, or the primary key. """
+
+    return [column for column in table.columns if column.unique] or list(table.primary_key.columns)
+
+
+def surrogate_key(table):
+    """ Return the primary key columns of a table identified by other columns. """
+
+    return [] if natural_key(table) == list(table.primary_key.columns) else list(table.primary_key.columns)
+
 
 class Client(Model):
     __tablename__ = 'clients'
@@ -44,7 +67,7 @@ class Order(Model):
     __tablename__ = 'orders'
 
     order_id = Column(Integer, primary_key=True, autoincrement=False)
-    client_id = Column(Integer, ForeignKey('clients.client_id'), nullable=False)
+    client_id = Column(Integer, ForeignKey('clients.client_id'), nullable=False, index=True)
 
     type = Column(Enum('city_tour', 'overnight', 'loading_service'))
     city_tour = Column(Float)
@@ -57,9 +80,9 @@ class Order(Model):
     client_support = Column(Float)
     distance = Column(Float)
     cash = Column(Boolean)
-    date = Column(DateTime)
+    date = Column(DateTime, index=True)
     uuid = Column(Integer)
-    user = Column(UnicodeText)
+    user = Column(UnicodeText, index=True)
 
     client = relationship('Client', backref=backref('orders'))
 
@@ -82,23 +105,74 @@ class Order(Model):
     def id(self):
         return self.order_id
 
-    @property
+    @hybrid_property
     def price(self):
-        total = sum([self.city_tour,
-                     self.overnight,
-                     self.loading_service,
-                     self.fax_confirm,
-                     self.extra_stops,
-                     self.cancelled_stop,
-                     self.client_support])
-        if total is not None:
-            return total
+        return sum(getattr(self, price) or 0.0 for price in PRICES)
+
+    @price.inplace.expression
+    @classmethod
+    def _price_expression(cls):
+        return sum((func.coalesce(getattr(cls, price), 0.0) for price in PRICES[1:]),
+                   func.coalesce(getattr(cls, PRICES[0]), 0.0))
+
+    @hybrid_property
+    def earnings(self):
+        """ The price and the pay for waiting: what the order earned. """
+
+        return self.price + (self.waiting_time or 0.0)
+
+    @earnings.inplace.expression
+    @classmethod
+    def _earnings_expression(cls):
+        return cls.price + func.coalesce(cls.waiting_time, 0.0)
+
+    @hybrid_property
+    def per_km(self):
+        """ The earnings per kilometer, if the distance is known. """
+
+        if self.distance:
+            return self.earnings / self.distance
+
+    @per_km.inplace.expression
+    @classmethod
+    def _per_km_expression(cls):
+        return cls.earnings / func.nullif(cls.distance, 0)
+
+    @hybrid_property
+    def wait_share(self):
+        """ The share of the earnings paid for waiting. """
+
+        if self.earnings:
+            return (self.waiting_time or 0.0) / self.earnings
+
+    @wait_share.inplace.expression
+    @classmethod
+    def _wait_share_expression(cls):
+        return func.coalesce(cls.waiting_time, 0.0) / func.nullif(cls.earnings, 0)
 
 
 class CheckinError(Exception):
     pass
 
 
+# We hash all attributes to bootstrap an ID
+# because no single attribute does the job.
+def checkin_digest(checkin):
+    h = md5()
+
+    try:
+        h.update(bytes(checkin.address or checkin.checkpoint.checkpoint_id, 'utf-8'))
+        h.update(bytes(str(checkin.order_id), 'utf-8'))
+        h.update(bytes(checkin.purpose, 'utf-8'))
+        h.update(bytes(str(checkin.after_), 'utf-8'))
+        h.update(bytes(str(checkin.until), 'utf-8'))
+        h.update(bytes(str(checkin.timestamp), 'utf-8'))
+    except (TypeError, AttributeError) as e:
+        raise CheckinError(e)
+
+    return h.hexdigest()
+
+
 class Checkin(Model):
     __tablename__ = 'checkins'
 
@@ -106,9 +180,10 @@ class Checkin(Model):
         super(Checkin, self).__init__(**kwargs)
         self.checkin_id = self.hexdigest
 
-    checkin_id = Column(String, primary_key=True)
-    checkpoint_id = Column(Integer, ForeignKey('checkpoints.checkpoint_id'), nullable=False)
-    order_id = Column(Integer, ForeignKey('orders.order_id'), nullable=False)
+    id = Column(Integer, primary_key=True)
+    checkin_id = Column(String, nullable=False, unique=True)
+    checkpoint_id = Column(Integer, ForeignKey('checkpoints.id'), nullable=False, index=True)
+    order_id = Column(Integer, ForeignKey('orders.order_id'), nullable=False, index=True)
     purpose = Column(Enum('pickup', 'dropoff', 'stopover'))
     timestamp = Column(DateTime)
     after_ = Column(DateTime)
@@ -117,39 +192,26 @@ class Checkin(Model):
     checkpoint = relationship('Checkpoint', backref=backref('checkins'))
     order = relationship('Order', backref=backref('checkins'))
 
+    # The address of the checkpoint, which stands in for
+    # checkpoint_id until the checkin is archived. It is
+    # not a column: the archiver looks the id up with it.
+    address = None
+
     def __str__(self):
         return 'Checkin(%s %s)' % (self.purpose or 'Purpose?', self.timestamp or 'Timestamp?')
 
     __repr__ = __str__
 
-    @synonym_for('checkin_id')
-    @property
-    def id(self):
-        return self.checkin_id
-
-    # We hash all attributes to bootstrap an ID
-    # because no single attribute does the job.
     @property
     def hexdigest(self):
-        h = md5()
-
-        try:
-            h.update(bytes(self.checkpoint_id, 'utf-8'))
-            h.update(bytes(str(self.order_id), 'utf-8'))
-            h.update(bytes(self.purpose, 'utf-8'))
-            h.update(bytes(str(self.after_), 'utf-8'))
-            h.update(bytes(str(self.until), 'utf-8'))
-            h.update(bytes(str(self.timestamp), 'utf-8'))
-        except TypeError as e:
-            raise CheckinError(e)
-
-        return h.hexdigest()
+        return checkin_digest(self)
 
 
 class Checkpoint(Model):
     __tablename__ = 'checkpoints'
 
-    checkpoint_id = Column(UnicodeText, primary_key=True, autoincrement=False)
+    id = Column(Integer, primary_key=True)
+    checkpoint_id = Column(UnicodeText, nullable=False, unique=True)
     lat = Column(Float)
     lon = Column(Float)
     city = Column(UnicodeText)
@@ -167,11 +229,6 @@ class Checkpoint(Model):
 
     __repr__ = __str__
 
-    @synonym_for('checkpoint_id')
-    @property
-    def id(self):
-        return self.checkpoint_id
-
     @synonym_for('checkpoint_id')
     @property
     def address(self):
@@ -181,3 +238,133 @@ class Checkpoint(Model):
     def is_geocoded(self):
         if self.lat and self.lon:
             return True
+
+
+# Aggregates and groupings of the orders, computed inside SQLite.
+# Earnings are the price plus the pay for waiting, and shares
+# are ratios of the totals. Weeks are named after their monday,
+# like the summaries. Orders are dated by the day only, so hours
+# are those of the first pickup.
+_pickup = select(func.min(Checkin.timestamp)).where(
+    Checkin.order_id == Order.order_id, Checkin.purpose == 'pickup').correlate(Order).scalar_subquery()
+
+METRICS = {
+    'jobs': func.count(Order.order_id),
+    'price': func.sum(Order.price),
+    'waiting_time': func.sum(func.coalesce(Order.waiting_time, 0.0)),
+    'earnings': func.sum(Order.earnings),
+    'distance': func.sum(Order.distance),
+    'per_km': func.sum(Order.earnings) / func.nullif(func.sum(Order.distance), 0),
+    'wait_share': func.sum(func.coalesce(Order.waiting_time, 0.0)) / func.nullif(func.sum(Order.earnings), 0),
+    'cash_share': func.avg(case((Order.cash, 1.0), else_=0.0)),
+}
+
+GROUPS = {
+    'day': func.date(Order.date),
+    'week': func.date(Order.date, '-6 days', 'weekday 1'),
+    'month': func.strftime('%Y-%m', Order.date),
+    'year': func.strftime('%Y', Order.date),
+    'weekday': cast(func.strftime('%w', Order.date), Integer),
+    'hour': cast(func.strftime('%H', _pickup), Integer),
+    'client': Order.client_id,
+    'type': Order.type,
+    'user': Order.user,
+}
+
+
+def aggregate(db, by=(), metrics=('jobs', 'earnings'), where=(), order_by=None, descending=False, limit=None):
+    """
+    Return orders grouped by the names in by (see GROUPS), with the named
+    metrics (see METRICS), as rows labelled with those names. Rows are
+    filtered with the SQL expressions in where and ordered by a group or a
+    metric name, the groups by default.
+    """
+
+    if isinstance(by, str):
+        by = (by,)
+
+    groups = [GROUPS[name].label(name) for name in by]
+    columns = [METRICS[name].label(name) for name in metrics]
+    statement = select(*groups, *columns).where(*where).group_by(*groups)
+
+    if order_by is not None:
+        ordering = statement.selected_columns[order_by] if isinstance(order_by, str) else order_by
+        statement = statement.order_by(ordering.desc() if descending else ordering)
+    else:
+        statement = statement.order_by(*groups)
+
+    if limit is not None:
+        statement = statement.limit(limit)
+
+    return db.execute(statement).all()
+
+
+# Foreign keys that new rows give as the natural key of the referenced row, in a non-column attribute.
+REFERENCES = {'checkins': {'checkpoint_id': 'address'}}
+
+
+def references(table):
+    """ Return the attributes that hold the natural key of a referenced row, by foreign key column. """
+
+    return REFERENCES.get(table.name, {})
+
+
+class Record(object):
+    """
+    A table row as a plain named tuple, without the instrumentation of the
+    model it stands for. Records are cheap to build and to throw away: the
+    model instance or the insert parameters are only made when needed.
+    """
+
+    __slots__ = ()
+
+    model = None
+    table = None
+    columns = ()
+    natural_key = ()
+    surrogates = ()
+    references = {}
+
+    @property
+    def key(self):
+        return tuple(getattr(self, name) for name in self.natural_key)
+
+    def params(self):
+        """ Return the insert parameters, without the surrogate key and the references. """
+
+        return {column: value for column, value in zip(self.columns, self) if column is not None}
+
+    def to_model(self):
+        # Foreign keys given by reference are left unset, like in the models.
+        unset = set(self.surrogates) | {field for field in self.references if getattr(self, field) is None}
+        return self.model(**{field: value for field, value in zip(self._fields, self) if field not in unset})
+
+
+def _record(model):
+    mapper = inspect(model)
+    attributes = [attribute.key for attribute in mapper.column_attrs]
+    extra = list(references(model.__table__).values())
+    base = namedtuple(model.__name__ + 'Record', attributes + extra, defaults=(None,) * len(attributes + extra))
+
+    surrogates = surrogate_key(model.__table__)
+
+    return type(base.__name__, (base, Record), {
+        '__slots__': (),
+        'model': model,
+        'table': model.__table__,
+        'columns': tuple(None if attribute.columns[0] in surrogates else attribute.columns[0].name
+                         for attribute in mapper.column_attrs) + (None,) * len(extra),
+        'natural_key': tuple(mapper.get_property_by_column(column).key
+                             for column in natural_key(model.__table__)),
+        'surrogates': tuple(mapper.get_property_by_column(column).key for column in surrogates),
+        'references': {mapper.get_property_by_column(model.__table__.c[column]).key: attribute
+                       for column, attribute in references(model.__table__).items()},
+    })
+
+
+ClientRecord = _record(Client)
+OrderRecord = _record(Order)
+CheckpointRecord = _record(Checkpoint)
+CheckinRecord = _record(Checkin)
+
+RECORDS = {record.model: record for record in (ClientRecord, OrderRecord, CheckpointRecord, CheckinRecord)}
@@ -0,0 +1,199 @@
+""" The pack module stores job webpages in compressed monthly containers instead of one file per job. """
+
+
+from os import listdir, remove
+from os.path import join, isfile, getsize
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from threading import Lock
+from zlib import compress, decompress
+from datetime import datetime
+from logging import debug, warning
+from re import compile
+
+from m5.settings import PACK_FILE_FORMAT, PACK_COMPRESSION
+
+
+# Each record is a header (date, uuid, payload length)
+# followed by the zlib compressed webpage. Records are
+# only ever appended, so the last copy of a job wins.
+HEADER = Struct('<10s7sI')
+
+PACK_FILE = compile(r'^\d{4}-\d{2}\.pack$')
+JOB_FILE = compile(r'^(\d{4}-\d{2}-\d{2})-uuid-(\d{7})\.html$')
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def _day(text):
+    return datetime.strptime(text, DATE_FORMAT).date()
+
+
+class Pack(object):
+    """
+    A month of job webpages appended to a single file. The offset table
+    is built from the record headers the first time the pack is read and
+    webpages are served from a read-only memory map of the file.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = Lock()
+        self._offsets = None
+        self._map = None
+
+    def __repr__(self):
+        return '<Pack: %s>' % self.filepath
+
+    def __len__(self):
+        with self._lock:
+            return len(self._table())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._table()
+
+    def keys(self):
+        with self._lock:
+            return sorted(self._table())
+
+    def get(self, day, uuid):
+        key = day.strftime(DATE_FORMAT), uuid
+
+        with self._lock:
+            if key not in self._table():
+                return None
+
+            offset, length = self._offsets[key]
+            if self._map is None or offset + length > len(self._map):
+                self._remap()
+
+            return decompress(self._map[offset:offset + length])
+
+    def put(self, day, uuid, content):
+        key = day.strftime(DATE_FORMAT), uuid
+        payload = compress(content, PACK_COMPRESSION)
+
+        with self._lock:
+            self._table()
+
+            with open(self.filepath, 'ab') as f:
+                offset = f.tell() + HEADER.size
+                f.write(HEADER.pack(key[0].encode(), uuid.encode(), len(payload)))
+                f.write(payload)
+
+            self._offsets[key] = offset, len(payload)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            self._map = None
+            self._offsets = None
+
+    def _table(self):
+        if self._offsets is None:
+            self._offsets = {}
+            self._remap()
+
+            position = 0
+            size = len(self._map) if self._map is not None else 0
+
+            while position + HEADER.size <= size:
+                day, uuid, length = HEADER.unpack_from(self._map, position)
+                position += HEADER.size
+
+                if position + length > size:
+                    warning('Truncated record at byte %s in %s', position, self.filepath)
+                    break
+
+                self._offsets[(day.decode(), uuid.decode())] = position, length
+                position += length
+
+            debug('Read %s webpages from %s', len(self._offsets), self.filepath)
+
+        return self._offsets
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        if isfile(self.filepath) and getsize(self.filepath):
+            with open(self.filepath, 'rb') as f:
+                self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+
+class Packs(object):
+    """ All the monthly packs of an archive folder, opened on demand. """
+
+    def __init__(self, archive):
+        self._archive = archive
+        self._packs = dict()
+        self._lock = Lock()
+
+    def __repr__(self):
+        return '<Packs: %s>' % self._archive
+
+    def pack(self, day):
+        filename = PACK_FILE_FORMAT.format(month=day.strftime('%Y-%m'))
+
+        with self._lock:
+            if filename not in self._packs:
+                self._packs[filename] = Pack(join(self._archive, filename))
+            return self._packs[filename]
+
+    def get(self, day, uuid):
+        return self.pack(day).get(day, uuid)
+
+    def put(self, day, uuid, content):
+        self.pack(day).put(day, uuid, content)
+
+    def items(self):
+        """ Generate (date, uuid, content) for every webpage in every pack. """
+
+        for filename in sorted(listdir(self._archive)):
+            if PACK_FILE.match(filename):
+                day = _day(filename[:7] + '-01')
+                pack = self.pack(day)
+
+                for date_string, uuid in pack.keys():
+                    yield _day(date_string), uuid, pack.get(_day(date_string), uuid)
+
+    def close(self):
+        with self._lock:
+            for pack in self._packs.values():
+                pack.close()
+
+
+def pack_archive(archive, packs=None):
+    """
+    Move every job webpage of a file-per-job archive into monthly packs.
+    Each file is only deleted once its content reads back identical from
+    the pack. Return the number of webpages converted.
+    """
+
+    packs = packs or Packs(archive)
+    converted = 0
+
+    for filename in sorted(listdir(archive)):
+        matched = JOB_FILE.match(filename)
+
+        if matched:
+            day, uuid = _day(matched.group(1)), matched.group(2)
+            filepath = join(archive, filename)
+
+            with open(filepath, 'rb') as f:
+                content = f.read()
+
+            if packs.get(day, uuid) != content:
+                packs.put(day, uuid, content)
+
+            if packs.get(day, uuid) == content:
+                remove(filepath)
+                converted += 1
+            else:
+                warning('Could not pack %s', filepath)
+
+    debug('Packed %s webpages in %s', converted, archive)
+
+    return converted
@@ -2,15 +2,17 @@
 
 
 from logging import warning, debug
+from hashlib import blake2b
 from datetime import datetime
 from time import strptime
-from geopy import GoogleV3
-from geopy.exc import GeopyError, GeocoderQuotaExceeded, GeocoderTimedOut
-from sqlalchemy import inspect
+from sqlalchemy import inspect, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.exc import IntegrityError
 
-from m5.model import Checkin, Checkpoint, Client, Order
-from m5.settings import GOOGLE_API_KEY
+from m5 import summary
+from m5.geocoder import google, lookup, query
+from m5.model import Model, Checkin, Checkpoint, Client, Order, Record, RECORDS
+from m5.model import checkin_digest, natural_key, references, surrogate_key
 
 
 def _boolean(value):
@@ -77,27 +79,196 @@ def _timestamp(day, time):
 
 def archive(db, rows):
     """
-    Take table objects from the processor, merge and commit them to the database.
+    Take table objects (or records) from the processor and commit them
+    to the database. Rows are merged on their natural keys, so the rows
+    of a single job go through the bulk archiver too. Return the number
+    of inserted and skipped rows.
     """
 
-    skipped = 0
+    return bulk_archive(db, rows)
+
+
+class ArchivedKeys(object):
+    """
+    The natural keys of every table in the database, loaded once and kept up
+    to date by the bulk archiver, so that rows known to be archived already
+    are dropped before any SQL is issued. Integer keys are kept as they are
+    and other keys as 64-bit digests, which keeps large histories compact.
+    """
+
+    def __init__(self, db=None):
+        self._keys = {table.name: set() for table in Model.metadata.sorted_tables}
+
+        if db is not None:
+            for table in Model.metadata.sorted_tables:
+                columns = natural_key(table)
+                self._keys[table.name].update(self._compact(tuple(row)) for row in db.execute(select(*columns)))
+
+            debug('Loaded %s', self)
+
+    def __repr__(self):
+        counts = ', '.join('%s %s' % (len(keys), name) for name, keys in self._keys.items())
+        return '<ArchivedKeys: %s>' % counts
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+    def known(self, table, key):
+        return self._compact(key) in self._keys[table.name]
+
+    def add(self, table, key):
+        self._keys[table.name].add(self._compact(key))
+
+    @staticmethod
+    def _compact(key):
+        if len(key) == 1 and isinstance(key[0], int):
+            return key[0]
+
+        text = key[0] if len(key) == 1 else repr(key)
+        return int.from_bytes(blake2b(str(text).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def bulk_archive(db, rows, keys=None):
+    """
+    Take the table objects (or records) of many jobs and commit them in one transaction.
+    Rows are deduplicated by natural key (the last one wins, like a merge)
+    and each table is written with batched upserts. References by natural
+    key are swapped for the surrogate keys of the rows they point at. Rows
+    that were already in the database, or twice in the batch, count as
+    skipped. With a set of archived keys, known rows are skipped right away,
+    without being updated.
+    If the batch breaks a constraint, it is written again record by record,
+    leaving out the culprits. Return the number of inserted and skipped rows.
+    """
+
+    tables = {table: dict() for table in Model.metadata.sorted_tables}
 
     for row in rows:
-        state = db.merge(row)
-        if not inspect(state).pending:
-            debug('Row is already in db: %s', row)
-            skipped += 1
+        if isinstance(row, Record):
+            table, values = row.table, row.params()
         else:
-            try:
-                db.flush()
-            except IntegrityError as e:
-                db.rollback()
-                warning('Rolled back %s (%s)', row, e)
-                skipped += 1
+            state = inspect(row)
+            table, values = state.mapper.local_table, _params(state)
+
+        for column, attribute in references(table).items():
+            if values.get(column) is None:
+                values.pop(column, None)
+                values[attribute] = getattr(row, attribute)
+
+        key = tuple(values.get(column.name) for column in natural_key(table))
+
+        if keys is not None and keys.known(table, key):
+            continue
+
+        tables[table][key] = values
+
+    inserted = 0
+
+    try:
+        for table, unique in tables.items():
+            if unique:
+                inserted += _write(db, table, list(unique.values()))
+        db.commit()
+
+        if keys is not None:
+            for table, unique in tables.items():
+                for key in unique:
+                    keys.add(table, key)
+
+    except IntegrityError as e:
+        db.rollback()
+        warning('Rolled back a batch of %s rows (%s)', len(rows), e)
+        inserted = 0
+
+        for table, unique in tables.items():
+            for key, record in unique.items():
+                try:
+                    inserted += _write(db, table, [record])
+                    db.commit()
+                    if keys is not None:
+                        keys.add(table, key)
+                except IntegrityError as e:
+                    db.rollback()
+                    warning('Rolled back %s %s (%s)', table.name, record, e)
+
+    debug('Committed rows in bulk: skipped %s / inserted %s', len(rows) - inserted, inserted)
+
+    return inserted, len(rows) - inserted
 
-    db.commit()
 
-    debug('Committed rows: skipped %s / inserted %s', skipped, len(rows)-skipped)
+def _params(state):
+    surrogates = surrogate_key(state.mapper.local_table)
+    return {attribute.columns[0].name: state.dict[attribute.key]
+            for attribute in state.mapper.column_attrs
+            if attribute.key in state.dict and attribute.columns[0] not in surrogates}
+
+
+def _write(db, table, records):
+    records = _resolve(db, table, records)
+    columns = list(table.columns) if table is Order.__table__ else natural_key(table)
+    existing = _existing(db, table, records, columns)
+    _upsert(db, table, records)
+
+    if table is Order.__table__:
+        summary.update(db, records, existing)
+
+    return len(records) - len(existing)
+
+
+def _resolve(db, table, records):
+    # Swap natural keys for the surrogate keys they stand for, on copies,
+    # because a batch that is rolled back is written again from scratch.
+    for column, attribute in references(table).items():
+        foreign_key, = table.c[column].foreign_keys
+        target = foreign_key.column
+        natural = natural_key(target.table)[0]
+        values = list({record[attribute] for record in records if attribute in record})
+        ids = dict()
+
+        for i in range(0, len(values), 500):
+            ids.update(db.execute(select(natural, target).where(natural.in_(values[i:i + 500]))).all())
+
+        records = [_swap(record, column, attribute, ids) if attribute in record else record for record in records]
+
+    return records
+
+
+def _swap(record, column, attribute, ids):
+    record = dict(record)
+    record[column] = ids.get(record.pop(attribute))
+    return record
+
+
+def _existing(db, table, records, columns):
+    keys = natural_key(table)
+    values = [tuple(record[key.name] for key in keys) for record in records]
+    column = keys[0] if len(keys) == 1 else tuple_(*keys)
+    existing = []
+
+    # Stay well below the limit on SQL variables
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        parameters = [value[0] for value in chunk] if len(keys) == 1 else chunk
+        existing.extend(db.execute(select(*columns).where(column.in_(parameters))).mappings())
+
+    return existing
+
+
+def _upsert(db, table, records):
+    groups = dict()
+    for record in records:
+        groups.setdefault(tuple(sorted(record)), []).append(record)
+
+    keys = [key.name for key in natural_key(table)]
+
+    for columns, group in groups.items():
+        statement = insert(table)
+        updates = {column: statement.excluded[column] for column in columns if column not in keys}
+        if updates:
+            statement = statement.on_conflict_do_update(index_elements=keys, set_=updates)
+        else:
+            statement = statement.on_conflict_do_nothing()
+        db.execute(statement, group)
 
 
 def _update_address(address, point):
@@ -113,7 +284,7 @@ def _update_address(address, point):
             warning('Google did not return %s', name)
             return default
 
-    address['as_scraped'] = '{address}, {locality}'.format(**address)
+    address['as_scraped'] = query(address)
     address['lat'] = point.point.latitude if point else None
     address['lon'] = point.point.longitude if point else None
     address['address'] = point.address if point else address['address']
@@ -129,57 +300,59 @@ def _update_address(address, point):
     return address
 
 
-def geocode(address, attempt=0):
-    # Google is free up to 2500 requests per day, then 0.50€ per 1000. We don't use
-    # Nominatim because it doesn't like bulk requests. Other services cost money.
-    service = GoogleV3(api_key=GOOGLE_API_KEY)
-
-    query = '{address}, {locality}'.format(**address)
-    point = None
+def geocode(address, cache=None):
+    query_ = query(address)
 
-    if attempt > 2:
-        warning('Google timed out 3 times. Giving up on %s', query)
+    if cache is not None:
+        is_known, point = cache.get(query_)
+        if is_known:
+            debug('Geocoded %s from cache', query_)
+            return point
 
-    else:
-        try:
-            point = service.geocode(query)
+    is_answered, point = lookup(google(), query_)
 
-            if not point:
-                raise GeopyError('Google returned empty object')
+    if cache is not None and is_answered:
+        cache.put(query_, point)
 
-            if 'partial_match' in point.raw.keys():
-                warning('Google partly matched %s', query)
-            else:
-                debug('Google matched %s', query)
+    return point
 
-        except GeocoderQuotaExceeded:
-            raise
 
-        except GeocoderTimedOut:
-            geocode(address, attempt=attempt+1)
+def _model(model, **values):
+    return model(**values)
 
-        except GeopyError as e:
-            warning('Error geocoding %s (%s)', address['address'], e)
 
-    return point
+def _record(model, **values):
+    record = RECORDS[model](**values)
+    if model is Checkin:
+        record = record._replace(checkin_id=checkin_digest(record))
+    return record
 
 
-def process(job, is_offline=False):
+def process(job, is_offline=False, geocodes=None, points=None, checkpoints=None, postcodes=None, records=False):
     """
     In goes raw data from the scraper module.
-    Out come table rows for the SQLAlchemy API.
+    Out come table rows for the SQLAlchemy API,
+    or lightweight records if asked for records.
+    Addresses that match an existing checkpoint reuse it. Others
+    are looked up in the points resolved in bulk when there are
+    some and geocoded through the geocodes cache otherwise. With
+    a postcode map, points are checked against their postcode and
+    unresolved addresses fall back on the postcode centroid.
     """
 
     assert job is not None, 'Cannot package nothingness'
+    make = _record if records else _model
     rows = []
 
-    client = Client(
+    client = make(
+        Client,
         client_id=_number(job.data.info['client_id']),
         name=_text(job.data.info['client_name'])
     )
     rows.append(client)
 
-    order = Order(
+    order = make(
+        Order,
         order_id=_number(job.data.info['order_id']),
         client_id=_number(job.data.info['client_id']),
         distance=_decimal(job.data.info['km']),
@@ -200,13 +373,19 @@ def process(job, is_offline=False):
     rows.append(order)
 
     for address in job.data.addresses:
-        if is_offline:
-            point = None
-        else:
-            point = geocode(address)
+        query_ = query(address)
+        point = checkpoints.get(query_) if checkpoints is not None else None
+
+        if point is None and not is_offline:
+            point = points.get(query_) if points is not None else geocode(address, cache=geocodes)
+
+        if postcodes is not None:
+            point = postcodes.check(address, point)
+
         address = _update_address(address, point)
 
-        checkpoint = Checkpoint(
+        checkpoint = make(
+            Checkpoint,
             checkpoint_id=address['address'],
             place_id=address['place_id'],
             lat=address['lat'],
@@ -222,9 +401,13 @@ def process(job, is_offline=False):
         )
         rows.append(checkpoint)
 
-        checkin = Checkin(
+        if checkpoints is not None:
+            checkpoints.add(checkpoint)
+
+        checkin = make(
+            Checkin,
             timestamp=_timestamp(job.stamp.date, address['timestamp']),
-            checkpoint_id=address['address'],
+            address=address['address'],
             order_id=_number(job.data.info['order_id']),
             purpose=_purpose(address['purpose']),
             after_=_timestamp(job.stamp.date, address['after']),
@@ -0,0 +1,224 @@
+""" The postcodes module geocodes offline with the Berlin postcode shapefile in the assets folder. """
+
+
+from collections import namedtuple, defaultdict
+from functools import lru_cache
+from logging import debug, warning
+from re import compile
+from struct import unpack_from
+from geopy import Location
+
+from m5.settings import SHP_FILEPATH, DBF_FILEPATH, POSTCODE_CELL
+
+
+POLYGON = 5
+POSTCODE = compile(r'\b(\d{5})\b')
+
+
+Postcode = namedtuple('Postcode', ['code', 'name', 'box', 'rings', 'centroid'])
+
+
+def read_polygons(filepath):
+    """ Yield the bounding box and the rings of each record in a polygon shapefile. """
+
+    with open(filepath, 'rb') as f:
+        content = f.read()
+
+    shape_type, = unpack_from('<i', content, 32)
+    if shape_type != POLYGON:
+        raise ValueError('%s holds shapes of type %s, not polygons' % (filepath, shape_type))
+
+    offset = 100
+
+    while offset < len(content):
+        _, length = unpack_from('>ii', content, offset)
+        offset += 8
+        shape_type, = unpack_from('<i', content, offset)
+
+        if shape_type == POLYGON:
+            box = unpack_from('<4d', content, offset + 4)
+            parts, points = unpack_from('<ii', content, offset + 36)
+            starts = unpack_from('<%si' % parts, content, offset + 44)
+            coordinates = unpack_from('<%sd' % (2 * points), content, offset + 44 + 4 * parts)
+
+            vertices = list(zip(coordinates[0::2], coordinates[1::2]))
+            ends = starts[1:] + (points,)
+            yield box, [vertices[start:end] for start, end in zip(starts, ends)]
+
+        else:
+            yield None, []
+
+        offset += 2 * length
+
+
+def read_records(filepath, encoding='latin-1'):
+    """ Yield each record of a dBase file as a dictionary. """
+
+    with open(filepath, 'rb') as f:
+        content = f.read()
+
+    count, header_length, record_length = unpack_from('<IHH', content, 4)
+    fields = []
+    offset = 32
+
+    while content[offset] != 0x0D:
+        name, type_, length = unpack_from('<11sc4xB', content, offset)
+        fields.append((name.split(b'\0')[0].decode('ascii'), type_, length))
+        offset += 32
+
+    for n in range(count):
+        offset = header_length + n * record_length
+
+        # The first byte flags deleted records.
+        if content[offset:offset + 1] == b'*':
+            continue
+
+        offset += 1
+        record = dict()
+
+        for name, type_, length in fields:
+            value = content[offset:offset + length].decode(encoding).strip()
+            if type_ == b'N':
+                value = (float(value) if '.' in value else int(value)) if value else None
+            record[name] = value
+            offset += length
+
+        yield record
+
+
+def centroid(rings):
+    """ Return the (x, y) center of mass of polygon rings, where holes wind the other way. """
+
+    area = x = y = 0.0
+
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            cross = x0 * y1 - x1 * y0
+            area += cross
+            x += (x0 + x1) * cross
+            y += (y0 + y1) * cross
+
+    if not area:
+        xs, ys = zip(*(vertex for ring in rings for vertex in ring))
+        return sum(xs) / len(xs), sum(ys) / len(ys)
+
+    return x / (3 * area), y / (3 * area)
+
+
+def contains(rings, x, y):
+    """ Tell whether a point is inside polygon rings (even-odd rule). """
+
+    is_inside = False
+
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                is_inside = not is_inside
+
+    return is_inside
+
+
+def postcode(address):
+    matched = POSTCODE.search(address.get('locality') or '')
+    if matched:
+        return matched.group(1)
+
+
+class PostcodeMap(object):
+    """
+    The postcode polygons of Berlin, loaded once into a grid of cells. Each
+    cell lists the postcodes whose bounding box overlaps it, so that locating
+    a point only tests a handful of polygons. The map gives the centroid of
+    the postcode of an address when nothing better is known and checks that
+    Google put an address inside its postcode.
+    """
+
+    def __init__(self, shp_filepath=SHP_FILEPATH, dbf_filepath=DBF_FILEPATH, cell=POSTCODE_CELL):
+        self.cell = cell
+        self.postcodes = dict()
+        self._grid = defaultdict(list)
+
+        shapes = dict()
+
+        for (box, rings), record in zip(read_polygons(shp_filepath), read_records(dbf_filepath)):
+            if box is not None:
+                shapes.setdefault(record['PLZ99'], (record['PLZORT99'], []))[1].extend(rings)
+
+        for code, (name, rings) in shapes.items():
+            xs, ys = zip(*(vertex for ring in rings for vertex in ring))
+            box = min(xs), min(ys), max(xs), max(ys)
+            self.postcodes[code] = Postcode(code, name, box, rings, centroid(rings))
+
+            for i in range(self._index(box[0]), self._index(box[2]) + 1):
+                for j in range(self._index(box[1]), self._index(box[3]) + 1):
+                    self._grid[(i, j)].append(self.postcodes[code])
+
+        debug('Loaded %s postcodes from %s', len(self.postcodes), shp_filepath)
+
+    def __repr__(self):
+        return '<PostcodeMap: %s postcodes>' % len(self.postcodes)
+
+    def __contains__(self, code):
+        return code in self.postcodes
+
+    def locate(self, lat, lon):
+        """ Return the postcode at these coordinates or None outside the map. """
+
+        for candidate in self._grid.get((self._index(lon), self._index(lat)), ()):
+            x0, y0, x1, y1 = candidate.box
+            if x0 <= lon <= x1 and y0 <= lat <= y1 and contains(candidate.rings, lon, lat):
+                return candidate.code
+
+    def geocode(self, address):
+        """ Place an address at the centroid of its postcode, if the postcode is on the map. """
+
+        code = postcode(address)
+        if code not in self.postcodes:
+            return None
+
+        lon, lat = self.postcodes[code].centroid
+        raw = {
+            'formatted_address': address['address'],
+            'place_id': None,
+            'partial_match': True,
+            'geometry': {'location': {'lat': lat, 'lng': lon}},
+            'address_components': [
+                {'long_name': code, 'short_name': code, 'types': ['postal_code']},
+                {'long_name': 'Berlin', 'short_name': 'Berlin', 'types': ['locality', 'political']},
+                {'long_name': 'Germany', 'short_name': 'DE', 'types': ['country', 'political']},
+            ]
+        }
+
+        debug('Placed %s at the centroid of %s', address['address'], code)
+        return Location(address['address'], (lat, lon), raw)
+
+    def check(self, address, point):
+        """
+        Return the point if it is plausible and the centroid of the postcode
+        of the address otherwise: when there is no point at all or when an
+        address with a Berlin postcode was placed outside Berlin. Points in
+        the wrong postcode are kept, because postcodes are often mistyped.
+        """
+
+        if point is None:
+            return self.geocode(address)
+
+        code = postcode(address)
+        found = self.locate(point.latitude, point.longitude)
+
+        if found is None and code in self.postcodes:
+            warning('Google placed %s outside Berlin', address['address'])
+            return self.geocode(address)
+
+        if found is not None and code is not None and found != code:
+            warning('Google placed %s in %s instead of %s', address['address'], found, code)
+
+        return point
+
+    def _index(self, degrees):
+        return int(degrees // self.cell)
+
+
+@lru_cache(maxsize=1)
+def berlin():
+    return PostcodeMap()
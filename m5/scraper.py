@@ -1,10 +1,15 @@
 """ The scraper module extracts data from webpages. """
 
 
-from re import search, compile
+from re import compile, escape
+from collections import namedtuple
 from logging import debug, warning
-from m5.spider import Stamped, RawData
-from m5.settings import SEPERATOR, FAILURE_REPORT
+from hashlib import sha1
+from json import dumps, loads
+from sqlite3 import connect
+from threading import Lock
+from m5.spider import Stamped, RawData, Webpage
+from m5.settings import SEPERATOR, FAILURE_REPORT, FAST_SCRAPE
 
 
 BLUEPRINTS = {
@@ -136,59 +141,205 @@ PRICE_CATEGORIES = {
 }
 
 
-def scrape(job):
+MOJIBAKE = [
+    ('Ã¼', 'ü'),
+    ('Ã¤', 'ä'),
+    ('Ã¶', 'ö'),
+    ('Ã©', 'é'),
+    ('â¬', '€'),
+    ('Ã', 'ß'),
+    ('Ã', 'Ö'),
+]
+
+PRICE = compile(r'(\d+,\d{2})$')
+
+Field = namedtuple('Field', ('name', 'default', 'variant', 'pattern', 'optional'))
+Fragment = namedtuple('Fragment', ('tag', 'attrs', 'fields'))
+Plan = namedtuple('Plan', ('fragments', 'labels', 'categories', 'mojibake', 'unicode', 'leads', 'version'))
+
+
+def compile_plan(blueprints=BLUEPRINTS, html=HTML, price_categories=PRICE_CATEGORIES, mojibake=MOJIBAKE):
     """
-    In goes a webpage (as a beautiful soup), out comes data (as a Stamped data object).
+    Compile the blueprints once into an extraction plan: flat tuples of fields
+    for each fragment, an inverted index from price labels to categories and
+    a single regular expression that repairs all badly decoded characters,
+    along with the characters they start with, to skip clean text quickly.
+    The version of the plan is a hash of everything it was compiled from.
+    """
+
+    fragments = dict()
+    for tag, markup in html.items():
+        fields = tuple(Field(name, tuple(bp['lines']['default']), tuple(bp['lines']['variant']),
+                             bp['pattern'], bp['optional'])
+                       for name, bp in blueprints.get(tag, {}).items())
+        fragments[tag] = Fragment(markup['tag'], markup['attrs'], fields)
+
+    labels = dict()
+    for category, synonyms in price_categories.items():
+        for label in synonyms:
+            labels[label] = labels.get(label, ()) + (category,)
+
+    # Longest first so that no substitution
+    # is shadowed by one of its own prefixes.
+    bad = sorted(dict(mojibake), key=len, reverse=True)
+
+    blueprint = dumps([blueprints, html, price_categories, mojibake], sort_keys=True, default=_serialize)
+    version = sha1(blueprint.encode()).hexdigest()
+
+    return Plan(fragments, labels, tuple(price_categories),
+                compile('|'.join(map(escape, bad))), dict(mojibake), tuple(sorted({b[0] for b in bad})), version)
+
+
+def _serialize(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return value.pattern, value.flags
+
+
+PLAN = compile_plan()
+
+
+class ScrapeCache(object):
+    """
+    Scrape results stored on disk, keyed by the hash of the webpage content
+    and the version of the extraction plan. Results scraped with any other
+    version of the blueprints are dropped when the cache is opened. Caches
+    can be sent to scraper processes: each opens its own connection.
+    """
+
+    def __init__(self, filepath, version=PLAN.version):
+        self.filepath = filepath
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = Lock()
+
+        self._connect().execute('DELETE FROM scrapes WHERE version != ?', (version,))
+        self._db.commit()
+
+    def __repr__(self):
+        return '<ScrapeCache: %s (%s hits, %s misses)>' % (self.filepath, self.hits, self.misses)
+
+    def __getstate__(self):
+        return self.filepath, self.version
+
+    def __setstate__(self, state):
+        self.filepath, self.version = state
+        self.hits = self.misses = 0
+        self._db = None
+        self._lock = Lock()
+
+    def get(self, content_hash):
+        with self._lock:
+            row = self._connect().execute('SELECT info, addresses FROM scrapes WHERE hash = ? AND version = ?',
+                                          (content_hash, self.version)).fetchone()
+            if row:
+                self.hits += 1
+                return RawData(loads(row[0]), loads(row[1]))
+            self.misses += 1
+
+    def put(self, content_hash, data):
+        with self._lock, self._connect():
+            self._db.execute('INSERT OR REPLACE INTO scrapes VALUES (?, ?, ?, ?)',
+                             (content_hash, self.version, dumps(data.info), dumps(data.addresses)))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+            self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = connect(self.filepath, timeout=60, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS scrapes ('
+                             'hash TEXT NOT NULL, version TEXT NOT NULL, info TEXT NOT NULL, addresses TEXT NOT NULL, '
+                             'PRIMARY KEY (hash, version))')
+        return self._db
+
+
+def scrape(job, fast=FAST_SCRAPE, cache=None):
+    """
+    In goes a webpage (a lazy Webpage or a beautiful soup), out comes data (as a Stamped data object).
     Each Stamped data object has an info attribute (a dictionary with IDs, prices etc...)
     and an addresses attribute containing an arbitrary number of addresses. All fields
-    are raw strings at this stage.
+    are raw strings at this stage. In fast mode, only the order detail of a Webpage is parsed.
+    With a cache, unchanged Webpages are not scraped twice.
     """
 
-    order = job.data.find(id='order_detail')
+    is_cacheable = cache is not None and isinstance(job.data, Webpage)
+
+    if is_cacheable:
+        data = cache.get(job.data.digest)
+        if data is not None:
+            debug('Scraped %s-uuid-%s.html from cache', job.stamp.date, job.stamp.uuid)
+            return Stamped(job.stamp, data)
+
+    if fast and isinstance(job.data, Webpage):
+        order = job.data.fragment('order_detail')
+    else:
+        order = job.data.find(id='order_detail')
+
     addresses = list()
     info = dict()
 
-    # Step 1: scrape all information fragments
-    tags = ['header', 'client', 'itinerary']
+    firsts, fragments = _select_fragments(order)
 
-    for tag in tags:
-        fragment = order.find_next(name=HTML[tag]['tag'])
-        fields = _scrape_fragment(BLUEPRINTS[tag], fragment, job.stamp)
+    # Step 1: scrape all information fragments
+    for tag in ['header', 'client', 'itinerary']:
+        fragment = firsts[tag] or order.find_next(name=PLAN.fragments[tag].tag)
+        fields = _scrape_fragment(PLAN.fragments[tag].fields, fragment, job.stamp)
         info.update(fields)
 
     # Step 2: scrape the price table
-    fragment = order.find(HTML['prices']['tag'])
-    prices = _scrape_prices(fragment, job.stamp)
+    prices = _scrape_prices(firsts['prices'], job.stamp)
     info.update(prices)
 
     # Step 3: scrape an arbitrary number of addresses
-    fragments = order.find_all(name=HTML['address']['tag'], attrs=HTML['address']['attrs'])
-
     for fragment in fragments:
-        address = _scrape_fragment(BLUEPRINTS['address'], fragment, job.stamp)
+        address = _scrape_fragment(PLAN.fragments['address'].fields, fragment, job.stamp)
         addresses.append(address)
 
+    data = RawData(info, addresses)
+
+    if is_cacheable:
+        cache.put(job.data.digest, data)
+
     debug('Scraped %s-uuid-%s.html', job.stamp.date, job.stamp.uuid)
 
-    return Stamped(job.stamp, RawData(info, addresses))
+    return Stamped(job.stamp, data)
+
+
+def failures(data):
+    """ Return the names of the mandatory fields that could not be scraped. """
+
+    failed = [field.name
+              for tag in ['header', 'client', 'itinerary']
+              for field in PLAN.fragments[tag].fields
+              if not field.optional and data.info.get(field.name) is None]
+
+    if not any(data.info.get(category) for category in PLAN.categories):
+        failed.append('prices')
+
+    for address in data.addresses:
+        failed.extend(field.name
+                      for field in PLAN.fragments['address'].fields
+                      if not field.optional and address.get(field.name) is None)
+
+    return failed
 
 
 def fix_unicode(original_text):
     # This function is deprecated because web-pages are now correctly decoded into unicode.
     # But there could still be a few in the cache that haven't. This is a really DIRTY FIX.
-    substitutions = [
-        ('Ã¼', 'ü'),
-        ('Ã¤', 'ä'),
-        ('Ã¶', 'ö'),
-        ('Ã©', 'é'),
-        ('â¬', '€'),
-        ('Ã', 'ß'),
-        ('Ã', 'Ö'),
-    ]
-
-    corrected_text = original_text
-    for bad, good in substitutions:
-        corrected_text = corrected_text.replace(bad, good)
+    for lead in PLAN.leads:
+        if lead in original_text:
+            break
+    else:
+        return original_text
+
+    corrected_text = PLAN.mojibake.sub(_unmangle, original_text)
 
     if corrected_text != original_text:
         debug('Fixed %s', corrected_text)
@@ -196,7 +347,40 @@ def fix_unicode(original_text):
     return corrected_text
 
 
-def _scrape_fragment(blueprints, fragment, stamp):
+def _unmangle(matched):
+    return PLAN.unicode[matched.group(0)]
+
+
+def _select_fragments(order):
+    # A single walk through the order detail finds the first
+    # tag of each fragment and all the addresses, instead of
+    # one search per fragment. Fragments that are not inside
+    # the order detail are left for find_next() to look for.
+    firsts = {tag: None for tag in ['header', 'client', 'itinerary', 'prices']}
+    addresses = list()
+
+    tags = {PLAN.fragments[tag].tag: [] for tag in firsts}
+    for tag in firsts:
+        tags[PLAN.fragments[tag].tag].append(tag)
+
+    address = PLAN.fragments['address']
+
+    for element in order.descendants:
+        name = element.name
+        if name is None:
+            continue
+
+        if name == address.tag and all(element.get(k) == v for k, v in address.attrs.items()):
+            addresses.append(element)
+
+        for tag in tags.get(name, ()):
+            if firsts[tag] is None:
+                firsts[tag] = element
+
+    return firsts, addresses
+
+
+def _scrape_fragment(fields, fragment, stamp):
     # Fields are ambiguously inserted in the markup.
     # Fields may or may not be there.
     # Fields may be bundled together inside a single tag.
@@ -208,23 +392,23 @@ def _scrape_fragment(blueprints, fragment, stamp):
     collected = {}
 
     # Sometimes addresses are formatted differently
-    case = 'variant' if 'Zusatz' in fragment.text else 'default'
+    is_variant = 'Zusatz' in ''.join(contents)
+
+    for field in fields:
+        value = None
 
-    for field, bp in blueprints.items():
         try:
-            for line in bp['lines'][case]:
-                matched = bp['pattern'].match(contents[line])
+            for line in field.variant if is_variant else field.default:
+                matched = field.pattern.match(contents[line])
                 if matched:
-                    raw_value = matched.group(1)
-                    collected[field] = fix_unicode(raw_value)
+                    value = fix_unicode(matched.group(1))
                     break
-            else:
-                raise ValueError
+        except IndexError:
+            pass
 
-        except (IndexError, ValueError):
-            collected[field] = None
-            if not bp['optional']:
-                _report_failure(stamp, field, contents)
+        collected[field.name] = value
+        if value is None and not field.optional:
+            _report_failure(stamp, field.name, contents)
 
     return collected
 
@@ -232,23 +416,23 @@ def _scrape_fragment(blueprints, fragment, stamp):
 def _scrape_prices(fragment, stamp):
     # This fragment is treated separately because it's a
     # table with a whole bunch of possible price labels.
-    pattern = r'(\d+,\d{2})$'
-
     cells = list(fragment.stripped_strings)
     raw_price_table = list(zip(cells[::2], cells[1::2]))
-    price_table = {k: [] for k in PRICE_CATEGORIES.keys()}
+    price_table = {k: [] for k in PLAN.categories}
 
     for raw_label, raw_price in sorted(raw_price_table):
-        for category, category_synonyms in PRICE_CATEGORIES.items():
-            if raw_label in category_synonyms:
-                matched = search(pattern, raw_price)
+        categories = PLAN.labels.get(raw_label)
 
-                if matched:
-                    price = matched.group(0)
-                else:
-                    price = None
-                    warning('Could not convert "%s" into a price', raw_price)
+        if categories:
+            matched = PRICE.search(raw_price)
+
+            if matched:
+                price = matched.group(0)
+            else:
+                price = None
+                warning('Could not convert "%s" into a price', raw_price)
 
+            for category in categories:
                 price_table[category].append(price)
 
     if not any(price_table.values()):
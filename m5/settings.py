@@ -17,9 +17,17 @@ TEST_JOBS_DIR = join(ASSETS_DIR, 'test_jobs')
 MASK_FILEPATH = join(ASSETS_DIR, 'mask.png')
 SHP_FILEPATH = join(ASSETS_DIR, 'berlin_postleitzahlen.shp')
 DBF_FILEPATH = join(ASSETS_DIR, 'berlin_postleitzahlen.dbf')
+POSTCODE_CELL = 0.02
 
 # Google geocoding
 GOOGLE_API_KEY = getenv('GOOGLE_API_KEY')
+GEOCODE_TTL = 180 * 24 * 3600
+GEOCODE_CACHE_SIZE = 100000
+GEOCODE_LRU_SIZE = 4096
+GEOCODE_RATE = 10
+GEOCODE_QUOTA = 2500
+GEOCODE_RETRIES = 3
+GEOCODE_BACKOFF = 1.0
 
 # Wordcloud parameters
 WORD_BLACKLIST = {'strasse', 'allee', 'platz', 'a', 'b', 'c', 'd'}
@@ -27,23 +35,64 @@ WORD_SOURCE = 'street'
 MAX_WORDS = 200
 HORIZONTAL_WORDS = 0.8
 
+# Packed archive
+PACK_COMPRESSION = 6
+
 # URLs to the company server
 LOGIN_URL = 'http://bamboo-mec.de/ll.php5'
 LOGOUT_URL = 'http://bamboo-mec.de/index.php5'
 JOB_URL = 'http://bamboo-mec.de/ll_detail.php5'
 SUMMARY_URL = 'http://bamboo-mec.de/ll.php5'
 
+# Concurrent downloads
+DOWNLOAD_WORKERS = 8
+HOST_CONNECTIONS = 4
+RECHECK_DAYS = 3
+
+# Scraper
+FAST_SCRAPE = True
+
+# Pipeline stages
+SCRAPE_PROCESSES = 2
+GEOCODE_THREADS = 4
+STAGE_BUFFER = 32
+SCRAPE_CHUNK = 8
+GEOCODE_BATCH = 64
+BULK_ARCHIVE = True
+ARCHIVE_BATCH = 64
+
+# SQLite storage profile
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -32000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,
+}
+
+# Columnar export
+EXPORT_DIRNAME = 'export'
+EXPORT_TABLES = ('orders', 'checkins', 'checkpoints')
+EXPORT_DICTIONARY = ('type', 'purpose', 'user', 'city', 'company', 'postal_code', 'country', 'country_code')
+
 # String formatting
 LOGGING_FORMAT = '[M5] [%(asctime)s] [%(levelname)s] [%(module)s] [%(funcName)s] %(message)s'
 JOB_URL_FORMAT = 'http://bamboo-mec.de/ll_detail.php5?status=delivered&uuid={uuid}&datum={date}'
 FAILURE_REPORT = '{date}-{uuid}.html: Failed to scrape {field}'
 LOG_FORMAT = '[%(asctime)s] [%(module)s] %(message)s'
 JOB_FILE_FORMAT = '{date}-uuid-{uuid}.html'
+INDEX_FILENAME = 'index.sqlite'
+SCRAPES_FILENAME = 'scrapes.sqlite'
+GEOCODES_FILENAME = 'geocodes.sqlite'
+FRAMES_FILENAME = 'frames.pickle'
+PACK_FILE_FORMAT = '{month}.pack'
 FILE_DATE_FORMAT = '%d-%m-%Y'
 URL_DATE_FORMAT = '%d.%m.%Y'
 
 # Readability
 LOGGED_IN = 'erfolgreich'
+LOGOUT_LINK = 'logout=1'
+OK = 200
 REDIRECT = 302
 EXIT = {'logout': '1'}
 UUID = slice(-12, -5)
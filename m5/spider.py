@@ -2,25 +2,33 @@
 
 
 from os.path import join
-from datetime import date
-from bs4 import BeautifulSoup
+from datetime import date, timedelta
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
 from re import findall
-from collections import namedtuple
-from logging import debug
-from glob import glob
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+from logging import debug, warning
 
-from m5.settings import JOB_URL_FORMAT, SUMMARY_URL, JOB_FILE_FORMAT, UUID
+from m5.index import EMPTY, COMPLETE, digest
+from m5.settings import JOB_URL_FORMAT, SUMMARY_URL, JOB_FILE_FORMAT, DOWNLOAD_WORKERS, HOST_CONNECTIONS
+from m5.settings import OK, LOGOUT_LINK
 
 Stamped = namedtuple('Stamped', ('stamp', 'data'))
 Stamp = namedtuple('Stamp', ('user', 'date', 'uuid'))
-RawData = namedtuple('Data', ('info', 'addresses'))
+RawData = namedtuple('RawData', ('info', 'addresses'))
+
+FAST_PARSER = 'lxml' if builder_registry.lookup('lxml') else 'html.parser'
 
 
 def download(day, user):
     """
     Download the user webpages for that day, save them to file and return
-    a generator of beautiful soup objects. Do not download things twice:
-    serve webpages from cache where possible.
+    a generator of stamped webpages. Do not download things twice: serve
+    webpages from cache where possible and do not ask the website about
+    days that are known to be empty or complete, unless they are recent.
     """
 
     assert isinstance(day, date), 'Argument must be a date object'
@@ -28,61 +36,245 @@ def download(day, user):
 
     s = Spider(day, user)
 
-    uuids = s.get_job_uuids_from_cache()
+    for uuid in s.get_job_uuids():
+        yield s.fetch(uuid)
+
+
+def load(pages, user):
+    """ Return a generator of stamped webpages from the archive, given as (date, uuid) pairs. """
+
+    for day, uuid in pages:
+        yield Spider(day, user).fetch(uuid)
+
+
+def download_range(start, stop, user, workers=DOWNLOAD_WORKERS):
+    """
+    Download the user webpages from start until stop (excluded) with a pool of
+    threads and return the same generator of stamped webpages as download(), in the
+    same order. Requests to any single host are capped at HOST_CONNECTIONS and
+    no more than a few pages per worker are held in memory at any time. The
+    archive index is read once for the whole range.
+    """
+
+    assert start <= stop, 'Cannot migrate backwards in time.'
+    assert stop <= date.today() + timedelta(days=1), 'Cannot return to the future.'
+
+    days = [start + timedelta(days=n) for n in range((stop - start).days)]
+    cached = user.index.lookup(start, stop) if days else {}
+    statuses = user.index.days(start, stop) if days else {}
+    spiders = (Spider(day, user, cached=cached.get(day, []), status=statuses.get(day)) for day in days)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        surveyed = bounded_map(pool, lambda s: (s, s.get_job_uuids()), spiders, workers)
+        jobs = ((s, uuid) for s, uuids in surveyed for uuid in uuids)
+
+        for stamped in bounded_map(pool, lambda job: job[0].fetch(job[1]), jobs, 2 * workers):
+            yield stamped
 
-    if not uuids and not user.offline:
-        uuids = s.scrape_job_uuids()
 
-    if not uuids:
-        debug('No jobs found %s on %s', 'offline' if user.offline else 'online', s.date_string)
+def bounded_map(pool, func, items, window):
+    """
+    Like pool.map() but lazy: no more than window tasks are ever in flight
+    or waiting to be consumed and results come out in order. Chained calls
+    form a pipeline whose stages work concurrently, each holding a bounded
+    queue of items. Without a pool, items are mapped inline.
+    """
+
+    if pool is None:
+        yield from map(func, items)
         return
 
-    for uuid in uuids:
-        stamp = Stamp(user.username, day, uuid)
+    pending = deque()
 
-        if s.is_cached:
-            soup = s.load_job(uuid)
-            debug('Loaded from cache %s ', s.job_filepath(uuid))
-        else:
-            soup = s.download_job(uuid)
-            s.save_job(soup, uuid)
-            debug('Downloaded and cached %s', s.job_url(uuid))
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
 
-        yield Stamped(stamp, soup)
+    while pending:
+        yield pending.popleft().result()
+
+
+_host_slots = {}
+_host_slots_lock = Lock()
+
+
+def _host_slot(url):
+    host = urlsplit(url).netloc
+
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = BoundedSemaphore(HOST_CONNECTIONS)
+        return _host_slots[host]
+
+
+class Webpage(object):
+    """
+    The raw bytes of a job webpage, exactly as served by the company website.
+    The beautiful soup is only cooked the first time somebody asks for it.
+    """
+
+    __slots__ = ('content', '_soup')
+
+    def __init__(self, content):
+        self.content = content
+        self._soup = None
+
+    def __repr__(self):
+        return '<Webpage: %s bytes%s>' % (len(self.content), ' parsed' if self._soup else '')
+
+    @property
+    def digest(self):
+        return digest(self.content)
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.content, from_encoding='utf-8')
+        return self._soup
+
+    def find(self, *args, **kwargs):
+        return self.soup.find(*args, **kwargs)
+
+    def fragment(self, tag_id):
+        """
+        Return the element with that id without parsing the whole page: the
+        markup before the element is skipped and everything outside of it is
+        thrown away by the parser. Fall back on the full soup when in doubt.
+        """
+
+        if self._soup is not None:
+            return self._soup.find(id=tag_id)
+
+        try:
+            html = self.content.decode('utf-8')
+        except UnicodeDecodeError:
+            return self.find(id=tag_id)
+
+        position = max(html.find('id="%s"' % tag_id), html.find("id='%s'" % tag_id))
+        start = html.rfind('<', 0, position)
+
+        if position < 0 or start < 0:
+            return self.find(id=tag_id)
+
+        soup = BeautifulSoup(html[start:], FAST_PARSER, parse_only=SoupStrainer(id=tag_id))
+        return soup.find(id=tag_id)
+
+    # Webpages travel to scraper processes
+    # as bytes: the soup is left behind.
+    def __getstate__(self):
+        return self.content,
+
+    def __setstate__(self, state):
+        self.content, = state
+        self._soup = None
 
 
 class Spider(object):
-    def __init__(self, day, user):
+    def __init__(self, day, user, cached=None, status=None):
         self._archive = user.archive
+        self._index = user.index
+        self._packs = user.packs
+        self._packed = user.packed
+        self._cached = cached
+        self._status = status
+        self._recheck = user.recheck
         self._session = user.web
+        self._username = user.username
+        self._offline = user.offline
         self._date = day
-        self.is_cached = False
+        self._missing = set()
+        self._jobs = 0
+        self._lock = Lock()
 
     def __repr__(self):
         return '<Spider: %s to %s>' % (self._date, self._archive)
 
+    @property
+    def is_recent(self):
+        # Jobs may still show up on the website for a
+        # few days, so recent days are always checked.
+        return (date.today() - self._date).days < self._recheck
+
+    def get_job_uuids(self):
+        cached = self.get_job_uuids_from_cache() or []
+
+        if self._offline or (self._status and not self.is_recent):
+            uuids = set(cached)
+        else:
+            online = self.scrape_job_uuids()
+
+            # Without a summary page to go by, the day is left
+            # unmarked so that it is asked for again next time.
+            if online is None:
+                uuids = set(cached)
+            else:
+                uuids = online | set(cached)
+                self._missing = online - set(cached)
+                self._jobs = len(uuids)
+
+                if not uuids:
+                    self._index.mark_day(self._date, EMPTY)
+                elif not self._missing:
+                    self._index.mark_day(self._date, COMPLETE, jobs=self._jobs)
+
+        if not uuids:
+            debug('No jobs found %s on %s', 'offline' if self._offline else 'online', self.date_string)
+            return []
+
+        return sorted(uuids)
+
     def get_job_uuids_from_cache(self):
-        pattern = self.date_string + '-uuid-' + '[0-9]'*7 + '.html'
-        filepaths = glob(join(self._archive, pattern))
+        if self._cached is None:
+            self._cached = self._index.uuids(self._date)
+            self._status = self._index.status(self._date)
 
-        if filepaths:
-            self.is_cached = True
-            return [filepath[UUID] for filepath in filepaths]
+        if self._cached:
+            return self._cached
 
     def scrape_job_uuids(self):
+        """ Return the uuids on the summary page of the day, or None if the server did not serve that page. """
+
         pattern = 'uuid=(\d{7})'
-        payload = {'status': 'delivered', 'datum': self._date.strftime('%d.%m.%Y')}
-        response = self._session.get(SUMMARY_URL, params=payload)
-        jobs = findall(pattern, response.text)
+        datum = self._date.strftime('%d.%m.%Y')
+        payload = {'status': 'delivered', 'datum': datum}
+        response = self._get(SUMMARY_URL, params=payload)
+
+        # Login, error and maintenance pages have no jobs
+        # either, but they say nothing about the day.
+        if response.status_code != OK or LOGOUT_LINK not in response.text or datum not in response.text:
+            warning('No summary page for %s (status %s)', self.date_string, response.status_code)
+            return None
+
+        return set(findall(pattern, response.text))
 
-        if jobs:
-            self.is_cached = False
-            return set(jobs)
+    def fetch(self, uuid):
+        stamp = Stamp(self._username, self._date, uuid)
+
+        if uuid not in self._missing:
+            webpage = self.load_job(uuid)
+            debug('Loaded from cache %s ', self.job_filepath(uuid))
+        else:
+            webpage = self.download_job(uuid)
+            self.save_job(webpage, uuid)
+            debug('Downloaded and cached %s', self.job_url(uuid))
+
+            with self._lock:
+                self._missing.discard(uuid)
+                is_complete = not self._missing
+
+            if is_complete:
+                self._index.mark_day(self._date, COMPLETE, jobs=self._jobs)
+
+        return Stamped(stamp, webpage)
 
     def download_job(self, uuid):
-        response = self._session.get(self.job_url(uuid))
-        content = response.content.decode('utf-8').encode()
-        return BeautifulSoup(content)
+        response = self._get(self.job_url(uuid))
+        return Webpage(response.content)
+
+    def _get(self, url, **kwargs):
+        with _host_slot(url):
+            return self._session.get(url, **kwargs)
 
     @property
     def date_string(self):
@@ -94,11 +286,21 @@ class Spider(object):
     def job_filepath(self, uuid):
         return join(self._archive, JOB_FILE_FORMAT.format(date=self.date_string, uuid=uuid))
 
-    def save_job(self, soup, uuid):
-        with open(self.job_filepath(uuid), 'w+') as f:
-            f.write(soup.prettify())
+    def save_job(self, webpage, uuid):
+        if self._packed:
+            self._packs.put(self._date, uuid, webpage.content)
+        else:
+            with open(self.job_filepath(uuid), 'wb') as f:
+                f.write(webpage.content)
+        self._index.add(self._date, uuid, webpage.content)
 
     def load_job(self, uuid):
-        with open(self.job_filepath(uuid), 'r') as f:
-            html = f.read()
-        return BeautifulSoup(html)
+        # Archives may be half packed: job files first, packs second.
+        try:
+            with open(self.job_filepath(uuid), 'rb') as f:
+                return Webpage(f.read())
+        except FileNotFoundError:
+            content = self._packs.get(self._date, uuid)
+            if content is None:
+                raise
+            return Webpage(content)
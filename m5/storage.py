@@ -0,0 +1,126 @@
+""" The storage module opens user databases with the SQLite profile of the package and keeps their schema current. """
+
+
+from logging import debug, info, warning
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from m5 import summary
+from m5.model import Model, Checkin, Checkpoint, SCHEMA_VERSION
+from m5.settings import SQLITE_PRAGMAS
+
+
+def connect(db_uri, pragmas=SQLITE_PRAGMAS):
+    """ Return an engine that sets the pragmas on every new connection. """
+
+    engine = create_engine(db_uri)
+
+    @event.listens_for(engine, 'connect')
+    def tune(connection, _):
+        cursor = connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (pragma, value))
+        cursor.close()
+
+    return engine
+
+
+def upgrade(engine):
+    """
+    Bring a database to the current schema version. Tables keyed by natural
+    keys are migrated to surrogate keys, then missing tables and indexes
+    are created. Summary tables are filled in from the orders when they
+    are new. Databases created before an index was declared get it in
+    place, after which the query planner statistics are refreshed. Return
+    the names of the indexes that were created.
+    """
+
+    with engine.connect() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+    tables = inspect(engine).get_table_names()
+    if version < 2 and Checkpoint.__tablename__ in tables:
+        columns = {column['name'] for column in inspect(engine).get_columns(Checkpoint.__tablename__)}
+        if 'id' not in columns:
+            _surrogate_keys(engine)
+
+    Model.metadata.create_all(engine)
+    summary.Summary.create_all(engine)
+
+    existing = {index['name'] for table in Model.metadata.sorted_tables
+                for index in inspect(engine).get_indexes(table.name)}
+    missing = [index for table in Model.metadata.sorted_tables
+               for index in table.indexes if index.name not in existing]
+
+    with engine.begin() as connection:
+        for index in missing:
+            index.create(connection, checkfirst=True)
+            debug('Created index %s', index.name)
+
+        if not set(summary.Summary.tables) <= set(tables):
+            summary.rebuild(connection)
+
+        if missing:
+            connection.exec_driver_sql('ANALYZE')
+
+        connection.exec_driver_sql('PRAGMA user_version = %s' % SCHEMA_VERSION)
+
+    return [index.name for index in missing]
+
+
+def _surrogate_keys(engine):
+    """
+    Move checkpoints and checkins to integer surrogate keys. The old tables
+    are renamed and copied over inside SQLite with INSERT ... SELECT, so
+    rows are streamed rather than loaded. Checkins whose checkpoint is gone
+    cannot be kept. The file is vacuumed to give the space back.
+    """
+
+    checkpoint_columns = ', '.join(column.name for column in Checkpoint.__table__.columns if column.name != 'id')
+    checkin_columns = [column.name for column in Checkin.__table__.columns if column.name != 'id']
+    selected = ', '.join('p.id' if column == 'checkpoint_id' else 'c.' + column for column in checkin_columns)
+
+    connection = engine.raw_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute('BEGIN')
+
+        for index in inspect(engine).get_indexes(Checkin.__tablename__):
+            cursor.execute('DROP INDEX IF EXISTS %s' % index['name'])
+
+        for table in (Checkin.__table__, Checkpoint.__table__):
+            cursor.execute('ALTER TABLE %s RENAME TO %s_v1' % (table.name, table.name))
+
+        for table in (Checkpoint.__table__, Checkin.__table__):
+            cursor.execute(str(CreateTable(table).compile(dialect=engine.dialect)))
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index).compile(dialect=engine.dialect)))
+
+        cursor.execute('INSERT INTO checkpoints (%s) SELECT %s FROM checkpoints_v1 ORDER BY rowid'
+                       % (checkpoint_columns, checkpoint_columns))
+        cursor.execute('INSERT INTO checkins (%s) SELECT %s FROM checkins_v1 c '
+                       'JOIN checkpoints p ON p.checkpoint_id = c.checkpoint_id ORDER BY c.rowid'
+                       % (', '.join(checkin_columns), selected))
+
+        orphans = cursor.execute('SELECT (SELECT count(*) FROM checkins_v1) - (SELECT count(*) FROM checkins)')
+        orphans = orphans.fetchone()[0]
+        if orphans:
+            warning('Dropped %s checkins without a checkpoint', orphans)
+
+        cursor.execute('DROP TABLE checkins_v1')
+        cursor.execute('DROP TABLE checkpoints_v1')
+        cursor.execute('COMMIT')
+
+    except Exception:
+        cursor.execute('ROLLBACK')
+        raise
+
+    finally:
+        cursor.close()
+        connection.close()
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql('VACUUM')
+
+    info('Migrated checkpoints and checkins to surrogate keys')
@@ -0,0 +1,165 @@
+""" The stream module runs the scraper, the processor and the archiver as concurrent pipeline stages. """
+
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from itertools import chain, islice
+from logging import debug, info
+
+from m5.geocoder import BatchGeocoder, query
+from m5.scraper import scrape
+from m5.pipeline import process, archive, bulk_archive, ArchivedKeys
+from m5.postcodes import berlin
+from m5.spider import bounded_map, load
+from m5.settings import SCRAPE_PROCESSES, GEOCODE_THREADS, STAGE_BUFFER, SCRAPE_CHUNK, GEOCODE_BATCH
+from m5.settings import BULK_ARCHIVE, ARCHIVE_BATCH
+
+
+def stream(webpages, user,
+           scrapers=SCRAPE_PROCESSES,
+           geocoders=GEOCODE_THREADS,
+           buffer=STAGE_BUFFER,
+           chunksize=SCRAPE_CHUNK,
+           batchsize=GEOCODE_BATCH,
+           bulk=BULK_ARCHIVE,
+           refresh=False,
+           archivesize=ARCHIVE_BATCH):
+    """
+    Scrape, process and archive stamped webpages as they come in. Scraping
+    runs in a pool of processes, geocoding in a pool of threads and archiving
+    in this thread, the only one that writes to the database. Webpages are
+    shipped to the scrapers in chunks. Scraped jobs are handled in batches:
+    the distinct addresses of a batch are resolved at once, within the rate
+    limit and the daily quota of the user, and in bulk mode the rows of a
+    batch are archived in a single transaction, from lightweight records
+    rather than model instances. Rows already in the database are then
+    skipped, unless asked to refresh them. Every archivesize jobs are
+    archived in a session of their own, which is closed afterwards. No stage
+    ever holds more than buffer chunks or two batches and no session more
+    than a batch of rows, so memory stays flat however long the stream. A
+    stage without workers runs inline. Webpages that were scraped before
+    are served from the scrape cache of the user. Addresses that cannot be
+    geocoded are placed on the Berlin postcode map. Yield each scraped job
+    once its rows are committed.
+    """
+
+    with ExitStack() as stack:
+        scraper_pool = stack.enter_context(ProcessPoolExecutor(scrapers)) if scrapers else None
+        batch_pool = stack.enter_context(ThreadPoolExecutor(1)) if geocoders else None
+
+        jobs = _scraped(scraper_pool, webpages, user, buffer, chunksize)
+
+        if user.offline:
+            geocoder = None
+        else:
+            geocoder = BatchGeocoder(cache=user.geocodes, workers=geocoders, quota=user.quota)
+
+        processor = partial(_process, geocoder=geocoder, checkpoints=user.checkpoints,
+                            postcodes=berlin(), records=bulk)
+        batches = bounded_map(batch_pool, processor, _chunks(jobs, batchsize), 2)
+
+        keys = _keys(user, bulk, refresh)
+
+        for batch in _chunks(chain.from_iterable(batches), archivesize):
+            yield from _archive(user, batch, bulk, keys)
+
+
+def two_pass(webpages, user,
+             scrapers=SCRAPE_PROCESSES,
+             geocoders=GEOCODE_THREADS,
+             buffer=STAGE_BUFFER,
+             chunksize=SCRAPE_CHUNK,
+             bulk=BULK_ARCHIVE,
+             refresh=False,
+             archivesize=ARCHIVE_BATCH):
+    """
+    Like stream, but geocode each address once for the whole range. The
+    first pass scrapes all the webpages and collects the distinct queries,
+    which are then resolved in bulk. The second pass reloads the webpages
+    from the archive, scrapes them again from the scrape cache and builds
+    the rows from the resolved table. Only the stamps and the queries are
+    kept in memory between the two passes. Yield each scraped job once its
+    rows are committed.
+    """
+
+    with ExitStack() as stack:
+        scraper_pool = stack.enter_context(ProcessPoolExecutor(scrapers)) if scrapers else None
+
+        pages = list()
+        queries = set()
+
+        for job in _scraped(scraper_pool, webpages, user, buffer, chunksize):
+            pages.append((job.stamp.date, job.stamp.uuid))
+            queries.update(_queries([job], user.checkpoints))
+
+        info('Scraped %s webpages with %s distinct addresses', len(pages), len(queries))
+
+        if user.offline:
+            points = None
+        else:
+            geocoder = BatchGeocoder(cache=user.geocodes, workers=geocoders, quota=user.quota)
+            points = geocoder.geocode(queries)
+            info('Geocoded %s distinct addresses with %s requests', len(points), geocoder.requests)
+
+        jobs = _scraped(scraper_pool, load(pages, user), user, buffer, chunksize)
+        keys = _keys(user, bulk, refresh)
+
+        for batch in _chunks(jobs, archivesize):
+            tables = [(job, process(job, is_offline=user.offline, points=points, checkpoints=user.checkpoints,
+                                    postcodes=berlin(), records=bulk)) for job in batch]
+            yield from _archive(user, tables, bulk, keys)
+
+
+def _keys(user, bulk, refresh):
+    if bulk and not refresh:
+        return ArchivedKeys(user.db)
+
+
+def _archive(user, tables, bulk, keys=None):
+    with user.sessions() as db:
+        if bulk:
+            bulk_archive(db, [row for _, rows in tables for row in rows], keys=keys)
+        else:
+            for _, rows in tables:
+                archive(db, rows)
+
+    for job, _ in tables:
+        user.index.mark_scraped(job.stamp.date, job.stamp.uuid)
+        debug('Streamed %s-uuid-%s.html', job.stamp.date, job.stamp.uuid)
+
+        yield job
+
+
+def _scraped(pool, webpages, user, buffer, chunksize):
+    scraper = partial(_scrape, cache=user.scrapes)
+    chunks = bounded_map(pool, scraper, _chunks(webpages, chunksize), buffer)
+    return chain.from_iterable(chunks)
+
+
+def _chunks(items, size):
+    items = iter(items)
+    chunk = list(islice(items, size))
+
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+def _scrape(webpages, cache=None):
+    return [scrape(webpage, cache=cache) for webpage in webpages]
+
+
+def _process(jobs, geocoder=None, checkpoints=None, postcodes=None, records=False):
+    options = dict(checkpoints=checkpoints, postcodes=postcodes, records=records)
+
+    if geocoder is None:
+        return [(job, process(job, is_offline=True, **options)) for job in jobs]
+
+    points = geocoder.geocode(_queries(jobs, checkpoints))
+    return [(job, process(job, points=points, **options)) for job in jobs]
+
+
+def _queries(jobs, checkpoints=None):
+    queries = (query(address) for job in jobs for address in job.data.addresses)
+    return [query_ for query_ in queries if checkpoints is None or query_ not in checkpoints]
@@ -0,0 +1,147 @@
+""" The summary module keeps precomputed totals of the orders per day, week, month, client and type. """
+
+
+from collections import defaultdict
+from datetime import datetime
+from logging import debug
+from sqlalchemy import Column, Date, Integer, Float, MetaData, Table, UnicodeText, delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from m5.model import Order, PRICES
+
+
+Summary = MetaData()
+
+MEASURES = ('jobs',) + PRICES + ('waiting_time', 'price', 'distance', 'cash')
+
+
+def _day(order):
+    return _date(order.get('date'))
+
+
+def _week(order):
+    day = _date(order.get('date'))
+    return day and day.fromordinal(day.toordinal() - day.weekday())
+
+
+def _month(order):
+    day = _date(order.get('date'))
+    return day and day.replace(day=1)
+
+
+def _client(order):
+    return order.get('client_id')
+
+
+def _type(order):
+    return order.get('type') or 'unknown'
+
+
+def _date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _table(grain, key):
+    return Table('summary_' + grain, Summary, key, *(Column(measure, Float, nullable=False, default=0.0)
+                                                     for measure in MEASURES))
+
+
+# Weeks start on mondays and months on the first.
+GRAINS = {
+    'day': (_table('day', Column('day', Date, primary_key=True)), _day),
+    'week': (_table('week', Column('week', Date, primary_key=True)), _week),
+    'month': (_table('month', Column('month', Date, primary_key=True)), _month),
+    'client': (_table('client', Column('client_id', Integer, primary_key=True, autoincrement=False)), _client),
+    'type': (_table('type', Column('type', UnicodeText, primary_key=True)), _type),
+}
+
+
+def measures(order):
+    """ Return what an order adds to the totals: missing prices and distances count as zero. """
+
+    values = {price: order.get(price) or 0.0 for price in PRICES}
+    values['jobs'] = 1.0
+    values['waiting_time'] = order.get('waiting_time') or 0.0
+    values['price'] = sum(values[price] for price in PRICES)
+    values['distance'] = order.get('distance') or 0.0
+    values['cash'] = 1.0 if order.get('cash') else 0.0
+    return values
+
+
+def update(db, orders, existing=()):
+    """
+    Add orders to the totals, in the transaction of the caller. Existing
+    orders are the rows that the orders replace: their old values are taken
+    off first, so rewriting an order does not count it twice.
+    """
+
+    old = {row['order_id']: row for row in existing}
+    deltas = {grain: defaultdict(lambda: dict.fromkeys(MEASURES, 0.0)) for grain in GRAINS}
+
+    for order in orders:
+        if order['order_id'] in old:
+            previous = old[order['order_id']]
+            _add(deltas, previous, -1)
+            order = dict(previous, **order)
+        _add(deltas, order, 1)
+
+    _apply(db, deltas)
+
+
+def rebuild(db, chunksize=1000):
+    """ Recompute the totals from all the orders. Return the number of orders. """
+
+    for table, _ in GRAINS.values():
+        db.execute(delete(table))
+
+    deltas = {grain: defaultdict(lambda: dict.fromkeys(MEASURES, 0.0)) for grain in GRAINS}
+    count = 0
+
+    for rows in db.execute(select(Order.__table__)).mappings().partitions(chunksize):
+        for row in rows:
+            _add(deltas, row, 1)
+        count += len(rows)
+
+    _apply(db, deltas)
+    debug('Summarized %s orders', count)
+
+    return count
+
+
+def summary(db, grain):
+    """
+    Return the totals of a grain, in key order, with the earnings (the price
+    and the pay for waiting), and the share of jobs paid cash.
+    """
+
+    table, _ = GRAINS[grain]
+    key = table.primary_key.columns[0]
+    earnings = (table.c.price + table.c.waiting_time).label('earnings')
+    cash_share = (table.c.cash / table.c.jobs).label('cash_share')
+    return db.execute(select(table, earnings, cash_share).where(table.c.jobs > 0).order_by(key)).all()
+
+
+def _add(deltas, order, sign):
+    values = measures(order)
+    for grain, (_, key) in GRAINS.items():
+        value = key(order)
+        if value is None:
+            continue
+        totals = deltas[grain][value]
+        for measure in MEASURES:
+            totals[measure] += sign * values[measure]
+
+
+def _apply(db, deltas):
+    for grain, totals in deltas.items():
+        if not totals:
+            continue
+
+        table, _ = GRAINS[grain]
+        key = table.primary_key.columns[0].name
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={measure: table.c[measure] + statement.excluded[measure] for measure in MEASURES})
+
+        db.execute(statement, [dict(values, **{key: value}) for value, values in totals.items()])
@@ -4,7 +4,7 @@
 from glob import glob
 from itertools import chain
 from requests import Session
-from sqlalchemy import create_engine
+from requests.adapters import HTTPAdapter
 from sqlalchemy.orm import sessionmaker
 from os.path import isdir, join
 from os import makedirs, remove
@@ -14,7 +14,14 @@ from shutil import rmtree, copytree
 
 from m5.settings import LOGGED_IN, REDIRECT, EXIT, ASSETS_DIR, MOCK_DIRNAME
 from m5.settings import USER_BASE_DIR, LOGIN_URL, LOGOUT_URL, USERNAME, PASSWORD
-from m5.model import Model
+from m5.settings import HOST_CONNECTIONS, INDEX_FILENAME, RECHECK_DAYS, SCRAPES_FILENAME, GEOCODES_FILENAME
+from m5.settings import GEOCODE_QUOTA, EXPORT_DIRNAME
+from m5.model import Checkpoint
+from m5.storage import connect, upgrade
+from m5.index import ArchiveIndex
+from m5.pack import Packs
+from m5.scraper import ScrapeCache
+from m5.geocoder import GeoCache, Quota, CheckpointIndex
 
 
 class UserError(Exception):
@@ -26,7 +33,9 @@ class User:
                  username=None,
                  password=None,
                  offline=False,
-                 verbose=False):
+                 verbose=False,
+                 packed=False,
+                 recheck=RECHECK_DAYS):
 
         self.username = username or USERNAME
         self.password = password or PASSWORD
@@ -34,15 +43,26 @@ class User:
         self.userdir = ''
         self.archive = ''
         self.plots = ''
+        self.exports = ''
 
         self.offline = offline
         self.verbose = verbose
+        self.packed = packed
+        self.recheck = recheck
 
         self.db_uri = None
         self.engine = None
 
         self.db = None
+        self.sessions = None
+        self.index = None
+        self.packs = None
+        self.scrapes = None
+        self.geocodes = None
+        self.quota = None
+        self.checkpoints = None
         self.web = Session()
+        self._pool_connections()
 
         if username:
             self._configure(username)
@@ -58,6 +78,7 @@ class User:
             raise
 
         self._start_db()
+        self._open_caches()
 
         return self
 
@@ -65,10 +86,17 @@ class User:
         self.userdir = join(USER_BASE_DIR, dirname)
         self.archive = join(USER_BASE_DIR, dirname, 'archive')
         self.plots = join(USER_BASE_DIR, dirname, 'plots')
+        self.exports = join(USER_BASE_DIR, dirname, EXPORT_DIRNAME)
         self.db_uri = 'sqlite:///' + self.userdir + '/' + dirname + '.sqlite'
 
         debug('Configured user to %s', self.userdir)
 
+    def _pool_connections(self):
+        # All spider threads share one keep-alive pool per host.
+        adapter = HTTPAdapter(pool_connections=HOST_CONNECTIONS, pool_maxsize=HOST_CONNECTIONS)
+        self.web.mount('http://', adapter)
+        self.web.mount('https://', adapter)
+
     def _check_installation(self):
         if self.offline:
             if not all(list(map(isdir, self.folders))):
@@ -84,12 +112,23 @@ class User:
         debug('User authenticated')
 
     def _start_db(self):
-        self.engine = create_engine(self.db_uri)
-        Model.metadata.create_all(self.engine)
-        self.db = sessionmaker(autoflush=False, bind=self.engine)()
+        self.engine = connect(self.db_uri)
+        upgrade(self.engine)
+        self.sessions = sessionmaker(autoflush=False, bind=self.engine)
+        self.db = self.sessions()
 
         debug('Switched on user database %s', self.db_uri)
 
+    def _open_caches(self):
+        self.packs = Packs(self.archive)
+        self.index = ArchiveIndex(self.archive, packs=self.packs)
+        self.scrapes = ScrapeCache(join(self.userdir, SCRAPES_FILENAME))
+        self.geocodes = GeoCache(join(self.userdir, GEOCODES_FILENAME))
+        self.quota = Quota(GEOCODE_QUOTA, join(self.userdir, GEOCODES_FILENAME))
+        self.checkpoints = CheckpointIndex(self.db.query(Checkpoint))
+
+        debug('Opened %s, %s, %s, %s and %s', self.index, self.scrapes, self.geocodes, self.quota, self.checkpoints)
+
     @property
     def folders(self):
         return [self.archive,
@@ -132,8 +171,14 @@ class Ghost(User):
 
     def flush(self):
         files = [join(self.archive, '*.html'),
+                 join(self.archive, '*.pack'),
+                 join(self.archive, INDEX_FILENAME),
                  join(self.plots, '*.png'),
-                 join(self.userdir, '*.sqlite')]
+                 join(self.exports, '*', '*'),
+                 join(self.userdir, '*.sqlite'),
+                 join(self.userdir, '*.sqlite-wal'),
+                 join(self.userdir, '*.sqlite-shm'),
+                 join(self.userdir, '*.pickle')]
 
         for file in chain(*list(map(glob, files))):
             remove(file)
@@ -0,0 +1,108 @@
+""" Test the analysis module. """
+
+
+from datetime import datetime
+from pytest import importorskip, approx
+
+importorskip('pandas')
+
+from m5.user import Ghost
+from m5.model import Client, Order, Checkpoint, Checkin
+from m5.pipeline import archive
+from m5.analysis import Frames, earnings, distance, jobs_per_weekday, jobs_per_hour, clients
+
+
+def _job(order_id, client_id, day, hour, price, km):
+    address = 'Street %s, 10115 Berlin, Germany' % order_id
+    return [Order(order_id=order_id, client_id=client_id, type='city_tour', date=day, city_tour=price,
+                  extra_stops=None, distance=km, cash=False, user='pytest'),
+            Checkpoint(checkpoint_id=address, lat=52.5, lon=13.4, city='Berlin', postal_code='10115'),
+            Checkin(address=address, order_id=order_id, purpose='pickup',
+                    timestamp=day.replace(hour=hour), after_=None, until=None),
+            Checkin(address=address, order_id=order_id, purpose='dropoff',
+                    timestamp=day.replace(hour=hour + 1), after_=None, until=None)]
+
+
+JOBS = [Client(client_id=1, name='Alpha'), Client(client_id=2, name='Beta')] + \
+    _job(1, 1, datetime(2014, 2, 10), 9, 10.0, 4.0) + \
+    _job(2, 1, datetime(2014, 2, 11), 9, 6.0, 2.0) + \
+    _job(3, 2, datetime(2014, 3, 3), 14, 20.0, 0.0)
+
+
+def test_statistics():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, JOBS)
+
+    frames = Frames.of(user)
+    orders, checkins = frames.orders, frames.checkins
+    assert not frames.is_cached
+    assert len(orders) == 3 and len(checkins) == 6
+
+    assert earnings(orders).tolist() == [16.0, 20.0]
+    weekly = earnings(orders, 'week')
+    assert weekly.tolist() == [16.0, 0.0, 0.0, 20.0]
+    assert weekly.index[0] == datetime(2014, 2, 10)
+
+    totals = distance(orders)
+    assert totals['distance'].tolist() == [6.0, 0.0]
+    assert totals['per_km'].iloc[0] == approx(16.0 / 6.0)
+
+    assert jobs_per_weekday(orders)[['Monday', 'Tuesday', 'Sunday']].tolist() == [2, 1, 0]
+    hours = jobs_per_hour(orders, checkins)
+    assert len(hours) == 24 and hours[9] == 2 and hours[14] == 1 and hours.sum() == 3
+
+    table = clients(orders)
+    assert table.index.tolist() == [2, 1]
+    assert table.loc[1].tolist() == ['Alpha', 2, 16.0, 6.0, approx(16.0 / 36.0)]
+
+    user.clear()
+
+
+def test_clients_with_the_same_name():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, JOBS + [Client(client_id=3, name='Alpha')] + _job(4, 3, datetime(2014, 3, 4), 9, 5.0, 1.0))
+
+    table = clients(Frames.of(user).orders)
+    assert table.index.tolist() == [2, 1, 3]
+    assert table['client'].tolist() == ['Beta', 'Alpha', 'Alpha']
+    assert table['jobs'].tolist() == [1, 2, 1]
+
+    user.clear()
+
+
+def test_frames_are_cached():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, JOBS[:6])
+    assert len(Frames.of(user).orders) == 1
+
+    frames = Frames.of(user)
+    assert len(frames.orders) == 1
+    assert frames.is_cached
+
+    archive(user.db, JOBS)
+    frames = Frames.of(user)
+    assert len(frames.orders) == 3
+    assert not frames.is_cached
+
+    user.clear()
+
+
+def test_broken_cache_is_read_again():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, JOBS)
+    frames = Frames.of(user)
+    assert len(frames.orders) == 3
+
+    with open(frames.filepath, 'r+b') as f:
+        f.truncate(100)
+
+    frames = Frames.of(user)
+    assert len(frames.orders) == 3
+    assert not frames.is_cached
+
+    # The cache was written again
+    frames = Frames.of(user)
+    assert len(frames.orders) == 3
+    assert frames.is_cached
+
+    user.clear()
@@ -0,0 +1,75 @@
+""" Test the export module. """
+
+
+from copy import deepcopy
+from datetime import datetime
+from math import isnan
+from os.path import join
+from pytest import importorskip
+
+from m5.user import Ghost
+from m5.model import Client, Order
+from m5.pipeline import archive
+from m5.export import export, columns, frame, read_manifest
+from tests.test_pipeline import OVERNIGHT_PROCESSED
+
+
+def _strings(view):
+    offsets, content = view
+    return [bytes(content[start:stop]).decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def _order(order_id, type_):
+    return Order(order_id=order_id, client_id=59017, type=type_, date=datetime(2014, 2, 13, 9, 30),
+                 city_tour=5.0, cash=None, user='pytest')
+
+
+def test_export_is_incremental():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    assert export(user.db, user.exports) == {'orders': 0, 'checkins': 0, 'checkpoints': 0}
+    assert read_manifest(join(user.exports, 'orders'))['rows'] == 0
+
+    archive(user.db, deepcopy(OVERNIGHT_PROCESSED))
+    assert export(user.db, user.exports) == {'orders': 1, 'checkins': 2, 'checkpoints': 2}
+    assert export(user.db, user.exports) == {'orders': 0, 'checkins': 0, 'checkpoints': 0}
+
+    # Leftovers of an interrupted export are dropped.
+    with open(join(user.exports, 'orders', 'order_id.bin'), 'ab') as f:
+        f.write(b'\xff' * 8)
+
+    archive(user.db, [Client(client_id=59017, name='Client'), _order(1, 'city_tour'), _order(2, 'overnight')])
+    assert export(user.db, user.exports)['orders'] == 2
+
+    orders = columns(join(user.exports, 'orders'))
+    manifest = read_manifest(join(user.exports, 'orders'))
+    assert manifest['rows'] == 3
+    assert list(orders['order_id']) == [1402120029, 1, 2]
+    assert [manifest['columns']['type']['dictionary'][code] for code in orders['type']] == [
+        'overnight', 'city_tour', 'overnight']
+    assert list(orders['cash']) == [0, -1, -1]
+    assert orders['date'][1] == int((datetime(2014, 2, 13, 9, 30) - datetime(1970, 1, 1)).total_seconds())
+    assert list(orders['city_tour'])[1:] == [5.0, 5.0]
+    assert isnan(orders['distance'][0])
+
+    checkpoints = columns(join(user.exports, 'checkpoints'))
+    assert _strings(checkpoints['checkpoint_id']) == ['Lützowstraße 107, 10785 Berlin, Germany',
+                                                      'Potsdamer Straße 4, 10785 Berlin, Germany']
+    checkins = columns(join(user.exports, 'checkins'))
+    assert sorted(checkins['checkpoint_id']) == sorted(checkpoints['id'])
+
+    user.clear()
+
+
+def test_frame():
+    importorskip('pandas')
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, deepcopy(OVERNIGHT_PROCESSED))
+    export(user.db, user.exports)
+
+    orders = frame(join(user.exports, 'orders'))
+    assert list(orders['type']) == ['overnight']
+    assert orders['date'][0] == datetime(2014, 2, 12)
+    assert frame(join(user.exports, 'checkpoints'))['city'].tolist() == ['Berlin', 'Berlin']
+
+    user.clear()
@@ -0,0 +1,212 @@
+""" Test the geocoder module. """
+
+
+from copy import deepcopy
+from threading import Lock
+from time import monotonic
+from pytest import fixture
+from geopy import Location
+from geopy.exc import GeocoderTimedOut
+
+import m5.pipeline
+from m5.geocoder import GeoCache, BatchGeocoder, TokenBucket, Quota, CheckpointIndex
+from m5.geocoder import normalize, canonical, lookup
+from m5.model import Checkpoint
+from m5.pipeline import geocode, process
+from tests.test_scraper import OVERNIGHT_SCRAPED
+
+
+RAW = {
+    'formatted_address': 'Lützowstraße 107, 10785 Berlin, Germany',
+    'place_id': 'ChIJj6NNFzVQqEcRxpeJsUaDork',
+    'geometry': {'location': {'lat': 52.50201999999999, 'lng': 13.36934}},
+    'address_components': [
+        {'long_name': '107', 'short_name': '107', 'types': ['street_number']},
+        {'long_name': 'Lützowstraße', 'short_name': 'Lützowstraße', 'types': ['route']},
+        {'long_name': 'Berlin', 'short_name': 'Berlin', 'types': ['locality', 'political']},
+        {'long_name': 'Germany', 'short_name': 'DE', 'types': ['country', 'political']},
+        {'long_name': '10785', 'short_name': '10785', 'types': ['postal_code']},
+    ]
+}
+
+POINT = Location(RAW['formatted_address'], (52.50201999999999, 13.36934), RAW)
+ADDRESS = {'address': 'Luetzowstrasse 107', 'locality': '10785 Berlin'}
+
+
+@fixture
+def filepath(tmpdir):
+    return str(tmpdir.join('geocodes.sqlite'))
+
+
+def test_normalized_queries():
+    assert normalize('  Potsdamer Str. 4,\t10785  BERLIN ') == 'potsdamer str. 4, 10785 berlin'
+
+
+def test_canonical_addresses():
+    assert canonical('Lützowstraße 107, 10785 Berlin') == 'luetzowstr 107 10785 berlin'
+    assert canonical('Luetzowstrasse 107,  10785 BERLIN') == 'luetzowstr 107 10785 berlin'
+    assert canonical('Potsdamer Str. 4, 10785 Berlin') == canonical('Potsdamer Straße 4, 10785 Berlin')
+    assert canonical('Prenzlauer Allee 33, 10405 Berlin') == 'prenzlauer allee 33 10405 berlin'
+
+
+def test_cache_survives_restart(filepath):
+    cache = GeoCache(filepath)
+    cache.put('Luetzowstrasse 107, 10785 Berlin', POINT)
+    cache.put('Nowhere 1, 00000 Nirgendwo', None)
+    cache.close()
+
+    cache = GeoCache(filepath)
+    is_known, point = cache.get('luetzowstrasse 107,  10785 BERLIN')
+
+    assert is_known
+    assert point.address == POINT.address
+    assert point.raw == RAW
+    assert (point.latitude, point.longitude) == (POINT.latitude, POINT.longitude)
+    assert cache.get('Nowhere 1, 00000 Nirgendwo') == (True, None)
+    assert cache.get('Somewhere 1, 00000 Irgendwo') == (False, None)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_time_to_live(filepath):
+    cache = GeoCache(filepath, ttl=-1)
+    cache.put('Luetzowstrasse 107, 10785 Berlin', POINT)
+
+    assert cache.get('Luetzowstrasse 107, 10785 Berlin') == (False, None)
+
+
+def test_size_eviction(filepath):
+    cache = GeoCache(filepath, size=2, lru=1)
+
+    cache.put('a', POINT)
+    cache.put('b', POINT)
+    assert 'a' in cache
+    cache.put('c', POINT)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+
+
+def test_cache_hits_skip_google(filepath, monkeypatch):
+    cache = GeoCache(filepath)
+    cache.put('Luetzowstrasse 107, 10785 Berlin', POINT)
+
+    def offline():
+        raise AssertionError('Google should not be asked')
+
+    monkeypatch.setattr(m5.pipeline, 'google', offline)
+
+    assert str(geocode(ADDRESS, cache=cache)) == 'Lützowstraße 107, 10785 Berlin, Germany'
+
+
+class StubGeocoder(object):
+    """ Answer every query with the same point, after timing out a given number of times. """
+
+    def __init__(self, timeouts=0):
+        self.timeouts = timeouts
+        self.queries = []
+        self._lock = Lock()
+
+    def geocode(self, query):
+        with self._lock:
+            self.queries.append(query)
+            if self.timeouts:
+                self.timeouts -= 1
+                raise GeocoderTimedOut('Stub timed out')
+
+        return POINT
+
+
+def test_retry_keeps_the_answer():
+    service = StubGeocoder(timeouts=2)
+
+    assert lookup(service, 'Luetzowstrasse 107, 10785 Berlin', backoff=0) == (True, POINT)
+    assert len(service.queries) == 3
+
+
+def test_retry_gives_up():
+    service = StubGeocoder(timeouts=5)
+
+    assert lookup(service, 'Luetzowstrasse 107, 10785 Berlin', retries=3, backoff=0) == (False, None)
+    assert len(service.queries) == 3
+
+
+def test_batch_asks_once_per_distinct_query(filepath):
+    service = StubGeocoder()
+    cache = GeoCache(filepath)
+    cache.put('Cached 1, 10115 Berlin', None)
+    geocoder = BatchGeocoder(service=service, cache=cache, workers=4, bucket=TokenBucket(rate=1000))
+
+    queries = ['Street %s, 10115 Berlin' % (n % 10) for n in range(50)] + ['Cached 1, 10115 Berlin']
+    points = geocoder.geocode(queries)
+
+    assert len(points) == 11
+    assert points['Cached 1, 10115 Berlin'] is None
+    assert points['Street 3, 10115 Berlin'] is POINT
+    assert sorted(service.queries) == sorted(set(queries) - {'Cached 1, 10115 Berlin'})
+    assert 'Street 3, 10115 Berlin' in cache
+
+
+def test_quota_stops_the_batch(filepath):
+    service = StubGeocoder()
+    quota = Quota(limit=5, filepath=filepath)
+    geocoder = BatchGeocoder(service=service, workers=4, bucket=TokenBucket(rate=1000), quota=quota)
+
+    points = geocoder.geocode('Street %s, 10115 Berlin' % n for n in range(20))
+
+    assert len(service.queries) == 5
+    assert sum(point is not None for point in points.values()) == 5
+    assert geocoder.is_exhausted
+    assert Quota(limit=5, filepath=filepath).remaining == 0
+
+
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(rate=100, burst=1)
+
+    start = monotonic()
+    for _ in range(11):
+        bucket.acquire()
+
+    assert monotonic() - start >= 0.09
+
+
+def test_resolved_points_feed_the_processor(monkeypatch):
+    def offline():
+        raise AssertionError('Google should not be asked')
+
+    monkeypatch.setattr(m5.pipeline, 'google', offline)
+
+    points = {'Luetzowstrasse 107, 10785 Berlin': POINT}
+    rows = process(deepcopy(OVERNIGHT_SCRAPED), points=points)
+    checkpoints = [row for row in rows if isinstance(row, Checkpoint)]
+
+    assert checkpoints[0].checkpoint_id == 'Lützowstraße 107, 10785 Berlin, Germany'
+    assert checkpoints[0].postal_code == '10785'
+    assert checkpoints[1].checkpoint_id == 'Potsdamer Str. 4'
+    assert checkpoints[1].lat is None
+
+
+def test_checkpoints_are_reused(monkeypatch):
+    def offline():
+        raise AssertionError('Google should not be asked')
+
+    monkeypatch.setattr(m5.pipeline, 'google', offline)
+
+    def checkpoints(rows):
+        return [{k: v for k, v in vars(row).items() if not k.startswith('_')}
+                for row in rows if isinstance(row, Checkpoint)]
+
+    job = deepcopy(OVERNIGHT_SCRAPED)
+    first = process(job, points={'Luetzowstrasse 107, 10785 Berlin': POINT})
+    index = CheckpointIndex(row for row in first if isinstance(row, Checkpoint))
+
+    assert len(index) == 1
+    assert 'Lützowstraße 107, 10785 berlin' in index
+
+    job = deepcopy(OVERNIGHT_SCRAPED)
+    job.data.addresses[0].update(address='Lützowstraße 107', locality='10785 BERLIN')
+    second = process(job, is_offline=True, checkpoints=index)
+
+    assert index.hits == 1
+    assert checkpoints(second)[0] == dict(checkpoints(first)[0], as_scraped='Lützowstraße 107, 10785 BERLIN')
+    assert checkpoints(second)[1]['lat'] is None
@@ -0,0 +1,38 @@
+""" Test the index module. """
+
+
+from unittest import TestCase
+from datetime import date
+
+from m5.index import ArchiveIndex
+from m5.user import Ghost
+
+
+class TestArchiveIndex(TestCase):
+    def setUp(self):
+        self.user = Ghost(offline=True).bootstrap().init()
+        self.day = date(2014, 12, 23)
+
+    def tearDown(self):
+        self.user.clear()
+
+    def test_index_is_built_from_archive(self):
+        cached = self.user.index.lookup(date(2014, 12, 1), date(2014, 12, 31))
+        self.assertEqual(cached, {self.day: ['2984702', '2984750', '2985351']})
+
+    def test_new_pages_are_indexed(self):
+        self.user.index.add(date(2014, 12, 24), '1234567', b'<html></html>')
+
+        self.assertEqual(self.user.index.uuids(date(2014, 12, 24)), ['1234567'])
+        self.assertEqual(self.user.index.uuids(date(2014, 12, 25)), [])
+
+    def test_rebuild_keeps_scrape_status(self):
+        self.user.index.mark_scraped(self.day, '2984702')
+        self.user.index.add(date(2014, 12, 24), '1234567', b'<html></html>')
+        self.user.index.close()
+
+        index = ArchiveIndex(self.user.archive)
+        self.assertEqual(index.rebuild(), 3)
+
+        scraped = {uuid: is_scraped for _, uuid, _, _, is_scraped in index.pages()}
+        self.assertEqual(scraped, {'2984702': True, '2984750': False, '2985351': False})
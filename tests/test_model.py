@@ -0,0 +1,97 @@
+""" Test the model module. """
+
+
+from copy import deepcopy
+from datetime import datetime
+from pytest import approx
+
+from m5.user import Ghost
+from m5.model import Client, Order, Checkpoint, Checkin, aggregate
+from m5.pipeline import archive, process
+from tests.test_scraper import OVERNIGHT_SCRAPED
+
+
+ORDERS = [
+    Client(client_id=1, name='Client 1'),
+    Client(client_id=2, name='Client 2'),
+    Order(order_id=1, client_id=1, type='city_tour', date=datetime(2014, 2, 10), city_tour=10.0,
+          extra_stops=2.0, waiting_time=4.0, distance=6.0, cash=True, user='pytest'),
+    Order(order_id=2, client_id=1, type='overnight', date=datetime(2014, 2, 10), overnight=4.0,
+          distance=0.0, cash=False, user='pytest'),
+    Order(order_id=3, client_id=2, type='city_tour', date=datetime(2014, 3, 3), city_tour=30.0,
+          distance=10.0, cash=False, user='pytest'),
+]
+
+# Orders are dated by the day, like in the pipeline: their hour is that of the first pickup.
+PICKUPS = [Checkpoint(checkpoint_id='Street 1, 10115 Berlin, Germany')] + [
+    Checkin(address='Street 1, 10115 Berlin, Germany', order_id=order_id, purpose=purpose, timestamp=timestamp)
+    for order_id, purpose, timestamp in [(1, 'pickup', datetime(2014, 2, 10, 9)),
+                                         (1, 'pickup', datetime(2014, 2, 10, 11)),
+                                         (1, 'dropoff', datetime(2014, 2, 10, 8)),
+                                         (2, 'pickup', datetime(2014, 2, 10, 17)),
+                                         (3, 'pickup', datetime(2014, 3, 3, 9))]]
+
+
+def test_hybrid_metrics():
+    order = ORDERS[2]
+    assert order.price == 12.0
+    assert order.earnings == 16.0
+    assert order.per_km == approx(16.0 / 6.0)
+    assert order.wait_share == 0.25
+    assert ORDERS[3].per_km is None
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, ORDERS)
+
+    assert [o.order_id for o in user.db.query(Order).filter(Order.price > 5).order_by(Order.price.desc())] == [3, 1]
+    assert user.db.query(Order.order_id).filter(Order.per_km.is_(None)).all() == [(2,)]
+    assert user.db.query(Order.wait_share).filter(Order.order_id == 1).scalar() == 0.25
+
+    user.clear()
+
+
+def test_aggregate():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, ORDERS + PICKUPS)
+
+    assert aggregate(user.db) == [(3, 50.0)]
+    assert aggregate(user.db, 'month', ('jobs', 'price', 'earnings', 'distance')) == [
+        ('2014-02', 2, 16.0, 20.0, 6.0), ('2014-03', 1, 30.0, 30.0, 10.0)]
+
+    metrics = ('earnings', 'per_km', 'wait_share', 'cash_share')
+    rows = aggregate(user.db, ('client',), metrics, order_by='earnings', descending=True)
+    assert [(row.client, row.earnings) for row in rows] == [(2, 30.0), (1, 20.0)]
+    assert rows[1].per_km == approx(20.0 / 6.0)
+    assert rows[1].cash_share == 0.5
+
+    # The share of the total, not the mean of the shares of each order
+    assert rows[1].wait_share == approx(4.0 / 20.0)
+
+    assert aggregate(user.db, ('weekday', 'hour'), ('jobs',), where=[Order.type == 'city_tour']) == [
+        (1, 9, 2)]
+    assert aggregate(user.db, 'hour', ('jobs',)) == [(9, 2), (17, 1)]
+    assert aggregate(user.db, 'type', ('jobs',), order_by=Order.type, limit=1) == [('city_tour', 2)]
+    assert aggregate(user.db, 'week', ('jobs',)) == [('2014-02-10', 2), ('2014-03-03', 1)]
+
+    user.clear()
+
+
+def test_weeks_across_new_year():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, [ORDERS[0]] + [Order(order_id=n, client_id=1, date=datetime(*day), user='pytest')
+                                    for n, day in enumerate([(2014, 12, 29), (2015, 1, 2), (2015, 1, 4),
+                                                             (2015, 1, 5)])])
+
+    assert aggregate(user.db, 'week', ('jobs',)) == [('2014-12-29', 3), ('2015-01-05', 1)]
+
+    user.clear()
+
+
+def test_aggregate_processed_jobs():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True))
+
+    # Picked up on Wednesday 12 February 2014 at 10:57
+    assert aggregate(user.db, ('day', 'weekday', 'hour'), ('jobs',)) == [('2014-02-12', 3, 10, 1)]
+
+    user.clear()
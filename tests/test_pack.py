@@ -0,0 +1,47 @@
+""" Test the pack module. """
+
+
+from unittest import TestCase
+from datetime import date
+from os import listdir
+from os.path import join
+
+from m5.pack import Pack, pack_archive
+from m5.spider import download
+from m5.user import Ghost
+
+
+class TestPack(TestCase):
+    def setUp(self):
+        self.user = Ghost(offline=True).bootstrap().init()
+        self.day = date(2014, 12, 23)
+
+    def tearDown(self):
+        self.user.clear()
+
+    def test_random_access(self):
+        filepath = join(self.user.archive, '2014-12.pack')
+        pack = Pack(filepath)
+
+        pack.put(self.day, '1111111', b'first')
+        pack.put(date(2014, 12, 24), '2222222', b'second' * 100)
+        pack.put(self.day, '1111111', b'first again')
+        pack.close()
+
+        pack = Pack(filepath)
+        self.assertEqual(len(pack), 2)
+        self.assertEqual(pack.get(date(2014, 12, 24), '2222222'), b'second' * 100)
+        self.assertEqual(pack.get(self.day, '1111111'), b'first again')
+        self.assertIsNone(pack.get(self.day, '3333333'))
+
+    def test_convert_archive(self):
+        before = [job.data.content for job in download(self.day, self.user)]
+
+        self.assertEqual(pack_archive(self.user.archive, packs=self.user.packs), 3)
+        self.assertNotIn('2014-12-23-uuid-2984702.html', listdir(self.user.archive))
+        self.assertIn('2014-12.pack', listdir(self.user.archive))
+
+        after = [job.data.content for job in download(self.day, self.user)]
+        self.assertEqual(before, after)
+
+        self.assertEqual(self.user.index.rebuild(), 3)
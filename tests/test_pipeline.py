@@ -1,12 +1,14 @@
 """ Test the pipeline module. """
 
 
+from copy import deepcopy
 from pytest import mark
 from datetime import date, datetime
 
 from m5.user import Ghost
-from m5.model import Client, Order, Checkpoint, Checkin
-from m5.pipeline import process, geocode, archive
+from m5.model import Client, Order, Checkpoint, Checkin, Record
+from m5.postcodes import berlin
+from m5.pipeline import process, geocode, archive, bulk_archive, ArchivedKeys
 from tests.test_scraper import OVERNIGHT_SCRAPED
 
 
@@ -49,7 +51,7 @@ OVERNIGHT_PROCESSED = (
         ),
         Checkin(
             timestamp=datetime(2014, 2, 12, 10, 57),
-            checkpoint_id='Lützowstraße 107, 10785 Berlin, Germany',
+            address='Lützowstraße 107, 10785 Berlin, Germany',
             order_id=1402120029,
             purpose='pickup',
             after_=datetime(2014, 2, 12, 7),
@@ -71,7 +73,7 @@ OVERNIGHT_PROCESSED = (
         ),
         Checkin(
             timestamp=datetime(2014, 2, 12, 11, 9),
-            checkpoint_id='Potsdamer Straße 4, 10785 Berlin, Germany',
+            address='Potsdamer Straße 4, 10785 Berlin, Germany',
             order_id=1402120029,
             purpose='dropoff',
             after_=datetime(2014, 2, 12, 8),
@@ -118,3 +120,106 @@ def test_archiver():
     assert user.db.query(Order.id).scalar() == 1402120029
 
     user.clear()
+
+
+def _dump(user):
+    return {model.__tablename__: sorted(tuple(row) for row in user.db.execute(model.__table__.select()))
+            for model in (Client, Order, Checkpoint, Checkin)}
+
+
+def test_bulk_archiver():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    assert archive(user.db, OVERNIGHT_PROCESSED) == (6, 0)
+    expected = _dump(user)
+    user.clear()
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    rows = list(OVERNIGHT_PROCESSED) + list(OVERNIGHT_PROCESSED[2:4])
+
+    assert bulk_archive(user.db, rows) == (6, 2)
+    assert _dump(user) == expected
+    assert bulk_archive(user.db, OVERNIGHT_PROCESSED) == (0, 6)
+    assert _dump(user) == expected
+
+    user.clear()
+
+
+def test_bulk_archiver_falls_back_on_errors():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    prices = ('city_tour', 'overnight', 'loading_service', 'fax_confirm',
+              'extra_stops', 'cancelled_stop', 'client_support')
+    orphan = Order(order_id=1, client_id=None, **dict.fromkeys(prices, 0))
+
+    assert bulk_archive(user.db, list(OVERNIGHT_PROCESSED) + [orphan]) == (6, 1)
+    assert user.db.query(Order).count() == 1
+
+    user.clear()
+
+
+def test_archived_keys():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, OVERNIGHT_PROCESSED[:4])
+
+    keys = ArchivedKeys(user.db)
+    assert len(keys) == 4
+    assert keys.known(Client.__table__, (59017,))
+    assert keys.known(Checkpoint.__table__, ('Lützowstraße 107, 10785 Berlin, Germany',))
+    assert keys.known(Checkin.__table__, (OVERNIGHT_PROCESSED[3].checkin_id,))
+    assert not keys.known(Checkin.__table__, (OVERNIGHT_PROCESSED[5].checkin_id,))
+
+    assert bulk_archive(user.db, OVERNIGHT_PROCESSED, keys=keys) == (2, 4)
+    assert len(keys) == 6
+    assert bulk_archive(user.db, OVERNIGHT_PROCESSED, keys=keys) == (0, 6)
+    assert len(user.db.query(Checkin).all()) == 2
+
+    user.clear()
+
+
+def _columns(row):
+    return type(row).__name__, {k: v for k, v in vars(row).items() if not k.startswith('_')}
+
+
+def test_records_match_models():
+    models = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True, postcodes=berlin())
+    records = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True, postcodes=berlin(), records=True)
+
+    assert all(isinstance(record, Record) and not hasattr(record, '__dict__') for record in records)
+    assert [_columns(record.to_model()) for record in records] == [_columns(model) for model in models]
+
+
+def test_archive_records():
+    records = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True, records=True)
+    models = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True)
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, models)
+    expected = _dump(user)
+    user.clear()
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    assert bulk_archive(user.db, records) == (len(records), 0)
+    assert _dump(user) == expected
+    user.clear()
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    assert archive(user.db, records) == (len(records), 0)
+    assert _dump(user) == expected
+    user.clear()
+
+
+def test_checkins_point_at_checkpoints_by_id():
+    models = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True)
+    checkins = [model for model in models if isinstance(model, Checkin)]
+
+    assert [checkin.address for checkin in checkins] == [model.checkpoint_id for model in models
+                                                         if isinstance(model, Checkpoint)]
+    assert all(checkin.checkpoint_id is None for checkin in checkins)
+
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, models)
+
+    ids = {checkpoint.checkpoint_id: checkpoint.id for checkpoint in user.db.query(Checkpoint)}
+    archived = {checkin.checkin_id: checkin.checkpoint_id for checkin in user.db.query(Checkin)}
+    assert archived == {checkin.checkin_id: ids[checkin.address] for checkin in checkins}
+
+    user.clear()
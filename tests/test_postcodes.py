@@ -0,0 +1,64 @@
+""" Test the postcodes module. """
+
+
+from copy import deepcopy
+from geopy import Location
+
+from m5.model import Checkpoint
+from m5.pipeline import process
+from m5.postcodes import berlin, read_records, contains, centroid
+from m5.settings import DBF_FILEPATH
+from tests.test_scraper import OVERNIGHT_SCRAPED
+from tests.test_geocoder import POINT
+
+
+SQUARE = [[(0, 0), (0, 2), (2, 2), (2, 0)], [(0.5, 0.5), (1.5, 0.5), (1.5, 1.5), (0.5, 1.5)]]
+
+
+def test_read_records():
+    records = list(read_records(DBF_FILEPATH))
+
+    assert len(records) == 190
+    assert records[0] == {'PLZ99': '10115', 'PLZ99_N': 10115, 'PLZORT99': 'Berlin (stl. Stadtbezirke)'}
+
+
+def test_polygon_with_a_hole():
+    assert contains(SQUARE, 0.25, 1)
+    assert not contains(SQUARE, 1, 1)
+    assert not contains(SQUARE, 3, 1)
+    assert centroid(SQUARE[:1]) == (1, 1)
+
+
+def test_locate():
+    assert len(berlin().postcodes) == 190
+    assert berlin().locate(POINT.latitude, POINT.longitude) == '10785'
+    assert berlin().locate(48.137, 11.575) is None
+
+
+def test_centroid_fallback():
+    point = berlin().geocode({'address': 'Luetzowstrasse 107', 'locality': '10785 Berlin'})
+
+    assert point.address == 'Luetzowstrasse 107'
+    assert berlin().locate(point.latitude, point.longitude) == '10785'
+    assert berlin().geocode({'address': 'Marienplatz 1', 'locality': '80331 München'}) is None
+
+
+def test_check_google_results():
+    address = {'address': 'Luetzowstrasse 107', 'locality': '10785 Berlin'}
+    munich = Location('Marienplatz 1, 80331 München, Germany', (48.137, 11.575), {})
+
+    fallback = berlin().check(address, munich)
+
+    assert berlin().check(address, POINT) is POINT
+    assert berlin().locate(fallback.latitude, fallback.longitude) == '10785'
+    assert berlin().check({'address': 'Marienplatz 1', 'locality': '80331 München'}, munich) is munich
+
+
+def test_offline_checkpoints_are_mappable():
+    rows = process(deepcopy(OVERNIGHT_SCRAPED), is_offline=True, postcodes=berlin())
+    checkpoints = [row for row in rows if isinstance(row, Checkpoint)]
+
+    assert all(checkpoint.lat and checkpoint.lon for checkpoint in checkpoints)
+    assert [checkpoint.postal_code for checkpoint in checkpoints] == ['10785', '10785']
+    assert checkpoints[0].checkpoint_id == 'Luetzowstrasse 107'
+    assert checkpoints[0].place_id is None
@@ -5,10 +5,11 @@ from datetime import date
 from bs4 import BeautifulSoup
 from os.path import join
 from pytest import mark
+from pickle import dumps, loads
 
-from m5.scraper import scrape, fix_unicode
+from m5.scraper import scrape, fix_unicode, compile_plan, failures, ScrapeCache, PRICE_CATEGORIES, BLUEPRINTS
 from m5.settings import ASSETS_DIR
-from m5.spider import Stamp, Stamped, RawData
+from m5.spider import Stamp, Stamped, RawData, Webpage
 
 
 OVERNIGHT_SCRAPED = Stamped(
@@ -164,6 +165,33 @@ def test_scraper(filename, expected):
     assert result.data.addresses == expected.data.addresses
 
 
+@mark.parametrize('filename, expected', SCRAPED)
+def test_scraper_parses_raw_webpages(filename, expected):
+
+    with open(join(ASSETS_DIR, filename), 'rb') as f:
+        webpage = Webpage(f.read())
+
+    job = Stamped(expected.stamp, webpage)
+    assert webpage._soup is None
+
+    result = scrape(job, fast=False)
+
+    assert result.data == expected.data
+    assert isinstance(webpage._soup, BeautifulSoup)
+
+
+@mark.parametrize('filename, expected', SCRAPED)
+def test_fast_scraper(filename, expected):
+
+    with open(join(ASSETS_DIR, filename), 'rb') as f:
+        webpage = Webpage(f.read())
+
+    result = scrape(Stamped(expected.stamp, webpage), fast=True)
+
+    assert result.data == expected.data
+    assert webpage._soup is None
+
+
 def test_unicode_correction():
     original_tokens = [
         'KurfÃ¼rstenstraÃe',
@@ -185,3 +213,45 @@ def test_unicode_correction():
 
     for original, final in zip(original_tokens, final_tokens):
         assert final == fix_unicode(original)
+
+
+def test_compiled_price_labels():
+    plan = compile_plan(price_categories=dict(PRICE_CATEGORIES, duplicate={'Ladehilfe'}))
+
+    for category, labels in PRICE_CATEGORIES.items():
+        for label in labels:
+            assert category in plan.labels[label]
+
+    assert plan.labels['Ladehilfe'] == ('loading_service', 'duplicate')
+
+
+def test_failure_counts():
+    assert failures(OVERNIGHT_SCRAPED.data) == []
+
+    info = dict(OVERNIGHT_SCRAPED.data.info, client_id=None, km=None, overnight=[])
+    addresses = [dict(address, timestamp=None) for address in OVERNIGHT_SCRAPED.data.addresses]
+
+    assert failures(RawData(info, addresses)) == ['client_id', 'prices', 'timestamp', 'timestamp']
+
+
+def test_scrape_cache(tmpdir):
+    filename, expected = SCRAPED[0]
+    filepath = str(tmpdir.join('scrapes.sqlite'))
+    cache = ScrapeCache(filepath)
+
+    with open(join(ASSETS_DIR, filename), 'rb') as f:
+        content = f.read()
+
+    first = scrape(Stamped(expected.stamp, Webpage(content)), cache=cache)
+    webpage = Webpage(content)
+    second = scrape(Stamped(expected.stamp, webpage), cache=loads(dumps(cache)))
+
+    assert first.data == second.data == expected.data
+    assert webpage._soup is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    blueprints = dict(BLUEPRINTS, header=dict(BLUEPRINTS['header']))
+    blueprints['header'].pop('cash')
+    cache = ScrapeCache(filepath, version=compile_plan(blueprints=blueprints).version)
+
+    assert cache.get(webpage.digest) is None
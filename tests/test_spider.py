@@ -3,12 +3,38 @@
 
 from unittest import TestCase, skipIf
 from os.path import join, isfile
-from datetime import date
+from datetime import date, timedelta
+from collections import namedtuple
 from bs4 import BeautifulSoup
 
-from m5.spider import download
+from m5.spider import download, download_range, Webpage
 from m5.user import Ghost
-from m5.settings import USERNAME, PASSWORD, CREDENTIALS_WARNING as WARN
+from m5.settings import USERNAME, PASSWORD, CREDENTIALS_WARNING as WARN, SUMMARY_URL
+
+
+Response = namedtuple('Response', ('text', 'content', 'status_code'))
+
+LOGIN_PAGE = '<form action="ll.php5" method="post"><input name="username"><input name="password"></form>'
+
+
+class FakeWebsite(object):
+    def __init__(self, jobs, is_logged_in=True):
+        self.jobs = jobs
+        self.is_logged_in = is_logged_in
+        self.summaries = 0
+
+    def get(self, url, params=None):
+        if url == SUMMARY_URL:
+            self.summaries += 1
+            if not self.is_logged_in:
+                return Response(LOGIN_PAGE, LOGIN_PAGE.encode(), 200)
+            uuids = self.jobs.get(params['datum'], [])
+            html = '<a href="/index.php5?logout=1"><a href="ll.php5?status=delivered&datum=%s">' % params['datum']
+            html += ' '.join('<a href="ll_detail.php5?uuid=%s">' % uuid for uuid in uuids)
+        else:
+            html = '<html><body>%s</body></html>' % url
+
+        return Response(html, html.encode(), 200)
 
 
 class TestSpider(TestCase):
@@ -17,12 +43,62 @@ class TestSpider(TestCase):
 
     def tearDown(self):
         self.user.clear()
-        self.user.logout()
+        if not isinstance(self.user.web, FakeWebsite):
+            self.user.logout()
+
+    def _fake_website(self, jobs, is_logged_in=True):
+        self.user = Ghost(offline=True).bootstrap().init()
+        self.user.offline = False
+        self.user.web = FakeWebsite(jobs, is_logged_in)
 
     def test_load_one_day_from_cache(self):
         self.user = Ghost(offline=True).bootstrap().init()
         self._check()
 
+    def test_load_day_range_from_cache(self):
+        self.user = Ghost(offline=True).bootstrap().init()
+        days = date(2014, 12, 21), date(2014, 12, 26)
+
+        concurrent = list(download_range(*days, user=self.user, workers=4))
+        sequential = list(download(self.day, self.user))
+
+        self.assertEqual([job.stamp for job in concurrent], [job.stamp for job in sequential])
+        self.assertEqual(len({job.stamp.uuid for job in concurrent}), 3)
+
+    def test_remember_empty_and_complete_days(self):
+        self._fake_website({'23.12.2014': ['2984702', '2984750', '2985351', '2999999']})
+
+        days = date(2014, 12, 21), date(2014, 12, 25)
+
+        self.assertEqual(len(list(download_range(*days, user=self.user, workers=2))), 4)
+        self.assertEqual(self.user.web.summaries, 4)
+        self.assertTrue(isfile(join(self.user.archive, '2014-12-23-uuid-2999999.html')))
+
+        self.assertEqual(len(list(download_range(*days, user=self.user, workers=2))), 4)
+        self.assertEqual(len(list(download(self.day, self.user))), 4)
+        self.assertEqual(self.user.web.summaries, 4)
+
+    def test_do_not_mark_days_without_a_summary_page(self):
+        self._fake_website({'21.12.2014': ['2984702']}, is_logged_in=False)
+        days = date(2014, 12, 21), date(2014, 12, 22)
+
+        self.assertEqual(list(download_range(*days, user=self.user, workers=2)), [])
+        self.assertIsNone(self.user.index.status(days[0]))
+
+        # Once logged in again, the day is asked for and downloaded.
+        self.user.web.is_logged_in = True
+        self.assertEqual(len(list(download_range(*days, user=self.user, workers=2))), 1)
+        self.assertEqual(self.user.web.summaries, 2)
+
+    def test_always_recheck_recent_days(self):
+        self._fake_website({})
+
+        yesterday = date.today() - timedelta(days=1)
+
+        for _ in range(2):
+            self.assertEqual(list(download(yesterday, self.user)), [])
+        self.assertEqual(self.user.web.summaries, 2)
+
     @skipIf(not USERNAME or not PASSWORD, WARN)
     def test_download_one_day(self):
         self.user = Ghost().bootstrap().flush().init()
@@ -38,7 +114,8 @@ class TestSpider(TestCase):
         ]
 
         for soup in self.soups:
-            self.assertIsInstance(soup.data, BeautifulSoup)
+            self.assertIsInstance(soup.data, Webpage)
+            self.assertIsInstance(soup.data.soup, BeautifulSoup)
 
         for file_path in expected_files:
             self.assertTrue(isfile(file_path))
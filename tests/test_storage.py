@@ -0,0 +1,95 @@
+""" Test the storage module. """
+
+
+from sqlalchemy import inspect
+
+from m5.model import Model, Client, SCHEMA_VERSION
+from m5.storage import connect, upgrade
+
+
+INDEXES = ['ix_checkins_checkpoint_id', 'ix_checkins_order_id', 'ix_orders_client_id', 'ix_orders_date', 'ix_orders_user']
+
+
+def _indexes(engine):
+    return sorted(index['name'] for table in Model.metadata.sorted_tables
+                  for index in inspect(engine).get_indexes(table.name))
+
+
+def test_pragmas(tmpdir):
+    engine = connect('sqlite:///' + str(tmpdir.join('m5.sqlite')))
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+
+
+def test_new_database(tmpdir):
+    engine = connect('sqlite:///' + str(tmpdir.join('m5.sqlite')))
+
+    assert upgrade(engine) == []
+    assert _indexes(engine) == INDEXES
+
+
+def test_upgrade_in_place(tmpdir):
+    engine = connect('sqlite:///' + str(tmpdir.join('m5.sqlite')))
+
+    # A database from before the indexes
+    Model.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in INDEXES:
+            connection.exec_driver_sql('DROP INDEX %s' % index)
+        connection.execute(Client.__table__.insert(), [{'client_id': 1, 'name': 'Client'}])
+
+    assert _indexes(engine) == []
+    assert sorted(upgrade(engine)) == INDEXES
+    assert _indexes(engine) == INDEXES
+    assert upgrade(engine) == []
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM clients').scalar() == 1
+
+
+V1 = [
+    'CREATE TABLE clients (client_id INTEGER PRIMARY KEY, name TEXT)',
+    'CREATE TABLE checkpoints (checkpoint_id TEXT PRIMARY KEY, lat FLOAT, lon FLOAT, city TEXT, '
+    'postal_code TEXT, street_name TEXT, street_number TEXT, country_code TEXT, country TEXT, '
+    'company TEXT, as_scraped TEXT, place_id TEXT)',
+    'CREATE TABLE orders (order_id INTEGER PRIMARY KEY, client_id INTEGER, type TEXT, city_tour FLOAT, '
+    'overnight FLOAT, waiting_time FLOAT, extra_stops FLOAT, fax_confirm FLOAT, cancelled_stop FLOAT, '
+    'loading_service FLOAT, client_support FLOAT, distance FLOAT, cash BOOLEAN, date DATETIME, uuid INTEGER, '
+    'user TEXT)',
+    'CREATE TABLE checkins (checkin_id VARCHAR PRIMARY KEY, '
+    'checkpoint_id INTEGER NOT NULL REFERENCES checkpoints (checkpoint_id), '
+    'order_id INTEGER NOT NULL REFERENCES orders (order_id), purpose TEXT, timestamp DATETIME, '
+    'after_ DATETIME, until DATETIME)',
+    'CREATE INDEX ix_checkins_checkpoint_id ON checkins (checkpoint_id)',
+    "INSERT INTO clients VALUES (1, 'Client')",
+    "INSERT INTO checkpoints (checkpoint_id, lat, lon) VALUES ('Street 1, 10115 Berlin', 52.5, 13.4)",
+    "INSERT INTO checkpoints (checkpoint_id, lat, lon) VALUES ('Street 2, 10115 Berlin', 52.6, 13.5)",
+    "INSERT INTO orders (order_id, client_id, user) VALUES (7, 1, 'bob')",
+    "INSERT INTO checkins (checkin_id, checkpoint_id, order_id, purpose) VALUES ('a', 'Street 2, 10115 Berlin', 7, 'pickup')",
+    "INSERT INTO checkins (checkin_id, checkpoint_id, order_id, purpose) VALUES ('b', 'Street 1, 10115 Berlin', 7, 'dropoff')",
+    "INSERT INTO checkins (checkin_id, checkpoint_id, order_id, purpose) VALUES ('c', 'Nowhere', 7, 'dropoff')",
+]
+
+
+def test_surrogate_keys_migration(tmpdir):
+    engine = connect('sqlite:///' + str(tmpdir.join('m5.sqlite')))
+
+    with engine.begin() as connection:
+        for statement in V1:
+            connection.exec_driver_sql(statement)
+
+    upgrade(engine)
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA user_version').scalar() == SCHEMA_VERSION
+        assert connection.exec_driver_sql('SELECT id, checkpoint_id, lat FROM checkpoints ORDER BY id').all() == [
+            (1, 'Street 1, 10115 Berlin', 52.5), (2, 'Street 2, 10115 Berlin', 52.6)]
+        assert connection.exec_driver_sql('SELECT checkin_id, checkpoint_id, purpose FROM checkins ORDER BY id').all() == [
+            ('a', 2, 'pickup'), ('b', 1, 'dropoff')]
+        assert connection.exec_driver_sql('SELECT COUNT(*) FROM orders').scalar() == 1
+
+    assert 'checkpoints_v1' not in inspect(engine).get_table_names()
+    assert _indexes(engine) == INDEXES
+    assert upgrade(engine) == []
@@ -0,0 +1,57 @@
+""" Test the stream module. """
+
+
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import date
+
+from m5.geocoder import query
+from m5.model import Order, Checkin, Checkpoint
+from m5.scraper import scrape
+from m5.spider import download
+from m5.stream import stream, two_pass
+from m5.user import Ghost
+from tests.test_geocoder import StubGeocoder
+
+
+class TestStream(TestCase):
+    def setUp(self):
+        self.user = Ghost(offline=True).bootstrap().init()
+        self.day = date(2014, 12, 23)
+
+    def tearDown(self):
+        self.user.clear()
+
+    def test_stream_with_pools(self):
+        self._check(scrapers=2, geocoders=2)
+
+    def test_stream_inline(self):
+        self._check(scrapers=0, geocoders=0)
+
+    def test_stream_row_by_row(self):
+        self._check(scrapers=0, geocoders=0, bulk=False, archivesize=1)
+
+    def test_two_pass_offline(self):
+        self._check(migration=two_pass, scrapers=2, geocoders=2)
+
+    def test_two_pass_geocodes_each_address_once(self):
+        webpages = list(download(self.day, self.user))
+        queries = {query(address) for webpage in webpages for address in scrape(webpage).data.addresses}
+        service = StubGeocoder()
+        self.user.offline = False
+
+        with patch('m5.geocoder.google', return_value=service):
+            jobs = list(two_pass(webpages, self.user, scrapers=0, geocoders=2, buffer=2, chunksize=2))
+
+        self.assertEqual(len(jobs), 3)
+        self.assertEqual(sorted(service.queries), sorted(queries))
+        self.assertTrue(all(checkpoint.lat for checkpoint in self.user.db.query(Checkpoint)))
+
+    def _check(self, migration=stream, **stages):
+        jobs = list(migration(download(self.day, self.user), self.user, buffer=2, chunksize=2, **stages))
+
+        self.assertEqual([job.stamp.uuid for job in jobs], ['2984702', '2984750', '2985351'])
+        self.assertEqual(len(self.user.db.identity_map), 0)
+        self.assertEqual(self.user.db.query(Order).count(), 3)
+        self.assertTrue(self.user.db.query(Checkin).count() >= 6)
+        self.assertTrue(all(scraped for *_, scraped in self.user.index.pages()))
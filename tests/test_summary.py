@@ -0,0 +1,73 @@
+""" Test the summary module. """
+
+
+from copy import deepcopy
+from datetime import date, datetime
+
+from m5.user import Ghost
+from m5.model import Client, Order
+from m5.pipeline import archive, bulk_archive
+from m5.summary import GRAINS, rebuild, summary
+from m5.storage import connect, upgrade
+from tests.test_pipeline import OVERNIGHT_PROCESSED
+
+
+def _order(order_id, day, price, client_id=59017, cash=False, type_='city_tour'):
+    return Order(order_id=order_id, client_id=client_id, date=day, city_tour=price, distance=2.0,
+                 cash=cash, type=type_, uuid=order_id, user='pytest')
+
+
+def _summaries(db):
+    return {grain: [tuple(row) for row in summary(db, grain)] for grain in GRAINS}
+
+
+def test_archive_updates_summaries():
+    user = Ghost(offline=True).bootstrap().flush().init()
+    archive(user.db, deepcopy(OVERNIGHT_PROCESSED))
+
+    day, = summary(user.db, 'day')
+    assert day.day == date(2014, 2, 12)
+    assert (day.jobs, day.overnight, day.price, day.cash_share) == (1, 4.20, 4.20, 0)
+
+    # Archiving the same order again does not count it twice.
+    archive(user.db, deepcopy(OVERNIGHT_PROCESSED))
+    assert summary(user.db, 'day') == [day]
+
+    rows = [Client(client_id=59017, name='Client'),
+            _order(1, datetime(2014, 2, 12, 9), 10.0, cash=True),
+            _order(2, datetime(2014, 2, 17, 9), 5.0),
+            _order(1402120029, datetime(2014, 2, 12), 6.0, type_='overnight')]
+    bulk_archive(user.db, rows)
+
+    # The rewritten order keeps its overnight price and gains a city tour.
+    assert [(row.day, row.jobs, row.price, row.cash_share) for row in summary(user.db, 'day')] == [
+        (date(2014, 2, 12), 2, 10.0 + 4.2 + 6.0, 0.5), (date(2014, 2, 17), 1, 5.0, 0)]
+    assert [(row.week, row.jobs) for row in summary(user.db, 'week')] == [
+        (date(2014, 2, 10), 2), (date(2014, 2, 17), 1)]
+    assert [(row.month, row.jobs, row.distance) for row in summary(user.db, 'month')] == [
+        (date(2014, 2, 1), 3, 6.0)]
+    assert [(row.client_id, row.jobs) for row in summary(user.db, 'client')] == [(59017, 3)]
+    assert [(row.type, row.jobs) for row in summary(user.db, 'type')] == [('city_tour', 2), ('overnight', 1)]
+
+    incremental = _summaries(user.db)
+    assert rebuild(user.db) == 3
+    user.db.commit()
+    assert _summaries(user.db) == incremental
+
+    user.clear()
+
+
+def test_upgrade_fills_summaries(tmpdir):
+    engine = connect('sqlite:///' + str(tmpdir.join('m5.sqlite')))
+
+    with engine.begin() as connection:
+        for table in (Client.__table__, Order.__table__):
+            table.create(connection)
+        connection.execute(Client.__table__.insert(), [{'client_id': 1, 'name': 'Client'}])
+        connection.execute(Order.__table__.insert(), [{'order_id': 1, 'client_id': 1, 'city_tour': 3.0,
+                                                       'date': datetime(2014, 2, 12), 'type': 'city_tour'}])
+
+    upgrade(engine)
+
+    with engine.connect() as connection:
+        assert [(row.client_id, row.jobs, row.price) for row in summary(connection, 'client')] == [(1, 1, 3.0)]